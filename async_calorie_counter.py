@@ -0,0 +1,676 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import calorie_counter
+import deadlines
+from calorie_counter import AccurateCalorieCounter
+from corrections import apply_corrections, corrections_applied
+from deadlines import DeadlineExceeded, deadline_at, deadline_scope
+from instrumentation import (aiterate_in_context, collect_timings, count, record_tokens, span, summarize_timings,
+                             usda_retries)
+from quota import BATCH, priority_scope
+from single_flight import AsyncSingleFlight
+from streaming_json import StreamingArrayParser
+
+try:
+    import httpx
+except ImportError:  # httpx is only needed for the asyncio variant
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# 429s are not retried here but handed to the quota scheduler
+_RETRY_STATUSES = {500, 502, 503, 504}
+
+# httpx transport for the FoodData Central clients counters create (None: httpx's default);
+# cassettes.py swaps in recording and replaying transports
+usda_transport = None
+
+
+class AsyncAccurateCalorieCounter(AccurateCalorieCounter):
+    """asyncio variant of AccurateCalorieCounter with the same result schema.
+
+    Gemini calls use ``generate_content_async`` and FoodData Central requests use a pooled
+    ``httpx.AsyncClient``, so one event loop can serve many concurrent analyses without a thread
+    per request. Caches, the offline FDC index and image preprocessing are shared with the
+    synchronous counter.
+    """
+
+    def __init__(self, *args, http_client: Optional["httpx.AsyncClient"] = None, **kwargs):
+        if httpx is None and http_client is None:
+            raise ImportError("AsyncAccurateCalorieCounter requires httpx (pip install httpx)")
+        super().__init__(*args, **kwargs)
+        self._http_client = http_client
+        self.usda_flight = AsyncSingleFlight("usda_search", enabled=calorie_counter.SINGLE_FLIGHT)
+        self.estimate_flight = AsyncSingleFlight("gemini_estimate", enabled=calorie_counter.SINGLE_FLIGHT)
+        self._owns_http_client = http_client is None
+
+    async def __aenter__(self) -> "AsyncAccurateCalorieCounter":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        if self._http_client is not None and self._owns_http_client:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    @property
+    def http_client(self) -> "httpx.AsyncClient":
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(
+                timeout=10,
+                transport=usda_transport,
+                limits=httpx.Limits(max_connections=calorie_counter.USDA_POOL_SIZE,
+                                    max_keepalive_connections=calorie_counter.USDA_POOL_SIZE)
+            )
+        return self._http_client
+
+    async def warmup(self, gemini: bool = True, usda: bool = True) -> Dict:
+        """Async counterpart of AccurateCalorieCounter.warmup; the USDA connection is opened on http_client."""
+        loop = asyncio.get_running_loop()
+        timings = await loop.run_in_executor(None, functools.partial(super().warmup, gemini=gemini, usda=False))
+        if usda:
+            started = time.perf_counter()
+            try:
+                await self.http_client.head(calorie_counter.USDA_API_BASE_URL,
+                                            params={"api_key": calorie_counter.USDA_API_KEY}, timeout=5)
+            except httpx.HTTPError as e:
+                logger.warning(f"Warmup step usda_connection failed: {e}")
+            timings["usda_connection"] = round(time.perf_counter() - started, 4)
+        return timings
+
+    async def _usda_request(self, method: str, url: str, params: Optional[Dict] = None, **kwargs) -> "httpx.Response":
+        """Send a FoodData Central request within the key quota.
+
+        5xx responses and timeouts are retried with jittered backoff; a 429 goes back to the
+        quota scheduler, which backs off that key and retries on the next free one.
+        """
+        endpoint = "search" if url.endswith("/search") else "details"
+
+        async def send(api_key: Optional[str]) -> "httpx.Response":
+            return await self._send_usda_request(method, url, endpoint, params=dict(params or {}, api_key=api_key),
+                                                 **kwargs)
+        return await self.usda_quota.call_async(send, name=f"usda.{endpoint}")
+
+    async def _send_usda_request(self, method: str, url: str, endpoint: str, **kwargs) -> "httpx.Response":
+        for attempt in range(calorie_counter.USDA_MAX_RETRIES + 1):
+            if deadlines.remaining() is not None:
+                # Each attempt gets what is left of the request deadline; none are started once it has passed
+                kwargs["timeout"] = deadlines.timeout_for(10, name=f"usda.{endpoint}")
+            try:
+                response = self._check_rate_limit(await self.http_client.request(method, url, **kwargs))
+                if response.status_code not in _RETRY_STATUSES or attempt == calorie_counter.USDA_MAX_RETRIES:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else 0.5 * (2 ** attempt)
+            except (httpx.TimeoutException, httpx.TransportError):
+                if attempt == calorie_counter.USDA_MAX_RETRIES:
+                    raise
+                delay = 0.5 * (2 ** attempt)
+            count(usda_retries, endpoint=endpoint)
+            await asyncio.sleep(delay + random.uniform(0, 0.5))
+        raise RuntimeError("unreachable")
+
+    async def analyze_food_with_gemini(self, image_data: bytes, user_corrections: str = "", mime_type: str = "image/jpeg",
+                                       on_item: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Use Gemini to identify food items with high accuracy, incorporating user corrections.
+
+        on_item is called with each food item as soon as it has streamed out of the response.
+        """
+        async def stream(api_key: Optional[str]):
+            response = await self._gemini_model_for(api_key, asynchronous=True).generate_content_async(
+                [{"mime_type": mime_type, "data": image_data}, self._vision_prompt(user_corrections)],
+                generation_config=self._vision_generation_config(),
+                request_options=self._gemini_request_options("gemini.vision"),
+                stream=True
+            )
+
+            parser = StreamingArrayParser("food_items")
+            async for chunk in response:
+                if deadlines.expired():
+                    raise DeadlineExceeded("Request deadline exceeded before the food items were identified")
+                for food_item in parser.feed(self._chunk_text(chunk)):
+                    if on_item is not None:
+                        on_item(food_item)
+            return response, parser
+
+        try:
+            with span("gemini.vision"):
+                response, parser = await self.gemini_quota.call_async(stream, name="gemini.vision")
+            record_tokens("vision", getattr(response, "usage_metadata", None))
+            logger.debug(f"Gemini raw response: {parser.text}")
+
+            return parser.result()
+
+        except Exception as e:
+            logger.error(f"Gemini analysis failed: {e}")
+            raise
+
+    async def apply_user_corrections(self, analysis: Dict, user_corrections: str) -> Dict:
+        """Apply user corrections to the analysis: locally where the correction grammar covers them, else with Gemini."""
+        try:
+            if not user_corrections or not user_corrections.strip():
+                return analysis
+
+            with span("corrections.local"):
+                outcome = apply_corrections(analysis, user_corrections)
+            if not outcome.unparsed:
+                count(corrections_applied, path="local")
+                return outcome.analysis
+
+            count(corrections_applied, path="gemini")
+            with span("gemini.corrections"):
+                response = await self._generate(self._correction_prompt(outcome.analysis, outcome.unparsed),
+                                                "gemini.corrections")
+            record_tokens("corrections", getattr(response, "usage_metadata", None))
+            return self._parse_correction_response(response.text.strip(), outcome.analysis)
+
+        except Exception as e:
+            logger.error(f"Error applying user corrections: {e}")
+            return analysis
+
+    async def _generate(self, prompt: str, call: str):
+        """One Gemini text call within the key quota, duplicated after GEMINI_HEDGE_AFTER_MS if it is slow to answer."""
+        async def send(api_key: Optional[str]):
+            return await self._gemini_model_for(api_key, asynchronous=True).generate_content_async(
+                prompt, request_options=self._gemini_request_options(call))
+
+        async def attempt():
+            return await self.gemini_quota.call_async(send, name=call)
+        return await deadlines.run_async(attempt, hedge_after=calorie_counter.GEMINI_HEDGE_AFTER_MS / 1000,
+                                         bounded=False, name=call)
+
+    async def estimate_nutrition_with_gemini(self, food_name: str, weight_grams: float, description: str = "", cooking_method: str = "") -> Dict:
+        """Use Gemini to estimate nutrition when USDA data is not available."""
+        try:
+            return await self._estimate_with_gemini(food_name, weight_grams, description, cooking_method)
+
+        except Exception as e:
+            logger.warning(f"Gemini nutrition estimation failed for {food_name}: {e}")
+            return self.get_default_nutrition_estimate(food_name, weight_grams)
+
+    async def _estimate_with_gemini(self, food_name: str, weight_grams: float, description: str = "",
+                                    cooking_method: str = "") -> Dict:
+        cached = self.cached_estimate(food_name, cooking_method, weight_grams)
+        if cached is not None:
+            return cached
+        nutrition, estimated_grams = await self.estimate_flight.do(
+            self._estimate_key(food_name, cooking_method), self._request_estimate,
+            food_name, weight_grams, description, cooking_method)
+        return self._for_portion(nutrition, estimated_grams, weight_grams)
+
+    async def _request_estimate(self, food_name: str, weight_grams: float, description: str,
+                                cooking_method: str) -> Tuple[Dict, float]:
+        prompt = self._estimation_prompt(food_name, weight_grams, description, cooking_method)
+        with span("gemini.estimate", food=food_name):
+            response = await self._generate(prompt, "gemini.estimate")
+        record_tokens("estimate", getattr(response, "usage_metadata", None))
+        return self._parse_estimation_response(response.text.strip(), food_name, weight_grams, cooking_method), weight_grams
+
+    async def estimate_nutrition_batch_with_gemini(self, food_items: List[Dict]) -> List[Dict]:
+        """Estimate nutrition for several USDA misses in one Gemini call, keeping the input order."""
+        estimates, pending = self._split_cached_estimates(food_items)
+        if pending:
+            items = [food_items[i] for i in pending]
+
+            async def estimate_led(led: List[int]) -> List[Tuple[Dict, float]]:
+                led_items = [items[i] for i in led]
+                return [(estimate, item.get("estimated_weight_grams", 100))
+                        for estimate, item in zip(await self._estimate_batch_uncached(led_items), led_items)]
+            shared = await self.estimate_flight.do_many(self._estimate_keys(items), estimate_led)
+            for i, item, (nutrition, estimated_grams) in zip(pending, items, shared):
+                estimates[i] = self._for_portion(nutrition, estimated_grams, item.get("estimated_weight_grams", 100))
+        return estimates
+
+    async def _estimate_batch_uncached(self, food_items: List[Dict]) -> List[Dict]:
+        if not food_items:
+            return []
+        if len(food_items) == 1:
+            item = food_items[0]
+            try:
+                return [await self._estimate_with_gemini(
+                    item["name"], item.get("estimated_weight_grams", 100),
+                    item.get("description", ""), item.get("cooking_method", "")
+                )]
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.warning(f"Gemini nutrition estimation failed for {item['name']}: {e}")
+                return [self.get_default_nutrition_estimate(item["name"], item.get("estimated_weight_grams", 100))]
+
+        estimates_by_id = {}
+        try:
+            with span("gemini.estimate_batch", items=len(food_items)):
+                response = await self._generate(self._batch_estimation_prompt(food_items), "gemini.estimate_batch")
+            record_tokens("estimate_batch", getattr(response, "usage_metadata", None))
+            estimates_by_id = self._parse_batch_estimation_response(response.text.strip())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Batched Gemini nutrition estimation failed: {e}")
+
+        return self._validate_batch_estimates(food_items, estimates_by_id)
+
+    async def search_usda_food(self, query: str) -> Optional[Dict]:
+        """Run one FDC search and pick the best candidate food (None if nothing matched).
+
+        Concurrent searches for the same canonical query share one request.
+        """
+        return await self.usda_flight.do(self.usda_cache_key(query), self._search_usda_food, query)
+
+    async def _search_usda_food(self, query: str) -> Optional[Dict]:
+        params = {
+            "query": query,
+            "pageSize": 5,
+            "dataType": ["Foundation", "SR Legacy", "Survey (FNDDS)"],
+            "sortBy": "dataType.keyword"
+        }
+
+        async def attempt():
+            return await self._usda_request("GET", f"{calorie_counter.USDA_API_BASE_URL}/foods/search", params=params)
+
+        with span("usda.search"):
+            response = await deadlines.run_async(attempt, hedge_after=calorie_counter.USDA_HEDGE_AFTER_MS / 1000,
+                                                 bounded=False, name="usda.search")
+        data = response.json()
+
+        return self._pick_best_food(data.get("foods") or [])
+
+    async def fetch_usda_food_details(self, fdc_ids: List[int]) -> Dict[int, Dict]:
+        """Fetch full FDC records for several foods with the bulk /foods endpoint, keyed by fdcId."""
+        unique_ids = list(dict.fromkeys(fdc_id for fdc_id in fdc_ids if fdc_id))
+        chunks = [unique_ids[start:start + 20] for start in range(0, len(unique_ids), 20)]
+        with span("usda.details", foods=len(unique_ids)):
+            responses = await asyncio.gather(*(
+                self._usda_request("POST", f"{calorie_counter.USDA_API_BASE_URL}/foods",
+                                   json={"fdcIds": chunk, "format": "full"})
+                for chunk in chunks
+            ))
+        return {int(food["fdcId"]): food for response in responses for food in response.json()}
+
+    async def fetch_usda_nutrition(self, food_name: str, cooking_method: str = "") -> Optional[Dict]:
+        """Fetch comprehensive nutrition data from USDA API with improved search."""
+        try:
+            query = f"{cooking_method} {food_name}".strip()
+
+            local = self.lookup_usda_locally(query, food_name)
+            if local is not None and not self.is_usda_miss(local):
+                return local
+
+            # A remembered miss skips the search but still falls back to the name-only query
+            best_food = await self.search_usda_food(query) if local is None else None
+            if not best_food:
+                if local is None:
+                    self.remember_usda_miss(query)
+                # Retry with just the food name if specific query fails
+                if cooking_method:
+                    logger.info(f"Detailed search failed, retrying with just: {food_name}")
+                    return await self.fetch_usda_nutrition(food_name, "")
+
+                logger.warning(f"No USDA data found for: {query}")
+                return None
+
+            nutrients = self._usda_record(best_food, food_name)
+            self.remember_usda_result(query, nutrients)
+            logger.info(f"USDA data found for {query}: {nutrients.get('calories', 0)} calories")
+            return nutrients
+
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"USDA API failed for {food_name}: {e}")
+            return None
+
+    async def fetch_usda_nutrition_many(self, food_items: List[Dict], limit: Optional[asyncio.Semaphore] = None) -> List[Optional[Dict]]:
+        """Bulk USDA path: concurrent searches pick candidates, then /foods fetches their full details."""
+        async def pick(food_item: Dict):
+            food_name = food_item["name"]
+            cooking_method = food_item.get("cooking_method", "")
+            query = f"{cooking_method} {food_name}".strip()
+            local = self.lookup_usda_locally(query, food_name)
+            if local is not None and not self.is_usda_miss(local):
+                return query, local, None
+            async with limit or nullcontext():
+                try:
+                    best_food = await self.search_usda_food(query) if local is None else None
+                    if not best_food and local is None:
+                        self.remember_usda_miss(query)
+                    if not best_food and cooking_method:
+                        name_local = self.lookup_usda_locally(food_name, food_name)
+                        if name_local is not None and not self.is_usda_miss(name_local):
+                            return query, name_local, None
+                        if name_local is None:
+                            best_food = await self.search_usda_food(food_name)
+                            if not best_food:
+                                self.remember_usda_miss(food_name)
+                except Exception as e:
+                    logger.warning(f"USDA API failed for {food_name}: {e}")
+                    best_food = None
+            return query, None, best_food
+
+        picks = await asyncio.gather(*(pick(food_item) for food_item in food_items))
+
+        details = {}
+        candidates = [best_food.get("fdcId") for _, _, best_food in picks if best_food]
+        if candidates:
+            try:
+                details = await self.fetch_usda_food_details(candidates)
+            except Exception as e:
+                logger.warning(f"USDA bulk details request failed: {e}")
+
+        results = []
+        for food_item, (query, local, best_food) in zip(food_items, picks):
+            if local is not None:
+                results.append(local)
+            elif best_food:
+                nutrients = self._usda_record(best_food, food_item["name"], details.get(best_food.get("fdcId")))
+                self.remember_usda_result(query, nutrients)
+                results.append(nutrients)
+            else:
+                results.append(None)
+        return results
+
+    async def lookup_usda_for_item(self, food_item: Dict) -> Optional[Dict]:
+        """USDA lookup for one identified food item."""
+        logger.info(f"Fetching nutrition data for: {food_item['name']} ({food_item.get('cooking_method', '')})")
+        with span("usda.lookup", food=food_item["name"]):
+            return await self.fetch_usda_nutrition(food_item["name"], food_item.get("cooking_method", ""))
+
+    async def resolve_food_item(self, food_item: Dict) -> Dict:
+        """Resolve nutrition for a single identified food item (USDA, the local food table, then Gemini,
+        then category defaults)."""
+        usda_deadline = self._usda_deadline()
+        timed_out = False
+        try:
+            with deadline_at(usda_deadline):
+                usda_data = await self.lookup_usda_for_item(food_item)
+        except DeadlineExceeded as e:
+            logger.warning(f"USDA lookup for {food_item['name']} ran out of time: {e}")
+            usda_data, timed_out = None, True
+        usda_degraded = "usda_deadline" if not usda_data and (timed_out or self._passed(usda_deadline)) else None
+        detailed_item = self.detailed_item_without_llm(food_item, usda_data)
+        if detailed_item:
+            return self._mark_degraded(detailed_item, usda_degraded)
+
+        estimates, reason = await self._estimate_misses([food_item])
+        return self._mark_degraded(self.build_detailed_item(food_item, estimated_nutrition=estimates[0]),
+                                   reason or usda_degraded)
+
+    async def _estimate_misses(self, food_items: List[Dict],
+                               limit: Optional[asyncio.Semaphore] = None) -> Tuple[List[Dict], Optional[str]]:
+        if not deadlines.expired():
+            try:
+                async with limit or nullcontext():
+                    return await deadlines.run_async(self.estimate_nutrition_batch_with_gemini, food_items,
+                                                     name="gemini.estimate_batch"), None
+            except DeadlineExceeded as e:
+                logger.warning(f"Falling back to category defaults for {len(food_items)} items: {e}")
+        return [self.get_default_nutrition_estimate(item["name"], item.get("estimated_weight_grams", 100))
+                for item in food_items], "estimate_deadline"
+
+    def _limited_lookup(self, limit: Optional[asyncio.Semaphore]):
+        per_image = asyncio.Semaphore(self.max_workers)
+
+        async def lookup(food_item: Dict) -> Optional[Dict]:
+            async with per_image, limit or nullcontext():
+                return await self.lookup_usda_for_item(food_item)
+        return lookup
+
+    async def iter_resolved_food_items(self, food_items: List[Dict], limit: Optional[asyncio.Semaphore] = None,
+                                       prefetched: Optional[Dict[Tuple[str, str], asyncio.Task]] = None
+                                       ) -> AsyncIterator[Tuple[int, Dict]]:
+        """Yield (index, detailed_item) pairs in the order their nutrition comes back.
+
+        Deadlines degrade items as in AccurateCalorieCounter.iter_resolved_food_items.
+        """
+        if not food_items:
+            return
+
+        usda_deadline = self._usda_deadline()
+        prefetched = dict(prefetched or {})
+        misses = []
+        degraded = {}
+
+        def resolved(index: int, usda_data: Optional[Dict], timed_out: bool = False) -> Optional[Dict]:
+            if not usda_data and (timed_out or self._passed(usda_deadline)):
+                degraded[index] = "usda_deadline"
+            detailed_item = self.detailed_item_without_llm(food_items[index], usda_data)
+            if detailed_item:
+                return self._mark_degraded(detailed_item, degraded.get(index))
+            misses.append(index)
+            return None
+
+        if self.usda_bulk_details and not prefetched:
+            with deadline_at(usda_deadline):
+                bulk = await self.fetch_usda_nutrition_many(food_items, limit)
+            for i, usda_data in enumerate(bulk):
+                detailed_item = resolved(i, usda_data)
+                if detailed_item:
+                    yield i, detailed_item
+        else:
+            limited_lookup = self._limited_lookup(limit)
+
+            async def indexed(index: int, food_item: Dict) -> Tuple[int, Optional[Dict], bool]:
+                task = prefetched.pop(self._lookup_key(food_item), None)
+                try:
+                    with deadline_at(usda_deadline):
+                        return index, await (task if task is not None else limited_lookup(food_item)), False
+                except DeadlineExceeded as e:
+                    logger.warning(f"USDA lookup for {food_item['name']} ran out of time: {e}")
+                    return index, None, True
+
+            pending = {asyncio.ensure_future(indexed(i, item)): i for i, item in enumerate(food_items)}
+            try:
+                while pending:
+                    timeout = None if usda_deadline is None else max(0.0, usda_deadline - time.monotonic())
+                    done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Lookups still running at the USDA deadline are abandoned, not waited for
+                        logger.warning(f"USDA deadline passed with {len(pending)} lookups pending")
+                        for i in sorted(pending.values()):
+                            detailed_item = resolved(i, None)
+                            if detailed_item:
+                                yield i, detailed_item
+                        break
+                    for task in done:
+                        i = pending.pop(task)
+                        detailed_item = resolved(*task.result())
+                        if detailed_item:
+                            yield i, detailed_item
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        # Misses the local table cannot cover are estimated in a single Gemini round trip
+        if misses:
+            misses.sort()
+            batch, reason = await self._estimate_misses([food_items[i] for i in misses], limit)
+            for i, estimated in zip(misses, batch):
+                detailed_item = self.build_detailed_item(food_items[i], estimated_nutrition=estimated)
+                yield i, self._mark_degraded(detailed_item, reason or degraded.get(i))
+
+    async def resolve_food_items(self, food_items: List[Dict], limit: Optional[asyncio.Semaphore] = None) -> List[Dict]:
+        """Resolve nutrition for all food items concurrently, keeping the input order."""
+        detailed_items = [None] * len(food_items)
+        async for i, detailed_item in self.iter_resolved_food_items(food_items, limit):
+            detailed_items[i] = detailed_item
+        return detailed_items
+
+    async def get_calories_from_image(self, image_path: Union[str, Path], user_corrections: str = "",
+                                      stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+                                      on_event: Optional[Callable[[Dict], None]] = None,
+                                      deadline_ms: Optional[float] = None) -> Dict:
+        """Main function to get accurate calorie analysis from image with user corrections."""
+        result = {"error": "Analysis produced no result", "success": False}
+        async for event in self.iter_calories_from_image(image_path, user_corrections, stage_limits, deadline_ms):
+            if on_event is not None:
+                try:
+                    on_event(event)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {e}")
+            if event["event"] in ("complete", "error"):
+                result = event["result"]
+        return result
+
+    async def iter_calories_from_image(self, image_path: Union[str, Path], user_corrections: str = "",
+                                       stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+                                       deadline_ms: Optional[float] = None) -> AsyncIterator[Dict]:
+        """Async counterpart of AccurateCalorieCounter.iter_calories_from_image, with the same events and deadline."""
+        budget = calorie_counter.ANALYSIS_DEADLINE_MS if deadline_ms is None else deadline_ms
+
+        async def events() -> AsyncIterator[Dict]:
+            started = time.perf_counter()
+            with deadline_scope(budget), collect_timings(self.include_timings) as timings:
+                async for event in self._iter_calories_from_image(image_path, user_corrections, stage_limits):
+                    if event["event"] == "complete" and timings is not None:
+                        event["result"]["timings"] = summarize_timings(timings, time.perf_counter() - started)
+                    yield event
+
+        # The scopes stay in a copied context: a consumer that breaks off must not keep the deadline
+        async for event in aiterate_in_context(events()):
+            yield event
+
+    async def _iter_calories_from_image(self, image_path: Union[str, Path], user_corrections: str,
+                                        stage_limits: Optional[Dict[str, asyncio.Semaphore]]) -> AsyncIterator[Dict]:
+        stage_limits = stage_limits or {}
+        try:
+            # File reads and image decoding are blocking, so they run on the default executor
+            async with stage_limits.get("read", nullcontext()):
+                with span("prepare_image"):
+                    prepared = await asyncio.get_running_loop().run_in_executor(None, self.prepare_image, image_path)
+            if prepared is None:
+                yield {"event": "error", "result": {"error": "Image file not found", "success": False}}
+                return
+
+            logger.info("Analyzing image with Gemini AI...")
+            analysis, cache_status = self._cached_analysis(prepared, user_corrections)
+            prefetched = {}
+            try:
+                if analysis is None:
+                    on_item = None
+                    if not self.usda_bulk_details:
+                        # USDA lookups start as soon as each item streams out of the vision response
+                        lookup = self._limited_lookup(stage_limits.get("nutrition"))
+
+                        def on_item(food_item: Dict) -> None:
+                            if food_item.get("name") and self._lookup_key(food_item) not in prefetched:
+                                prefetched[self._lookup_key(food_item)] = asyncio.ensure_future(lookup(food_item))
+
+                    async with stage_limits.get("vision", nullcontext()):
+                        analysis = await self.analyze_food_with_gemini(
+                            prepared["data"], user_corrections, prepared["mime_type"], on_item=on_item)
+                    self._store_analysis(prepared, user_corrections, analysis)
+
+                if user_corrections and user_corrections.strip():
+                    logger.info("Applying user corrections...")
+                    with span("corrections.manual"):
+                        analysis = self.process_user_corrections_manually(analysis, user_corrections)
+
+                food_items = analysis.get("food_items", [])
+                yield {
+                    "event": "items_identified",
+                    "food_items": food_items,
+                    "meal_context": analysis.get("meal_context", ""),
+                    "total_items": len(food_items),
+                    "analysis_cache": cache_status
+                }
+
+                detailed_items = [None] * len(food_items)
+                resolved = 0
+                async for i, detailed_item in self.iter_resolved_food_items(
+                        food_items, stage_limits.get("nutrition"), prefetched):
+                    detailed_items[i] = detailed_item
+                    resolved += 1
+                    yield {
+                        "event": "item_resolved",
+                        "index": i,
+                        "item": detailed_item,
+                        "resolved": resolved,
+                        "total_items": len(food_items),
+                        "total_nutrition": self.sum_nutrition(item for item in detailed_items if item)
+                    }
+            finally:
+                # Lookups for items the corrections removed are not worth waiting for
+                for task in prefetched.values():
+                    task.cancel()
+
+            with span("build_result"):
+                result = self._finalize_result(analysis, detailed_items, user_corrections, prepared, cache_status)
+
+        except Exception as e:
+            logger.error(f"Calorie analysis error: {e}")
+            yield {"event": "error", "result": {"error": str(e), "success": False}}
+            return
+
+        yield {"event": "complete", "result": result}
+
+    async def reanalyze_with_corrections(self, previous_result: Dict, user_corrections: str) -> Dict:
+        """Apply corrections to a previous result, recomputing nutrition only for items that changed."""
+        try:
+            if not previous_result.get("success"):
+                return {"error": "Previous result is not a successful analysis", "success": False}
+            if not user_corrections or not user_corrections.strip():
+                return previous_result
+
+            logger.info("Applying user corrections incrementally...")
+            analysis = await self.apply_user_corrections(self._analysis_from_result(previous_result), user_corrections)
+            analysis = self.process_user_corrections_manually(analysis, user_corrections)
+
+            detailed_items, to_resolve, diff = self._merge_corrected_items(previous_result.get("food_items", []), analysis)
+            resolved = await self.resolve_food_items([food_item for _, food_item in to_resolve])
+            for (position, _), detailed_item in zip(to_resolve, resolved):
+                detailed_items[position] = detailed_item
+
+            return self._finish_incremental(previous_result, user_corrections, analysis, detailed_items, diff)
+
+        except Exception as e:
+            logger.error(f"Incremental correction error: {e}")
+            return {"error": str(e), "success": False}
+
+    async def get_calories_for_images(self, images: Iterable[Union[str, Path, Tuple[Union[str, Path], str]]],
+                                      concurrency: int = 16, read_concurrency: Optional[int] = None,
+                                      vision_concurrency: Optional[int] = None,
+                                      nutrition_concurrency: Optional[int] = None,
+                                      deadline_ms: Optional[float] = None) -> AsyncIterator[Dict]:
+        """Analyze many images, yielding each result (tagged with image_path) as soon as it finishes.
+
+        deadline_ms bounds each image's analysis from the moment it starts. Batch analyses queue
+        for the API key quotas behind interactive ones.
+        """
+        stage_limits = {
+            "read": asyncio.Semaphore(read_concurrency or concurrency),
+            "vision": asyncio.Semaphore(vision_concurrency or concurrency),
+            "nutrition": asyncio.Semaphore(nutrition_concurrency or concurrency * self.max_workers)
+        }
+
+        async def run(entry) -> Dict:
+            image_path, user_corrections = entry if isinstance(entry, tuple) else (entry, "")
+            with priority_scope(BATCH):
+                result = await self.get_calories_from_image(image_path, user_corrections, stage_limits,
+                                                            deadline_ms=deadline_ms)
+            result["image_path"] = str(image_path)
+            return result
+
+        entries = iter(images)
+        pending = set()
+        for entry in entries:
+            pending.add(asyncio.ensure_future(run(entry)))
+            if len(pending) >= concurrency:
+                break
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+                next_entry = next(entries, None)
+                if next_entry is not None:
+                    pending.add(asyncio.ensure_future(run(next_entry)))
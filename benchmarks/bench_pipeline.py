@@ -0,0 +1,236 @@
+"""Offline benchmark of the calorie analysis pipeline.
+
+Gemini and FoodData Central are replaced by the local fakes in benchmarks/fakes.py, so no
+API quota is spent and runs are repeatable. Each scenario reports p50/p95/p99 latency,
+throughput, per-stage latency (from the result timings block), peak traced memory and the
+number of fake API calls. Save a run with --output and compare a later one with --compare.
+
+    python benchmarks/bench_pipeline.py --runs 20 --output before.json
+    python benchmarks/bench_pipeline.py --runs 20 --compare before.json
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Keep the pipeline self-contained: no persistent caches, no offline index, no stale .env settings
+os.environ["ANALYSIS_CACHE_ENABLED"] = "0"
+os.environ.pop("USDA_CACHE_PATH", None)
+os.environ.pop("FDC_INDEX_PATH", None)
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+sys.path[:0] = [str(BENCHMARK_DIR.parent), str(BENCHMARK_DIR)]
+
+import calorie_counter
+from fakes import FakeFoodDataCentral, FakeGemini, install, make_food_items, make_test_image
+from food_table import FoodTable
+from nutrition_cache import create_nutrition_cache
+
+KNOWN = ["rice", "chicken", "dal", "chapati", "egg", "paneer", "banana", "apple", "bread", "yogurt",
+         "potato", "spinach"]
+UNKNOWN = ["idli", "sambar", "papad", "upma", "poha", "dosa", "chutney", "rasam", "halwa", "kheer"]
+
+# name -> (vision food items, user corrections, images per run)
+SCENARIOS = {
+    "single_image": (KNOWN[:3] + UNKNOWN[:1], "", 1),
+    "many_items": (KNOWN + UNKNOWN[:8], "", 1),
+    "usda_miss_heavy": (KNOWN[:1] + UNKNOWN[:7], "", 1),
+    "correction_flow": (KNOWN[:3] + UNKNOWN[:1], "missing: raita", 1),
+    "batch": (KNOWN[:3] + UNKNOWN[:1], "", 16),
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(fraction: float) -> float:
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+    return {
+        "p50": round(rank(0.50), 2), "p95": round(rank(0.95), 2), "p99": round(rank(0.99), 2),
+        "mean": round(statistics.fmean(ordered), 2), "max": round(ordered[-1], 2)
+    }
+
+
+class ScenarioRunner:
+    def __init__(self, name: str, args: argparse.Namespace, image_dir: Path):
+        self.name = name
+        self.args = args
+        item_names, self.corrections, self.images_per_run = SCENARIOS[name]
+        if name == "batch":
+            self.images_per_run = args.batch_size
+        self.gemini = FakeGemini(latency=args.gemini_latency / 1000, estimate_latency=args.estimate_latency / 1000,
+                                 error_rate=args.gemini_error_rate, food_items=make_food_items(item_names),
+                                 seed=args.seed)
+        self.fdc = FakeFoodDataCentral(latency=args.usda_latency / 1000, error_rate=args.usda_error_rate,
+                                       seed=args.seed)
+        self.image_dir = image_dir
+        self.images: List[Path] = []
+
+    def _prepare_images(self, runs: int) -> None:
+        """Generate every test image up front so image synthesis stays out of the timings."""
+        self.images = []
+        for index in range(runs * self.images_per_run):
+            path = self.image_dir / f"{self.name}-{index}.jpg"
+            self.images.append(make_test_image(path, seed=index, size=self.args.image_size))
+
+    def _images(self, count: int) -> List[Path]:
+        taken, self.images = self.images[:count], self.images[count:]
+        return taken
+
+    def _counter(self) -> calorie_counter.AccurateCalorieCounter:
+        # A fresh nutrition cache per run measures cold lookups unless --warm-cache is given
+        cache = self.shared_cache if self.args.warm_cache else create_nutrition_cache(None)
+        # An empty table sends every USDA miss to the (fake) Gemini estimate
+        food_table = FoodTable([]) if self.args.no_food_table else None
+        return calorie_counter.AccurateCalorieCounter(usda_cache=cache, include_timings=True,
+                                                      usda_bulk_details=self.args.bulk_details,
+                                                      food_table=food_table)
+
+    def run_once(self) -> List[Dict]:
+        """One run of the scenario; returns the results it produced."""
+        counter = self._counter()
+        images = self._images(self.images_per_run)
+        if self.name == "batch":
+            return list(counter.get_calories_for_images(images, concurrency=self.args.concurrency))
+        result = counter.get_calories_from_image(images[0], self.corrections)
+        if self.name == "correction_flow" and result.get("success"):
+            started = time.perf_counter()
+            updated = counter.reanalyze_with_corrections(result, "missing: lassi")
+            updated["timings"] = {"stages": {}, "total_seconds": time.perf_counter() - started}
+            return [result, dict(updated, _stage="reanalyze_with_corrections")]
+        return [result]
+
+    def run(self) -> Dict:
+        self.shared_cache = create_nutrition_cache(None)
+        # Warmup runs, timed runs and the memory-tracing run each get distinct images
+        self._prepare_images(self.args.warmup_runs + self.args.runs + 1)
+        with self.fdc:
+            restore = install(self.gemini, self.fdc)
+            try:
+                for _ in range(self.args.warmup_runs):
+                    self.run_once()
+                self.gemini.calls.clear()
+                self.fdc.requests.clear()
+
+                latencies, stages, errors = [], {}, 0
+                started = time.perf_counter()
+                for _ in range(self.args.runs):
+                    run_started = time.perf_counter()
+                    results = self.run_once()
+                    run_seconds = time.perf_counter() - run_started
+                    for result in results:
+                        if not result.get("success"):
+                            errors += 1
+                        stage_name = result.get("_stage")
+                        if stage_name:
+                            stages.setdefault(stage_name, []).append(result["timings"]["total_seconds"] * 1000)
+                            continue
+                        timings = result.get("timings") or {}
+                        if self.name == "batch":
+                            latencies.append(timings.get("total_seconds", run_seconds) * 1000)
+                        for stage, seconds in timings.get("stages", {}).items():
+                            stages.setdefault(stage, []).append(seconds * 1000)
+                    if self.name != "batch":
+                        latencies.append(run_seconds * 1000)
+                wall = time.perf_counter() - started
+                gemini_calls, fdc_requests = dict(self.gemini.calls), dict(self.fdc.requests)
+
+                # Memory is traced in a separate run so tracemalloc's overhead does not skew latency
+                tracemalloc.start()
+                self.run_once()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            finally:
+                restore()
+
+        images = self.args.runs * self.images_per_run
+        return {
+            "runs": self.args.runs,
+            "images": images,
+            "latency_ms": percentiles(latencies),
+            "throughput_images_per_s": round(images / wall, 2) if wall else None,
+            "stages_ms": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+            "peak_memory_kb": round(peak / 1024, 1),
+            "errors": errors,
+            "gemini_calls": gemini_calls,
+            "fdc_requests": fdc_requests
+        }
+
+
+def compare(report: Dict, baseline: Dict) -> List[str]:
+    """Lines showing how each scenario's latency and throughput moved against a saved report."""
+    lines = []
+    for name, current in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        parts = []
+        for key in ("p50", "p95", "p99"):
+            old, new = before["latency_ms"].get(key), current["latency_ms"].get(key)
+            if old:
+                parts.append(f"{key} {old:.1f}->{new:.1f}ms ({(new - old) / old * 100:+.1f}%)")
+        old, new = before.get("throughput_images_per_s"), current.get("throughput_images_per_s")
+        if old:
+            parts.append(f"throughput {old}->{new}/s ({(new - old) / old * 100:+.1f}%)")
+        lines.append(f"{name}: " + ", ".join(parts))
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of the calorie analysis pipeline")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per scenario")
+    parser.add_argument("--warmup-runs", type=int, default=1, help="untimed runs before measuring")
+    parser.add_argument("--gemini-latency", type=float, default=400, help="fake vision/correction latency in ms")
+    parser.add_argument("--estimate-latency", type=float, default=200, help="fake estimation latency in ms")
+    parser.add_argument("--usda-latency", type=float, default=60, help="fake FDC request latency in ms")
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--usda-error-rate", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=16, help="images per run in the batch scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="images in flight in the batch scenario")
+    parser.add_argument("--image-size", type=int, default=1024, help="edge length of the generated test images")
+    parser.add_argument("--warm-cache", action="store_true", help="keep the nutrition cache across runs")
+    parser.add_argument("--bulk-details", action="store_true", help="use the bulk /foods details path")
+    parser.add_argument("--no-food-table", action="store_true", help="skip the local food table for USDA misses")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="print deltas against a previously saved report")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's INFO/WARNING logging")
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+
+    report = {"config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "verbose")},
+              "scenarios": {}}
+    with tempfile.TemporaryDirectory(prefix="calorie-bench-") as image_dir:
+        for name in args.scenarios:
+            report["scenarios"][name] = ScenarioRunner(name, args, Path(image_dir)).run()
+            summary = report["scenarios"][name]
+            print(f"{name}: p50 {summary['latency_ms'].get('p50')}ms p95 {summary['latency_ms'].get('p95')}ms "
+                  f"p99 {summary['latency_ms'].get('p99')}ms, {summary['throughput_images_per_s']} images/s, "
+                  f"peak {summary['peak_memory_kb']} KB", file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+    if args.compare:
+        for line in compare(report, json.loads(Path(args.compare).read_text())):
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""Local stand-ins for Gemini and FoodData Central, for benchmarks and offline smoke runs.
+
+    with FakeFoodDataCentral(latency=0.05) as fdc:
+        restore = install(FakeGemini(latency=0.4), fdc)
+        ...
+        restore()
+
+FakeGemini answers the four prompt shapes calorie_counter sends (vision, correction,
+single and batched estimation) with canned JSON after a configurable delay, streaming the
+vision response in chunks. FakeFoodDataCentral is a threaded HTTP server that serves
+/foods/search and the bulk /foods endpoint for a configurable set of known foods.
+Both can inject errors at a given rate.
+"""
+import asyncio
+import io
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import calorie_counter
+
+# Calories per 100 g for the foods the fake FDC knows about
+DEFAULT_KNOWN_FOODS = {
+    "rice": 130, "chicken": 165, "dal": 116, "chapati": 297, "egg": 155, "paneer": 265,
+    "banana": 89, "apple": 52, "bread": 265, "yogurt": 61, "potato": 77, "spinach": 23
+}
+
+
+def make_food_items(names: Sequence[str], weight_grams: float = 150) -> List[Dict]:
+    """Vision-style food_items entries for the given names."""
+    return [{
+        "name": name,
+        "cooking_method": "",
+        "estimated_quantity": "1 serving",
+        "estimated_weight_grams": weight_grams,
+        "description": f"a serving of {name}",
+        "confidence_score": 80,
+        "confidence_reasoning": "benchmark fixture",
+        "hidden_calories": ""
+    } for name in names]
+
+
+class FakeGeminiError(Exception):
+    """Raised by FakeGemini for injected failures, like a 429 or 503 from the real API."""
+
+
+class _Response:
+    def __init__(self, text: str, prompt_tokens: int):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(prompt_token_count=prompt_tokens,
+                                              candidates_token_count=len(text) // 4)
+
+
+class _Stream:
+    """Iterable over response chunks, sync or async, with the latency spread across chunks."""
+
+    def __init__(self, text: str, delay: float, prompt_tokens: int, chunk_size: int = 64):
+        self.pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+        self.delay = delay / len(self.pieces)
+        self.usage_metadata = _Response(text, prompt_tokens).usage_metadata
+
+    def __iter__(self):
+        for piece in self.pieces:
+            time.sleep(self.delay)
+            yield _Response(piece, 0)
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            await asyncio.sleep(self.delay)
+            yield _Response(piece, 0)
+
+
+class FakeGemini:
+    """Configurable fake of the google.generativeai module, installed as calorie_counter's SDK."""
+
+    def __init__(self, latency: float = 0.4, estimate_latency: Optional[float] = None, jitter: float = 0.1,
+                 error_rate: float = 0.0, food_items: Optional[List[Dict]] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.estimate_latency = latency / 2 if estimate_latency is None else estimate_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.food_items = food_items if food_items is not None else make_food_items(["rice", "chicken", "dal"])
+        self.calls: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        fake = self
+
+        class GenerativeModel:
+            def __init__(self, model_name: str = "", **kwargs):
+                self.model_name = model_name
+
+            def generate_content(self, contents, stream: bool = False, **kwargs):
+                text, delay = fake._respond(contents)
+                if stream:
+                    return _Stream(text, delay, fake._prompt_tokens(contents))
+                time.sleep(delay)
+                return _Response(text, fake._prompt_tokens(contents))
+
+            async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+                text, delay = fake._respond(contents)
+                if stream:
+                    return _Stream(text, delay, fake._prompt_tokens(contents))
+                await asyncio.sleep(delay)
+                return _Response(text, fake._prompt_tokens(contents))
+
+        self.GenerativeModel = GenerativeModel
+
+    def configure(self, **kwargs) -> None:
+        pass
+
+    @staticmethod
+    def _prompt_tokens(contents) -> int:
+        text = contents[-1] if isinstance(contents, list) else contents
+        # Gemini bills a fixed 258 tokens per image
+        return len(str(text)) // 4 + (258 if isinstance(contents, list) else 0)
+
+    def _delay(self, base: float) -> float:
+        with self._lock:
+            return max(0.0, base * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _respond(self, contents):
+        if isinstance(contents, list):
+            kind = "vision"
+            text = json.dumps({"food_items": self.food_items, "meal_context": "Lunch",
+                               "reasoning": "benchmark fixture"})
+            base = self.latency
+        elif "Original AI Analysis:" in contents:
+            kind = "correction"
+            text = contents.split("Original AI Analysis:")[1].split("User Corrections:")[0]
+            base = self.latency
+        elif "item_id" in contents:
+            kind = "estimate_batch"
+            count = contents.count("- item_id ")
+            text = json.dumps([{"item_id": i, "calories": 180, "protein": 6, "fat": 5, "carbohydrates": 28,
+                                "fiber": 2, "sodium": 150, "estimation_confidence": "medium"} for i in range(count)])
+            base = self.estimate_latency
+        else:
+            kind = "estimate"
+            text = json.dumps({"calories": 180, "protein": 6, "fat": 5, "carbohydrates": 28,
+                               "fiber": 2, "sodium": 150, "estimation_confidence": "medium"})
+            base = self.estimate_latency
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise FakeGeminiError(f"429 Resource has been exhausted (injected {kind} failure)")
+        return text, self._delay(base)
+
+
+def _fdc_food(fdc_id: int, name: str, calories: float, search_shape: bool = True) -> Dict:
+    values = {"208": calories, "203": 6.0, "204": 3.0, "205": 20.0, "291": 1.5, "307": 40.0}
+    if search_shape:
+        nutrients = [{"nutrientNumber": number, "value": value} for number, value in values.items()]
+    else:
+        nutrients = [{"nutrient": {"number": number}, "amount": value} for number, value in values.items()]
+    return {"fdcId": fdc_id, "description": name.title(), "dataType": "SR Legacy", "foodNutrients": nutrients}
+
+
+class FakeFoodDataCentral:
+    """Threaded local HTTP stub of the FDC API (search, bulk details, HEAD for warmup)."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.1, error_rate: float = 0.0,
+                 known_foods: Optional[Dict[str, float]] = None, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.known_foods = dict(DEFAULT_KNOWN_FOODS if known_foods is None else known_foods)
+        self.requests: Dict[str, int] = {}
+        self._ids = {name: 100000 + i for i, name in enumerate(self.known_foods)}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/fdc/v1"
+
+    def _admit(self, endpoint: str) -> bool:
+        """Count the request, sleep its latency and decide whether to fail it."""
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            failed = self._random.random() < self.error_rate
+            delay = max(0.0, self.latency * (1 + self._random.uniform(-self.jitter, self.jitter)))
+        time.sleep(delay)
+        return not failed
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload=None):
+                body = json.dumps(payload).encode() if payload is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_HEAD(self):
+                self._send(200)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if not url.path.endswith("/foods/search"):
+                    return self._send(404, {"error": "not found"})
+                if not stub._admit("search"):
+                    return self._send(503, {"error": "injected failure"})
+                query = parse_qs(url.query).get("query", [""])[0].lower()
+                foods = [_fdc_food(stub._ids[name], name, calories)
+                         for name, calories in stub.known_foods.items() if name in query]
+                self._send(200, {"totalHits": len(foods), "foods": foods})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+                if not urlparse(self.path).path.endswith("/foods"):
+                    return self._send(404, {"error": "not found"})
+                if not stub._admit("details"):
+                    return self._send(503, {"error": "injected failure"})
+                names = {fdc_id: name for name, fdc_id in stub._ids.items()}
+                ids = json.loads(body or b"{}").get("fdcIds", [])
+                self._send(200, [_fdc_food(fdc_id, names[fdc_id], stub.known_foods[names[fdc_id]], search_shape=False)
+                                 for fdc_id in ids if fdc_id in names])
+
+        return Handler
+
+    def start(self) -> "FakeFoodDataCentral":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-fdc", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeFoodDataCentral":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def install(gemini: FakeGemini, fdc: Optional[FakeFoodDataCentral] = None) -> Callable[[], None]:
+    """Point calorie_counter at the fakes; returns a function that undoes it.
+
+    The fakes have no quota, so the client-side rate limits are lifted while installed.
+    """
+    previous = (calorie_counter._genai, calorie_counter.USDA_API_BASE_URL, calorie_counter.USDA_API_KEY,
+                calorie_counter.GEMINI_RATE_LIMIT, calorie_counter.USDA_RATE_LIMIT)
+    calorie_counter._genai = gemini
+    calorie_counter.GEMINI_RATE_LIMIT = calorie_counter.USDA_RATE_LIMIT = "0"
+    if fdc is not None:
+        calorie_counter.USDA_API_BASE_URL = fdc.base_url
+        calorie_counter.USDA_API_KEY = calorie_counter.USDA_API_KEY or "DEMO_KEY"
+
+    def restore() -> None:
+        (calorie_counter._genai, calorie_counter.USDA_API_BASE_URL, calorie_counter.USDA_API_KEY,
+         calorie_counter.GEMINI_RATE_LIMIT, calorie_counter.USDA_RATE_LIMIT) = previous
+    return restore
+
+
+def make_test_image(path: Path, seed: int = 0, size: int = 1024) -> Path:
+    """Write a distinct photo-sized JPEG (noise plus a gradient) so preprocessing does real work."""
+    try:
+        from PIL import Image
+    except ImportError:
+        path.write_bytes(b"\xff\xd8\xff\xe0" + random.Random(seed).randbytes(200_000) + b"\xff\xd9")
+        return path
+    rng = random.Random(seed)
+    image = Image.effect_noise((size, size), 40).convert("RGB")
+    overlay = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    image = Image.blend(image, overlay, 0.5)
+    image.paste((rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+                (0, 0, size // 4, size // 4))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    path.write_bytes(buffer.getvalue())
+    return path
@@ -0,0 +1,75 @@
+"""Measure the cold-start cost of the calorie counter.
+
+Each sample runs in a fresh interpreter and reports how long ``import calorie_counter`` and
+constructing an ``AccurateCalorieCounter`` take, and which heavy dependencies were imported
+along the way. Exits non-zero when the median exceeds ``--max-import-ms`` or when
+google.generativeai, requests or numpy are imported eagerly, so it can guard startup in CI.
+
+    python benchmarks/import_time.py --runs 10 --max-import-ms 150
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Dependencies that must only load on first use
+LAZY_MODULES = ("google.generativeai", "requests", "numpy")
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import calorie_counter
+imported = time.perf_counter()
+calorie_counter.AccurateCalorieCounter()
+constructed = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "construct_ms": (constructed - imported) * 1000,
+    "eager_modules": [name for name in %r if name in sys.modules]
+}))
+""" % (LAZY_MODULES,)
+
+
+def sample() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE], cwd=REPO_ROOT, check=True,
+        capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters to sample")
+    parser.add_argument("--max-import-ms", type=float, help="fail when the median import time exceeds this")
+    args = parser.parse_args()
+
+    samples = [sample() for _ in range(args.runs)]
+    report = {"runs": args.runs}
+    for key in ("import_ms", "construct_ms"):
+        values = [s[key] for s in samples]
+        report[key] = {
+            "p50": round(statistics.median(values), 2),
+            "p95": round(percentile(values, 0.95), 2),
+            "min": round(min(values), 2)
+        }
+    report["eager_modules"] = sorted({name for s in samples for name in s["eager_modules"]})
+    print(json.dumps(report, indent=2))
+
+    failed = bool(report["eager_modules"])
+    if args.max_import_ms is not None and report["import_ms"]["p50"] > args.max_import_ms:
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
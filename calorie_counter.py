@@ -1,14 +1,35 @@
 import os
 import base64
 import json
-import requests
-import google.generativeai as genai
 from dotenv import load_dotenv
 import re
-from typing import Dict, List, Optional, Union
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 import logging
 from pathlib import Path
 import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+from functools import partial
+import threading
+
+import deadlines
+from corrections import apply_corrections, corrections_applied
+from deadlines import DeadlineExceeded, deadline_at, deadline_scope
+from fdc_index import FDCIndex, nutrients_from_fdc_food
+from food_names import QueryIndex, canonical_query
+from food_table import DEFAULT_FOOD_TABLE_PATHS, FoodTable
+from image_preprocessing import ImagePreprocessor, preprocess_image_file, report as preprocessing_report
+from instrumentation import (collect_timings, count, iterate_in_context, record_cache, record_tokens, span,
+                             submit_in_context, summarize_timings, usda_retries)
+from nutrition_cache import AnalysisCache, create_analysis_cache_from_env, create_nutrition_cache_from_env
+from nutrition_records import (FoodRecord, macro_percentages, nutrient_dict, nutrient_vector, scale,
+                                split_nutrition, totals_of)
+from quota import BATCH, QuotaScheduler, RateLimited, parse_rate, priority_scope
+from single_flight import SingleFlight
+from streaming_json import StreamingArrayParser
+
+if TYPE_CHECKING:
+    import requests
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -19,20 +40,392 @@ load_dotenv()
 
 GOOGLE_GENERATIVE_AI_API_KEY = os.getenv("GOOGLE_GENERATIVE_AI_API_KEY")
 USDA_API_KEY = os.getenv("USDA_API_KEY")
+USDA_API_BASE_URL = os.getenv("USDA_API_BASE_URL", "https://api.nal.usda.gov/fdc/v1")
+USDA_POOL_SIZE = int(os.getenv("USDA_POOL_SIZE", "16"))
+USDA_MAX_RETRIES = int(os.getenv("USDA_MAX_RETRIES", "3"))
+USDA_BULK_DETAILS = os.getenv("USDA_BULK_DETAILS", "0").lower() in ("1", "true", "yes")
+# How long a query FoodData Central had no match for is remembered (seconds, 0 disables)
+USDA_MISS_TTL = float(os.getenv("USDA_MISS_TTL", str(24 * 3600)))
+# How long per-100 g Gemini nutrition estimates are reused (seconds, 0 disables)
+ESTIMATE_CACHE_TTL = float(os.getenv("ESTIMATE_CACHE_TTL", str(30 * 24 * 3600)))
+# Optional offline FoodData Central index built with `python fdc_index.py build`
+FDC_INDEX_PATH = os.getenv("FDC_INDEX_PATH")
+# Minimum trigram similarity for serving a query from a close earlier one; above 1 disables it
+QUERY_MATCH_MIN_SCORE = float(os.getenv("QUERY_MATCH_MIN_SCORE", "0.85"))
+# Local food composition table consulted for USDA misses before any Gemini estimate (see food_table.py)
+LOCAL_FOOD_TABLE = os.getenv("LOCAL_FOOD_TABLE", "1").lower() not in ("0", "false", "no")
+FOOD_TABLE_PATH = os.getenv("FOOD_TABLE_PATH") or os.pathsep.join(map(str, DEFAULT_FOOD_TABLE_PATHS))
+FOOD_TABLE_MIN_SCORE = float(os.getenv("FOOD_TABLE_MIN_SCORE", "0.6"))
+# Share one in-flight USDA search or Gemini estimate between concurrent lookups of the same food
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1").lower() not in ("0", "false", "no")
+# Latency budget of each analysis in ms (0 = none); deadline_ms arguments override it per request
+ANALYSIS_DEADLINE_MS = float(os.getenv("ANALYSIS_DEADLINE_MS", "0"))
+# Budget held back from USDA lookups (at most half of what is left) so misses can still get a Gemini estimate
+DEADLINE_ESTIMATE_RESERVE_MS = float(os.getenv("DEADLINE_ESTIMATE_RESERVE_MS", "1500"))
+# Timeout of each Gemini call, further capped by the request deadline
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+# Send a duplicate of a USDA search or Gemini estimate still unanswered after this many ms (0 = never)
+USDA_HEDGE_AFTER_MS = float(os.getenv("USDA_HEDGE_AFTER_MS", "0"))
+GEMINI_HEDGE_AFTER_MS = float(os.getenv("GEMINI_HEDGE_AFTER_MS", "0"))
+# Comma-separated key pools the quota scheduler spreads calls across (default: the single keys above)
+GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()]
+USDA_API_KEYS = [key.strip() for key in os.getenv("USDA_API_KEYS", "").split(",") if key.strip()]
+# Per-key request quotas as "count/period" (e.g. "2000/min", "1000/hour"); 0 removes the limit
+GEMINI_RATE_LIMIT = os.getenv("GEMINI_RATE_LIMIT", "2000/min")
+USDA_RATE_LIMIT = os.getenv("USDA_RATE_LIMIT", "1000/hour")
+# Longest a call waits for quota before failing (the request deadline may cut it shorter)
+QUOTA_MAX_WAIT_SECONDS = float(os.getenv("QUOTA_MAX_WAIT_SECONDS", "30"))
+# Further attempts, on the next free key, of a call that got a 429
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "2"))
+
+# Cached in place of a USDA record when FoodData Central has no match for a query
+USDA_MISS = {"usda_miss": True}
+# Key prefix of cached Gemini estimates in the nutrition cache
+ESTIMATE_KEY_PREFIX = "gemini_estimate:"
+
+# Data source of items estimated from the local food table
+LOCAL_TABLE_SOURCE = "Local Food Table"
+
+# Keywords of the category-average fallback, in priority order, matched in one pass
+CATEGORY_KEYWORDS = (
+    ("vegetable", ("vegetable", "salad", "broccoli", "spinach", "carrot", "lettuce")),
+    ("fruit", ("fruit", "apple", "banana", "orange", "berry")),
+    ("meat", ("beef", "pork", "lamb", "steak")),
+    ("poultry", ("chicken", "turkey")),
+    ("fish", ("fish", "salmon", "tuna", "shrimp")),
+    ("grain", ("rice", "pasta", "bread", "grain", "cereal")),
+    ("dairy", ("milk", "cheese", "yogurt", "dairy")),
+)
+CATEGORY_BY_KEYWORD = {keyword: category for category, keywords in CATEGORY_KEYWORDS for keyword in keywords}
+CATEGORY_PATTERN = re.compile("|".join(sorted(map(re.escape, CATEGORY_BY_KEYWORD), key=len, reverse=True)))
+
+# Structured JSON output for the vision call; disable for models without response_schema support
+GEMINI_STRUCTURED_OUTPUT = os.getenv("GEMINI_STRUCTURED_OUTPUT", "1").lower() not in ("0", "false", "no")
+
+# Response schema mirroring the JSON layout described in the vision prompt. Gemini emits
+# properties in alphabetical order, so food_items streams out before reasoning.
+VISION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "food_items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "cooking_method": {"type": "string"},
+                    "estimated_quantity": {"type": "string"},
+                    "estimated_weight_grams": {"type": "number"},
+                    "description": {"type": "string"},
+                    "confidence_score": {"type": "integer"},
+                    "confidence_reasoning": {"type": "string"},
+                    "hidden_calories": {"type": "string"}
+                },
+                "required": ["name", "cooking_method", "estimated_weight_grams"]
+            }
+        },
+        "meal_context": {"type": "string"},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["food_items"]
+}
+
+# Add a per-stage "timings" block to every result (see instrumentation.py for metrics export)
+RESULT_TIMINGS = os.getenv("RESULT_TIMINGS", "0").lower() in ("1", "true", "yes")
+
+# Nutrients summed into a meal's total_nutrition
+TOTAL_NUTRIENTS = ("calories", "protein", "fat", "carbohydrates", "fiber", "sodium")
+
+# The Gemini SDK and requests are imported on first use: google.generativeai alone
+# accounts for most of a cold start, and many processes never call Gemini at all.
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """Import and configure google.generativeai once per process."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                genai.configure(api_key=GOOGLE_GENERATIVE_AI_API_KEY)
+                _genai = genai
+    return _genai
+
+_gemini_pool_models = {}
+
+def get_gemini_pool_model(api_key: str, asynchronous: bool = False):
+    """A Gemini 2.0 Flash model bound to one key of GEMINI_API_KEYS.
+    
+    google.generativeai configures a single key per process and has no public per-model key,
+    so models for the other keys of the pool get a client of their own through the lazily
+    created _client (or, for asynchronous use, _async_client) attribute. The async client has
+    to be created on a running event loop, hence one model per key and mode. SDK versions
+    without these attributes keep the default key, with a warning, since the quota scheduler
+    then no longer spreads load across the pool.
+    """
+    model = _gemini_pool_models.get((api_key, asynchronous))
+    if model is None:
+        genai = get_genai()
+        with _genai_lock:
+            model = _gemini_pool_models.get((api_key, asynchronous))
+            if model is None:
+                model = genai.GenerativeModel("gemini-2.0-flash")
+                attribute = "_async_client" if asynchronous else "_client"
+                if hasattr(model, attribute):
+                    from google.ai import generativelanguage as glm
+                    client = glm.GenerativeServiceAsyncClient if asynchronous else glm.GenerativeServiceClient
+                    setattr(model, attribute, client(client_options={"api_key": api_key}))
+                else:
+                    logger.warning(
+                        f"google.generativeai {getattr(genai, '__version__', '(unknown version)')} has no "
+                        f"{attribute} on GenerativeModel; Gemini calls for pool key ...{api_key[-4:]} "
+                        "use the default key"
+                    )
+                _gemini_pool_models[(api_key, asynchronous)] = model
+    return model
+
+# One scheduler per API and key pool, shared by every counter (and event loop) in the process
+_quota_schedulers = {}
+_quota_lock = threading.Lock()
+
+def get_quota_scheduler(api: str) -> QuotaScheduler:
+    """Return the process-wide quota scheduler of the "gemini" or "usda" key pool."""
+    if api == "gemini":
+        keys, rate_limit = tuple(GEMINI_API_KEYS or [GOOGLE_GENERATIVE_AI_API_KEY]), GEMINI_RATE_LIMIT
+    else:
+        keys, rate_limit = tuple(USDA_API_KEYS or [USDA_API_KEY]), USDA_RATE_LIMIT
+    scheduler = _quota_schedulers.get((api, keys, rate_limit))
+    if scheduler is None:
+        with _quota_lock:
+            scheduler = _quota_schedulers.get((api, keys, rate_limit))
+            if scheduler is None:
+                rate, burst = parse_rate(rate_limit)
+                scheduler = QuotaScheduler(api, keys, rate, burst, max_wait=QUOTA_MAX_WAIT_SECONDS,
+                                           max_retries=QUOTA_MAX_RETRIES)
+                _quota_schedulers[(api, keys, rate_limit)] = scheduler
+    return scheduler
+
+# USDA lookups are shared by every counter in the process so the cache survives across images
+_shared_usda_cache = None
+_shared_usda_cache_lock = threading.RLock()
+
+def get_shared_usda_cache():
+    """Return the process-wide USDA nutrition cache, creating it from the environment on first use."""
+    global _shared_usda_cache
+    if _shared_usda_cache is None:
+        with _shared_usda_cache_lock:
+            if _shared_usda_cache is None:
+                _shared_usda_cache = create_nutrition_cache_from_env()
+    return _shared_usda_cache
+
+_shared_query_index = None
+
+def get_shared_query_index() -> QueryIndex:
+    """Return the fuzzy index over the queries held in the shared USDA cache."""
+    global _shared_query_index
+    if _shared_query_index is None:
+        with _shared_usda_cache_lock:
+            if _shared_query_index is None:
+                _shared_query_index = QueryIndex(min_score=QUERY_MATCH_MIN_SCORE)
+    return _shared_query_index
 
-# Configure Gemini
-genai.configure(api_key=GOOGLE_GENERATIVE_AI_API_KEY)
+_shared_usda_session = None
+
+def get_usda_session() -> "requests.Session":
+    """Return the process-wide pooled HTTP session used for FoodData Central requests."""
+    global _shared_usda_session
+    if _shared_usda_session is None:
+        with _shared_usda_cache_lock:
+            if _shared_usda_session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                
+                retry = Retry(
+                    total=USDA_MAX_RETRIES,
+                    backoff_factor=0.5,
+                    backoff_jitter=0.5,
+                    # 429s go back to the quota scheduler, which backs off the key and retries on another
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=frozenset({"GET", "POST"}),
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=USDA_POOL_SIZE, max_retries=retry)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _shared_usda_session = session
+    return _shared_usda_session
+
+_shared_analysis_cache = None
+_shared_analysis_cache_loaded = False
+
+def get_shared_analysis_cache() -> Optional[AnalysisCache]:
+    """Return the process-wide vision analysis cache (None when ANALYSIS_CACHE_ENABLED=0)."""
+    global _shared_analysis_cache, _shared_analysis_cache_loaded
+    if not _shared_analysis_cache_loaded:
+        with _shared_usda_cache_lock:
+            if not _shared_analysis_cache_loaded:
+                _shared_analysis_cache = create_analysis_cache_from_env()
+                _shared_analysis_cache_loaded = True
+    return _shared_analysis_cache
+
+_shared_fdc_index = None
+
+def get_shared_fdc_index() -> Optional[FDCIndex]:
+    """Return the process-wide offline FDC index if FDC_INDEX_PATH points at one."""
+    global _shared_fdc_index
+    if _shared_fdc_index is None and FDC_INDEX_PATH:
+        with _shared_usda_cache_lock:
+            if _shared_fdc_index is None:
+                try:
+                    _shared_fdc_index = FDCIndex(FDC_INDEX_PATH)
+                    logger.info(f"Loaded offline FDC index with {len(_shared_fdc_index)} foods")
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not load FDC index from {FDC_INDEX_PATH}: {e}")
+                    return None
+    return _shared_fdc_index
+
+_shared_food_table = None
+
+def get_shared_food_table() -> Optional[FoodTable]:
+    """Return the process-wide local food composition table (None when LOCAL_FOOD_TABLE=0)."""
+    global _shared_food_table
+    if _shared_food_table is None and LOCAL_FOOD_TABLE:
+        with _shared_usda_cache_lock:
+            if _shared_food_table is None:
+                try:
+                    _shared_food_table = FoodTable.load(FOOD_TABLE_PATH)
+                    logger.info(f"Loaded local food table with {len(_shared_food_table)} dishes")
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Could not load food table from {FOOD_TABLE_PATH}: {e}")
+                    return None
+    return _shared_food_table
 
 class AccurateCalorieCounter:
-    def __init__(self):
-        # Use the correct Gemini 2.0 Flash model
-        self.gemini_model = genai.GenerativeModel("gemini-2.0-flash")
-        self.usda_cache = {}
+    def __init__(self, max_workers: int = 6, usda_cache=None, fdc_index: Optional[FDCIndex] = None,
+                 image_preprocessor: Optional[ImagePreprocessor] = None,
+                 analysis_cache: Optional[AnalysisCache] = None,
+                 http_session=None, usda_bulk_details: Optional[bool] = None,
+                 include_timings: Optional[bool] = None, query_index: Optional[QueryIndex] = None,
+                 food_table: Optional[FoodTable] = None):
+        # Clients are created on first use (see the gemini_model and http_session properties)
+        self._init_lock = threading.Lock()
+        self._gemini_model = None
+        self._http_session = http_session
+        # Any backend with get/set works here (see nutrition_cache); default is the shared tiered cache
+        self.usda_cache = usda_cache if usda_cache is not None else get_shared_usda_cache()
+        # Fuzzy index over the canonical queries cached in usda_cache, so it must match that cache
+        if query_index is None:
+            query_index = get_shared_query_index() if usda_cache is None else QueryIndex(min_score=QUERY_MATCH_MIN_SCORE)
+        self.query_index = query_index
+        # Per-100 g dish table that answers most USDA misses without a Gemini estimate
+        self._food_table = food_table
+        # Concurrent misses on the same food wait for one upstream call instead of each sending their own
+        self.usda_flight = SingleFlight("usda_search", enabled=SINGLE_FLIGHT)
+        self.estimate_flight = SingleFlight("gemini_estimate", enabled=SINGLE_FLIGHT)
+        # Local FDC index is the primary nutrition source when available; the USDA API is the fallback
+        self.fdc_index = fdc_index if fdc_index is not None else get_shared_fdc_index()
+        # Enrich USDA search matches with full /foods details in one bulk request per image
+        self.usda_bulk_details = USDA_BULK_DETAILS if usda_bulk_details is None else usda_bulk_details
+        # Upper bound on food items resolved concurrently per image
+        self.max_workers = max_workers
+        # Downscales, strips EXIF and re-encodes images before upload (configured from IMAGE_* env vars)
+        self.image_preprocessor = image_preprocessor or ImagePreprocessor.from_env()
+        # Exact and near-duplicate cache in front of the vision call
+        self.analysis_cache = analysis_cache if analysis_cache is not None else get_shared_analysis_cache()
+        # Attach per-stage and per-item timings to each result
+        self.include_timings = RESULT_TIMINGS if include_timings is None else include_timings
+
+    @property
+    def food_table(self) -> Optional[FoodTable]:
+        """The local food composition table, loaded on first use."""
+        if self._food_table is None:
+            self._food_table = get_shared_food_table()
+        return self._food_table
+
+    @food_table.setter
+    def food_table(self, table: Optional[FoodTable]) -> None:
+        self._food_table = table
+
+    @property
+    def gemini_model(self):
+        """The Gemini 2.0 Flash model, created on first use."""
+        if self._gemini_model is None:
+            with self._init_lock:
+                if self._gemini_model is None:
+                    # Use the correct Gemini 2.0 Flash model
+                    self._gemini_model = get_genai().GenerativeModel("gemini-2.0-flash")
+        return self._gemini_model
+
+    @gemini_model.setter
+    def gemini_model(self, model) -> None:
+        self._gemini_model = model
+
+    def _gemini_model_for(self, api_key: Optional[str], asynchronous: bool = False):
+        """The model to call with a key the Gemini quota scheduler handed out."""
+        if not GEMINI_API_KEYS or api_key == GOOGLE_GENERATIVE_AI_API_KEY:
+            return self.gemini_model
+        return get_gemini_pool_model(api_key, asynchronous)
+
+    @property
+    def gemini_quota(self) -> QuotaScheduler:
+        """Rate limiter and priority queue in front of the Gemini key pool."""
+        return get_quota_scheduler("gemini")
+
+    @property
+    def usda_quota(self) -> QuotaScheduler:
+        """Rate limiter and priority queue in front of the FoodData Central key pool."""
+        return get_quota_scheduler("usda")
+
+    @property
+    def http_session(self) -> "requests.Session":
+        """Pooled keep-alive session with jittered retries, shared by every counter in the process."""
+        if self._http_session is None:
+            self._http_session = get_usda_session()
+        return self._http_session
+
+    @http_session.setter
+    def http_session(self, session) -> None:
+        self._http_session = session
+
+    def warmup(self, gemini: bool = True, usda: bool = True) -> Dict:
+        """Pay one-time startup costs up front instead of on the first request.
         
-    def analyze_food_with_gemini(self, image_data: bytes, user_corrections: str = "") -> Dict:
-        """Use Gemini to identify food items with high accuracy, incorporating user corrections."""
-        try:
-            base_prompt = """You are a professional nutritionist AI. Analyze this food image and:
+        Creates the Gemini client, opens a pooled connection to the FoodData Central API,
+        touches the nutrition and analysis caches, pages in the offline FDC index and loads
+        the local food table.
+        Returns the seconds spent on each step.
+        """
+        timings = {}
+        
+        def timed(step: str, func: Callable[[], object]) -> None:
+            started = time.perf_counter()
+            try:
+                func()
+            except Exception as e:
+                logger.warning(f"Warmup step {step} failed: {e}")
+            timings[step] = round(time.perf_counter() - started, 4)
+        
+        if gemini:
+            timed("gemini_client", lambda: self.gemini_model)
+        if usda:
+            # Any response leaves a TLS connection in the pool for the first real lookup
+            timed("usda_connection", lambda: self.http_session.head(
+                USDA_API_BASE_URL, params={"api_key": USDA_API_KEY}, timeout=5))
+        timed("nutrition_cache", lambda: self.usda_cache.get("__warmup__"))
+        if self.analysis_cache is not None:
+            timed("analysis_cache", self.analysis_cache.stats)
+        if self.fdc_index is not None:
+            timed("fdc_index", lambda: self.fdc_index.lookup("apple"))
+        timed("food_table", lambda: self.food_table)
+        return timings
+        
+    def _vision_prompt(self, user_corrections: str = "") -> str:
+        """Prompt for the vision call, with any user corrections folded in."""
+        base_prompt = """You are a professional nutritionist AI. Analyze this food image and:
 
 1. Identify ALL visible food items with specific names (e.g., "Grilled Chicken Breast" instead of just "Chicken").
 2. Estimate the QUANTITY/VOLUME first (e.g., "1 cup", "2 slices", "1 fist-sized portion").
@@ -59,9 +452,9 @@ Respond in PURE JSON format:
   "meal_context": "Description of the complete meal (e.g., Breakfast, Lunch, Snack)"
 }"""
 
-            # Add user corrections to the prompt if provided
-            if user_corrections and user_corrections.strip():
-                correction_prompt = f"""
+        # Add user corrections to the prompt if provided
+        if user_corrections and user_corrections.strip():
+            correction_prompt = f"""
 IMPORTANT USER CORRECTIONS: {user_corrections}
 
 Please carefully consider these user corrections when analyzing the image. The user may have additional information about:
@@ -72,37 +465,34 @@ Please carefully consider these user corrections when analyzing the image. The u
 
 Adjust your analysis accordingly and provide more accurate results based on this additional information.
 """
-                full_prompt = correction_prompt + base_prompt
-            else:
-                full_prompt = base_prompt
+            full_prompt = correction_prompt + base_prompt
+        else:
+            full_prompt = base_prompt
+        return full_prompt
 
-            response = self.gemini_model.generate_content([
-                {"mime_type": "image/jpeg", "data": image_data},
-                full_prompt
-            ])
-            
-            raw_text = response.text.strip()
-            logger.info(f"Gemini raw response: {raw_text}")
-            
-            # Extract JSON from response
-            json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-            if not json_match:
-                raise ValueError("No JSON found in Gemini response")
-                
-            analysis_data = json.loads(json_match.group())
-            return analysis_data
-            
-        except Exception as e:
-            logger.error(f"Gemini analysis failed: {e}")
-            raise
+    @staticmethod
+    def _parse_vision_response(raw_text: str) -> Dict:
+        parser = StreamingArrayParser("food_items")
+        parser.feed(raw_text)
+        return parser.result()
 
-    def apply_user_corrections(self, analysis: Dict, user_corrections: str) -> Dict:
-        """Apply user corrections to the analysis using Gemini."""
+    @staticmethod
+    def _vision_generation_config() -> Optional[Dict]:
+        if not GEMINI_STRUCTURED_OUTPUT:
+            return None
+        return {"response_mime_type": "application/json", "response_schema": VISION_RESPONSE_SCHEMA}
+
+    @staticmethod
+    def _chunk_text(chunk) -> str:
+        # Chunks that only carry a finish reason or safety ratings have no text parts
         try:
-            if not user_corrections or not user_corrections.strip():
-                return analysis
+            return chunk.text
+        except ValueError:
+            return ""
 
-            prompt = f"""
+    @staticmethod
+    def _correction_prompt(analysis: Dict, user_corrections: str) -> str:
+        prompt = f"""
 Original AI Analysis:
 {json.dumps(analysis, indent=2)}
 
@@ -125,91 +515,23 @@ Important:
 - If user mentions specific quantities, adjust the estimated_weight_grams accordingly
 - If user mentions additional items, add them to the food_items list
 """
+        return prompt
 
-            response = self.gemini_model.generate_content(prompt)
-            raw_text = response.text.strip()
-            
-            # Extract JSON from response
-            json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-            if json_match:
-                corrected_analysis = json.loads(json_match.group())
-                logger.info("Successfully applied user corrections")
-                return corrected_analysis
-            else:
-                logger.warning("Failed to parse corrected analysis, using original")
-                return analysis
-                
-        except Exception as e:
-            logger.error(f"Error applying user corrections: {e}")
-            return analysis
-
-    def process_user_corrections_manually(self, analysis: Dict, user_corrections: str) -> Dict:
-        """Manually process common user correction patterns for better accuracy."""
-        if not user_corrections or not user_corrections.strip():
+    @staticmethod
+    def _parse_correction_response(raw_text: str, analysis: Dict) -> Dict:
+        # Extract JSON from response
+        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
+        if json_match:
+            corrected_analysis = json.loads(json_match.group())
+            logger.info("Successfully applied user corrections")
+            return corrected_analysis
+        else:
+            logger.warning("Failed to parse corrected analysis, using original")
             return analysis
 
-        corrections_lower = user_corrections.lower()
-        food_items = analysis.get("food_items", [])
-        
-        # Common correction patterns
-        patterns = {
-            'quantity': r'(\d+)\s+(chapatis?|rotis?|breads?)',
-            'portion': r'(\d+(?:\.\d+)?)\s*(cups?|tablespoons?|teaspoons?|grams?|g)',
-            'additional': r'add\s+(.+)',
-            'correction': r'actually\s+(\d+)\s+instead\s+of\s+(\d+)',
-            'missing': r'missing:\s*(.+)'
-        }
-
-        # Apply quantity corrections
-        quantity_match = re.search(patterns['quantity'], corrections_lower)
-        if quantity_match:
-            try:
-                quantity = int(quantity_match.group(1))
-                food_name = quantity_match.group(2)
-                
-                for item in food_items:
-                    if food_name in item['name'].lower():
-                        # Adjust weight based on quantity
-                        original_weight = item.get('estimated_weight_grams', 100)
-                        # Avoid division by zero
-                        count = max(1, len(food_items)) # This logic seems flawed in original, keeping simple
-                        # Better logic: If we know unit weight, use it. Here we just scale? 
-                        # Assuming original weight was for "some" amount, now we scale it?
-                        # Let's just update the note for now to be safe
-                        item['user_corrected'] = True
-                        item['correction_notes'] = f"User corrected quantity to {quantity} items"
-                        
-                        # Heuristic: If name is singular and now plural, maybe multiply?
-                        # For safety, let's trust the AI correction more, this is just a flag setter
-                        break
-            except Exception as e:
-                logger.warning(f"Manual quantity correction failed: {e}")
-
-        # ... (Other manual patterns kept similar or improved slightly for safety) ...
-        # Add missing items
-        missing_match = re.search(patterns['missing'], corrections_lower)
-        if missing_match:
-            try:
-                missing_item = missing_match.group(1).strip()
-                food_items.append({
-                    "name": missing_item,
-                    "estimated_weight_grams": 100,  # Default estimate
-                    "description": f"Added based on user input: {missing_item}",
-                    "confidence_score": 100,
-                    "user_added": True
-                })
-            except Exception as e:
-                logger.warning(f"Manual missing item addition failed: {e}")
-
-        analysis["food_items"] = food_items
-        analysis["user_corrections_applied"] = True
-        
-        return analysis
-
-    def estimate_nutrition_with_gemini(self, food_name: str, weight_grams: float, description: str = "", cooking_method: str = "") -> Dict:
-        """Use Gemini to estimate nutrition when USDA data is not available."""
-        try:
-            prompt = f"""As a professional nutritionist, estimate the nutritional content for this food item:
+    @staticmethod
+    def _estimation_prompt(food_name: str, weight_grams: float, description: str = "", cooking_method: str = "") -> str:
+        prompt = f"""As a professional nutritionist, estimate the nutritional content for this food item:
 
 Food: {food_name}
 Cooking Method: {cooking_method}
@@ -232,31 +554,308 @@ Respond in PURE JSON format only:
 }}
 
 Important: Provide values for the exact portion size of {weight_grams} grams, not per 100g."""
+        return prompt
 
-            response = self.gemini_model.generate_content(prompt)
-            raw_text = response.text.strip()
-            
-            # Extract JSON from response
-            json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
-            if not json_match:
-                logger.warning(f"Failed to parse Gemini nutrition estimation for {food_name}")
-                return self.get_default_nutrition_estimate(food_name, weight_grams)
-                
-            nutrition_data = json.loads(json_match.group())
+    def _parse_estimation_response(self, raw_text: str, food_name: str, weight_grams: float,
+                                   cooking_method: str = "") -> Dict:
+        # Extract JSON from response
+        json_match = re.search(r'\{.*\}', raw_text, re.DOTALL)
+        if not json_match:
+            logger.warning(f"Failed to parse Gemini nutrition estimation for {food_name}")
+            return self.get_default_nutrition_estimate(food_name, weight_grams)
             
-            # Validate required fields
-            required_fields = ["calories", "protein", "fat", "carbohydrates"]
-            if all(field in nutrition_data for field in required_fields):
-                logger.info(f"Gemini nutrition estimation successful for {food_name}")
-                return nutrition_data
+        nutrition_data = json.loads(json_match.group())
+        
+        # Validate required fields
+        required_fields = ["calories", "protein", "fat", "carbohydrates"]
+        if all(field in nutrition_data for field in required_fields):
+            logger.info(f"Gemini nutrition estimation successful for {food_name}")
+            self.remember_estimate(food_name, cooking_method, weight_grams, nutrition_data)
+            return nutrition_data
+        else:
+            logger.warning(f"Incomplete Gemini nutrition data for {food_name}")
+            return self.get_default_nutrition_estimate(food_name, weight_grams)
+
+    @staticmethod
+    def _batch_estimation_prompt(food_items: List[Dict]) -> str:
+        listing = "\n".join(
+            f"- item_id {i}: {item['name']} | Cooking Method: {item.get('cooking_method', '')} | "
+            f"Description: {item.get('description', '')} | Portion Size: {item.get('estimated_weight_grams', 100)} grams"
+            for i, item in enumerate(food_items)
+        )
+        prompt = f"""As a professional nutritionist, estimate the nutritional content for each of these food items:
+
+{listing}
+
+Provide a realistic estimate of the nutritional values for each item's specific portion size.
+
+Respond with a PURE JSON array only, one object per item, echoing its item_id:
+
+[
+  {{
+    "item_id": 0,
+    "calories": 250,
+    "protein": 15.5,
+    "fat": 12.0,
+    "carbohydrates": 20.0,
+    "fiber": 3.5,
+    "sodium": 300.0,
+    "estimation_confidence": "high/medium/low",
+    "estimation_notes": "Brief explanation of how you estimated these values"
+  }}
+]
+
+Important: Provide values for each item's exact portion size in grams, not per 100g."""
+        return prompt
+
+    @staticmethod
+    def _parse_batch_estimation_response(raw_text: str) -> Dict[int, Dict]:
+        estimates_by_id = {}
+        # Extract JSON array from response
+        json_match = re.search(r'\[.*\]', raw_text, re.DOTALL)
+        if json_match:
+            for entry in json.loads(json_match.group()):
+                if isinstance(entry, dict) and "item_id" in entry:
+                    estimates_by_id[int(entry.pop("item_id"))] = entry
+        else:
+            logger.warning("Failed to parse batched Gemini nutrition estimation")
+        return estimates_by_id
+
+    def _validate_batch_estimates(self, food_items: List[Dict], estimates_by_id: Dict[int, Dict]) -> List[Dict]:
+        # Validate required fields per item; only invalid entries fall back to category defaults
+        required_fields = ["calories", "protein", "fat", "carbohydrates"]
+        results = []
+        for i, item in enumerate(food_items):
+            nutrition_data = estimates_by_id.get(i)
+            if nutrition_data and all(field in nutrition_data for field in required_fields):
+                self.remember_estimate(item["name"], item.get("cooking_method", ""),
+                                       item.get("estimated_weight_grams", 100), nutrition_data)
+                results.append(nutrition_data)
             else:
-                logger.warning(f"Incomplete Gemini nutrition data for {food_name}")
-                return self.get_default_nutrition_estimate(food_name, weight_grams)
+                logger.warning(f"Incomplete Gemini nutrition data for {item['name']}")
+                results.append(self.get_default_nutrition_estimate(item["name"], item.get("estimated_weight_grams", 100)))
+        
+        logger.info(f"Batched Gemini nutrition estimation for {len(food_items)} items")
+        return results
+
+    def analyze_food_with_gemini(self, image_data: bytes, user_corrections: str = "", mime_type: str = "image/jpeg",
+                                 on_item: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Use Gemini to identify food items with high accuracy, incorporating user corrections.
+        
+        The response is streamed; on_item is called with each food item as soon as it is complete,
+        while the model is still generating the rest of the analysis.
+        """
+        def stream(api_key: Optional[str]):
+            response = self._gemini_model_for(api_key).generate_content(
+                [{"mime_type": mime_type, "data": image_data}, self._vision_prompt(user_corrections)],
+                generation_config=self._vision_generation_config(),
+                request_options=self._gemini_request_options("gemini.vision"),
+                stream=True
+            )
+            
+            parser = StreamingArrayParser("food_items")
+            for chunk in response:
+                if deadlines.expired():
+                    raise DeadlineExceeded("Request deadline exceeded before the food items were identified")
+                for food_item in parser.feed(self._chunk_text(chunk)):
+                    if on_item is not None:
+                        on_item(food_item)
+            return response, parser
+        
+        try:
+            with span("gemini.vision"):
+                response, parser = self.gemini_quota.call(stream, name="gemini.vision")
+            record_tokens("vision", getattr(response, "usage_metadata", None))
+            logger.debug(f"Gemini raw response: {parser.text}")
+            
+            return parser.result()
+            
+        except Exception as e:
+            logger.error(f"Gemini analysis failed: {e}")
+            raise
+
+    @staticmethod
+    def _gemini_request_options(call: str) -> Dict:
+        """Per-call timeout of a Gemini request, capped by the request deadline."""
+        return {"timeout": deadlines.timeout_for(GEMINI_TIMEOUT_SECONDS, name=call)}
+
+    def _generate(self, prompt: str, call: str):
+        """One Gemini text call within the key quota, duplicated after GEMINI_HEDGE_AFTER_MS if it is slow to answer."""
+        def send(api_key: Optional[str]):
+            return self._gemini_model_for(api_key).generate_content(
+                prompt, request_options=self._gemini_request_options(call))
+        
+        def attempt():
+            return self.gemini_quota.call(send, name=call)
+        return deadlines.run(attempt, hedge_after=GEMINI_HEDGE_AFTER_MS / 1000, bounded=False, name=call)
+
+    def apply_user_corrections(self, analysis: Dict, user_corrections: str) -> Dict:
+        """Apply user corrections to the analysis: locally where the correction grammar covers them, else with Gemini."""
+        try:
+            if not user_corrections or not user_corrections.strip():
+                return analysis
+
+            with span("corrections.local"):
+                outcome = apply_corrections(analysis, user_corrections)
+            if not outcome.unparsed:
+                count(corrections_applied, path="local")
+                return outcome.analysis
+
+            # Gemini only sees what the grammar could not parse, on top of the local edits
+            count(corrections_applied, path="gemini")
+            with span("gemini.corrections"):
+                response = self._generate(self._correction_prompt(outcome.analysis, outcome.unparsed),
+                                          "gemini.corrections")
+            record_tokens("corrections", getattr(response, "usage_metadata", None))
+            return self._parse_correction_response(response.text.strip(), outcome.analysis)
+                
+        except Exception as e:
+            logger.error(f"Error applying user corrections: {e}")
+            return analysis
+
+    def process_user_corrections_manually(self, analysis: Dict, user_corrections: str) -> Dict:
+        """Re-apply the corrections the local grammar understands to an analysis Gemini already corrected.
+        
+        Only edits that are safe to repeat are applied: quantities the model did not convert into
+        weights are rescaled, but "one more roti" is not added a second time.
+        """
+        if not user_corrections or not user_corrections.strip():
+            return analysis
+
+        analysis = apply_corrections(analysis, user_corrections, repeat_safe_only=True).analysis
+        analysis["user_corrections_applied"] = True
+        return analysis
+
+    @staticmethod
+    def _estimate_key(food_name: str, cooking_method: str = "") -> str:
+        return ESTIMATE_KEY_PREFIX + (canonical_query(food_name, cooking_method) or food_name.strip().lower())
+
+    def cached_estimate(self, food_name: str, cooking_method: str, weight_grams: float) -> Optional[Dict]:
+        """An earlier Gemini estimate for this dish, scaled from per-100 g to weight_grams."""
+        if ESTIMATE_CACHE_TTL <= 0:
+            return None
+        cached = self.usda_cache.get(self._estimate_key(food_name, cooking_method))
+        record_cache("estimate", "miss" if cached is None else "hit")
+        if cached is None:
+            return None
+        nutrition = nutrient_dict(scale(nutrient_vector(cached["per_100g"]), weight_grams / 100))
+        nutrition["estimation_confidence"] = cached.get("estimation_confidence", "medium")
+        nutrition["estimation_notes"] = cached.get("estimation_notes", "")
+        return nutrition
+
+    def remember_estimate(self, food_name: str, cooking_method: str, weight_grams: float, nutrition: Dict) -> None:
+        """Cache a Gemini estimate normalized to per-100 g, so other portion sizes reuse it."""
+        if ESTIMATE_CACHE_TTL <= 0 or not weight_grams or weight_grams <= 0:
+            return
+        if not isinstance(nutrition.get("calories"), (int, float)):
+            return
+        self.usda_cache.set(self._estimate_key(food_name, cooking_method), {
+            "per_100g": nutrient_dict(scale(nutrient_vector(nutrition), 100 / weight_grams), digits=4),
+            "estimation_confidence": nutrition.get("estimation_confidence", "medium"),
+            "estimation_notes": nutrition.get("estimation_notes", "")
+        }, ttl_seconds=ESTIMATE_CACHE_TTL)
+
+    @staticmethod
+    def _for_portion(nutrition: Dict, estimated_grams: float, weight_grams: float) -> Dict:
+        """An estimate made for one portion size, rescaled to another (a copy either way)."""
+        if not estimated_grams or estimated_grams == weight_grams:
+            return dict(nutrition)
+        nutrients, extras = split_nutrition(nutrition)
+        portion_nutrition = nutrient_dict(scale(nutrients, weight_grams / estimated_grams))
+        portion_nutrition.update(extras)
+        return portion_nutrition
+
+    def estimate_nutrition_with_gemini(self, food_name: str, weight_grams: float, description: str = "", cooking_method: str = "") -> Dict:
+        """Use Gemini to estimate nutrition when USDA data is not available.
+        
+        Concurrent estimates of the same dish share one Gemini call, rescaled to each portion.
+        """
+        try:
+            return self._estimate_with_gemini(food_name, weight_grams, description, cooking_method)
                 
         except Exception as e:
             logger.warning(f"Gemini nutrition estimation failed for {food_name}: {e}")
             return self.get_default_nutrition_estimate(food_name, weight_grams)
 
+    def _estimate_with_gemini(self, food_name: str, weight_grams: float, description: str = "",
+                              cooking_method: str = "") -> Dict:
+        """estimate_nutrition_with_gemini without the fallback; errors, DeadlineExceeded included, propagate."""
+        cached = self.cached_estimate(food_name, cooking_method, weight_grams)
+        if cached is not None:
+            return cached
+        nutrition, estimated_grams = self.estimate_flight.do(
+            self._estimate_key(food_name, cooking_method), self._request_estimate,
+            food_name, weight_grams, description, cooking_method)
+        return self._for_portion(nutrition, estimated_grams, weight_grams)
+
+    def _request_estimate(self, food_name: str, weight_grams: float, description: str,
+                          cooking_method: str) -> Tuple[Dict, float]:
+        """One Gemini estimate, with the portion size it was made for."""
+        prompt = self._estimation_prompt(food_name, weight_grams, description, cooking_method)
+        with span("gemini.estimate", food=food_name):
+            response = self._generate(prompt, "gemini.estimate")
+        record_tokens("estimate", getattr(response, "usage_metadata", None))
+        return self._parse_estimation_response(response.text.strip(), food_name, weight_grams, cooking_method), weight_grams
+
+    def _split_cached_estimates(self, food_items: List[Dict]) -> Tuple[List[Optional[Dict]], List[int]]:
+        """Cached estimates for the items (None where missing) and the indices still to estimate."""
+        estimates = [self.cached_estimate(item["name"], item.get("cooking_method", ""),
+                                          item.get("estimated_weight_grams", 100)) for item in food_items]
+        return estimates, [i for i, estimate in enumerate(estimates) if estimate is None]
+
+    def estimate_nutrition_batch_with_gemini(self, food_items: List[Dict]) -> List[Dict]:
+        """Estimate nutrition for several USDA misses in one Gemini call, keeping the input order.
+        
+        Dishes estimated before are served from the per-100 g estimate cache instead, and dishes
+        another request is estimating right now wait for that estimate.
+        """
+        estimates, pending = self._split_cached_estimates(food_items)
+        if pending:
+            items = [food_items[i] for i in pending]
+            shared = self.estimate_flight.do_many(
+                self._estimate_keys(items), lambda led: self._estimate_portions([items[i] for i in led]))
+            for i, item, (nutrition, estimated_grams) in zip(pending, items, shared):
+                estimates[i] = self._for_portion(nutrition, estimated_grams, item.get("estimated_weight_grams", 100))
+        return estimates
+
+    def _estimate_keys(self, food_items: List[Dict]) -> List[str]:
+        return [self._estimate_key(item["name"], item.get("cooking_method", "")) for item in food_items]
+
+    def _estimate_portions(self, food_items: List[Dict]) -> List[Tuple[Dict, float]]:
+        """Uncached estimates for the items, each with the portion size it was made for."""
+        return [(estimate, item.get("estimated_weight_grams", 100))
+                for estimate, item in zip(self._estimate_batch_uncached(food_items), food_items)]
+
+    def _estimate_batch_uncached(self, food_items: List[Dict]) -> List[Dict]:
+        """Gemini estimates for the items; failures fall back to category defaults, but DeadlineExceeded propagates."""
+        if not food_items:
+            return []
+        if len(food_items) == 1:
+            item = food_items[0]
+            try:
+                return [self._estimate_with_gemini(
+                    item["name"], item.get("estimated_weight_grams", 100),
+                    item.get("description", ""), item.get("cooking_method", "")
+                )]
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                logger.warning(f"Gemini nutrition estimation failed for {item['name']}: {e}")
+                return [self.get_default_nutrition_estimate(item["name"], item.get("estimated_weight_grams", 100))]
+        
+        estimates_by_id = {}
+        try:
+            with span("gemini.estimate_batch", items=len(food_items)):
+                response = self._generate(self._batch_estimation_prompt(food_items), "gemini.estimate_batch")
+            record_tokens("estimate_batch", getattr(response, "usage_metadata", None))
+            estimates_by_id = self._parse_batch_estimation_response(response.text.strip())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"Batched Gemini nutrition estimation failed: {e}")
+        
+        return self._validate_batch_estimates(food_items, estimates_by_id)
+
     def get_default_nutrition_estimate(self, food_name: str, weight_grams: float) -> Dict:
         """Provide reasonable default estimates based on food category."""
         # Common food category estimates (per 100g)
@@ -271,62 +870,193 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
             "default": {"calories": 100, "protein": 5, "fat": 5, "carbohydrates": 10, "fiber": 1}
         }
         
-        # Determine food category
-        food_lower = food_name.lower()
-        category = "default"
-        
-        if any(word in food_lower for word in ["vegetable", "salad", "broccoli", "spinach", "carrot", "lettuce"]):
-            category = "vegetable"
-        elif any(word in food_lower for word in ["fruit", "apple", "banana", "orange", "berry"]):
-            category = "fruit"
-        elif any(word in food_lower for word in ["beef", "pork", "lamb", "steak"]):
-            category = "meat"
-        elif any(word in food_lower for word in ["chicken", "turkey"]):
-            category = "poultry"
-        elif any(word in food_lower for word in ["fish", "salmon", "tuna", "shrimp"]):
-            category = "fish"
-        elif any(word in food_lower for word in ["rice", "pasta", "bread", "grain", "cereal"]):
-            category = "grain"
-        elif any(word in food_lower for word in ["milk", "cheese", "yogurt", "dairy"]):
-            category = "dairy"
+        # Determine food category: the earliest category in CATEGORY_KEYWORDS with a keyword in the name
+        matched = {CATEGORY_BY_KEYWORD[keyword] for keyword in CATEGORY_PATTERN.findall(food_name.lower())}
+        category = next((name for name, _ in CATEGORY_KEYWORDS if name in matched), "default")
         
         # Calculate for portion size
         multiplier = weight_grams / 100
-        estimate = category_estimates[category]
-        
-        portion_nutrition = {}
-        for key, value in estimate.items():
-            portion_nutrition[key] = round(value * multiplier, 2)
+        portion_nutrition = nutrient_dict(scale(nutrient_vector(category_estimates[category]), multiplier))
         
         portion_nutrition["estimation_confidence"] = "low"
         portion_nutrition["estimation_notes"] = f"Estimated based on {category} category averages"
         
         return portion_nutrition
 
+    def lookup_usda_locally(self, query: str, food_name: str) -> Optional[Dict]:
+        """Serve a USDA lookup from the cache or the offline FDC index, without network access.
+        
+        Returns USDA_MISS when the query is known to have no FoodData Central match.
+        """
+        # Check cache first
+        key = self.usda_cache_key(query)
+        cached = self.usda_cache.get(key)
+        if cached is None:
+            record_cache("usda", "miss")
+        else:
+            record_cache("usda", "negative_hit" if self.is_usda_miss(cached) else "hit")
+            return cached
+        
+        # Then a close match among earlier queries ("grilled chiken breast" for "grilled chicken breast")
+        match = self.query_index.match(key)
+        if match:
+            matched_key, score = match
+            cached = self.usda_cache.get(matched_key)
+            if cached is not None and not self.is_usda_miss(cached):
+                record_cache("query_index", "hit")
+                logger.info(f"Fuzzy cache match for {query}: '{matched_key}' (score {score})")
+                self.remember_usda_result(query, cached)
+                return cached
+            # The matched entry expired or was evicted from the cache
+            self.query_index.discard(matched_key)
+        record_cache("query_index", "miss")
+        
+        # Try the offline index next, for the detailed query and then the bare food name
+        if self.fdc_index is not None:
+            with span("fdc_index.lookup"):
+                for local_query in dict.fromkeys([query, food_name.strip()]):
+                    local_match = self.fdc_index.lookup(local_query)
+                    if local_match:
+                        self.remember_usda_result(query, local_match)
+                        record_cache("fdc_index", "hit")
+                        logger.info(f"Local FDC index match for {query}: {local_match['food_name']}")
+                        return local_match
+            record_cache("fdc_index", "miss")
+        return None
+
+    @staticmethod
+    def usda_cache_key(query: str) -> str:
+        """Cache key of a USDA query: case, word order, plurals, stop words and synonyms do not matter."""
+        return canonical_query(query) or query.strip().lower()
+
+    @staticmethod
+    def is_usda_miss(cached) -> bool:
+        return isinstance(cached, dict) and bool(cached.get("usda_miss"))
+
+    def remember_usda_miss(self, query: str) -> None:
+        """Remember that a search found nothing, for USDA_MISS_TTL, so it is not repeated."""
+        if USDA_MISS_TTL > 0:
+            self.usda_cache.set(self.usda_cache_key(query), USDA_MISS, ttl_seconds=USDA_MISS_TTL)
+
+    def remember_usda_result(self, query: str, nutrients: Dict) -> None:
+        """Cache a USDA result under its canonical query and make it available to fuzzy matches."""
+        key = self.usda_cache_key(query)
+        self.usda_cache.set(key, nutrients)
+        self.query_index.add(key)
+
+    def search_usda_food(self, query: str) -> Optional[Dict]:
+        """Run one FDC search and pick the best candidate food (None if nothing matched).
+        
+        Concurrent searches for the same canonical query share one request.
+        """
+        return self.usda_flight.do(self.usda_cache_key(query), self._search_usda_food, query)
+
+    def _search_usda_food(self, query: str) -> Optional[Dict]:
+        params = {
+            "query": query,
+            "pageSize": 5,
+            "dataType": ["Foundation", "SR Legacy", "Survey (FNDDS)"], # Added Survey data for prepared foods
+            "sortBy": "dataType.keyword"
+        }
+        
+        def send(api_key: Optional[str]):
+            return self._check_rate_limit(self.http_session.get(
+                f"{USDA_API_BASE_URL}/foods/search", params=dict(params, api_key=api_key),
+                timeout=deadlines.timeout_for(10, name="usda.search")))
+        
+        def attempt():
+            return self.usda_quota.call(send, name="usda.search")
+        
+        # Transient failures (5xx, timeouts) are retried with jittered backoff by the session, 429s by the quota scheduler
+        with span("usda.search"):
+            response = deadlines.run(attempt, hedge_after=USDA_HEDGE_AFTER_MS / 1000, bounded=False, name="usda.search")
+        self._count_retries(response, "search")
+        response.raise_for_status()
+        data = response.json()
+        
+        return self._pick_best_food(data.get("foods") or [])
+
+    @staticmethod
+    def _check_rate_limit(response):
+        """Raise RateLimited for a 429 response so the quota scheduler backs off and retries it."""
+        if response.status_code == 429:
+            retry_after = response.headers.get("Retry-After")
+            raise RateLimited(f"429 from {response.url}",
+                              float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return response
+
+    @staticmethod
+    def _count_retries(response, endpoint: str) -> None:
+        # urllib3 keeps the retry history of the request on the raw response
+        retries = getattr(getattr(response, "raw", None), "retries", None)
+        count(usda_retries, len(getattr(retries, "history", None) or ()), endpoint=endpoint)
+
+    @staticmethod
+    def _pick_best_food(foods: List[Dict]) -> Optional[Dict]:
+        """Pick the best FDC search match from a result page."""
+        best_food = None
+        for food in foods:
+            # Prefer Foundation foods or Survey foods (good for mixed dishes)
+            if food.get("dataType") in ["Foundation", "Survey (FNDDS)"]:
+                best_food = food
+                break
+            elif best_food is None:
+                best_food = food
+        return best_food
+
+    def fetch_usda_food_details(self, fdc_ids: List[int]) -> Dict[int, Dict]:
+        """Fetch full FDC records for several foods with the bulk /foods endpoint, keyed by fdcId."""
+        details = {}
+        unique_ids = list(dict.fromkeys(fdc_id for fdc_id in fdc_ids if fdc_id))
+        # The endpoint accepts at most 20 ids per request
+        for start in range(0, len(unique_ids), 20):
+            chunk = unique_ids[start:start + 20]
+            def send(api_key: Optional[str], chunk: List[int] = chunk):
+                return self._check_rate_limit(self.http_session.post(
+                    f"{USDA_API_BASE_URL}/foods",
+                    params={"api_key": api_key},
+                    json={"fdcIds": chunk, "format": "full"},
+                    timeout=deadlines.timeout_for(10, name="usda.details")
+                ))
+            
+            with span("usda.details", foods=len(chunk)):
+                response = self.usda_quota.call(send, name="usda.details")
+            self._count_retries(response, "details")
+            response.raise_for_status()
+            for food in response.json():
+                details[int(food["fdcId"])] = food
+        return details
+
+    def _usda_record(self, best_food: Dict, food_name: str, details: Optional[Dict] = None) -> Dict:
+        """Build the cached USDA record from a search match, enriched by its full details if available."""
+        # Extract nutrients by FDC nutrient number
+        nutrients = nutrients_from_fdc_food(best_food)
+        if details:
+            nutrients.update(nutrients_from_fdc_food(details))
+        
+        # Add food details
+        nutrients["food_name"] = best_food.get("description", food_name)
+        nutrients["serving_size"] = best_food.get("servingSize", 100)
+        nutrients["serving_unit"] = best_food.get("servingSizeUnit", "g")
+        nutrients["fdc_id"] = best_food.get("fdcId")
+        nutrients["data_source"] = "USDA"
+        return nutrients
+
     def fetch_usda_nutrition(self, food_name: str, cooking_method: str = "") -> Optional[Dict]:
         """Fetch comprehensive nutrition data from USDA API with improved search."""
         try:
             # Construct a better query
             query = f"{cooking_method} {food_name}".strip()
             
-            # Check cache first
-            if query in self.usda_cache:
-                return self.usda_cache[query]
-                
-            url = "https://api.nal.usda.gov/fdc/v1/foods/search"
-            params = {
-                "query": query,
-                "api_key": USDA_API_KEY,
-                "pageSize": 5,
-                "dataType": ["Foundation", "SR Legacy", "Survey (FNDDS)"], # Added Survey data for prepared foods
-                "sortBy": "dataType.keyword"
-            }
+            local = self.lookup_usda_locally(query, food_name)
+            if local is not None and not self.is_usda_miss(local):
+                return local
             
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if "foods" not in data or not data["foods"]:
+            # A remembered miss skips the search but still falls back to the name-only query
+            best_food = self.search_usda_food(query) if local is None else None
+            if not best_food:
+                if local is None:
+                    self.remember_usda_miss(query)
                 # Retry with just the food name if specific query fails
                 if cooking_method:
                     logger.info(f"Detailed search failed, retrying with just: {food_name}")
@@ -335,61 +1065,89 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
                 logger.warning(f"No USDA data found for: {query}")
                 return None
             
-            # Find the best match
-            best_food = None
-            for food in data["foods"]:
-                # Prefer Foundation foods or Survey foods (good for mixed dishes)
-                if food.get("dataType") in ["Foundation", "Survey (FNDDS)"]:
-                    best_food = food
-                    break
-                elif best_food is None:
-                    best_food = food
-            
-            if not best_food:
-                return None
-            
-            # Extract nutrients
-            nutrients = {}
-            for nutrient in best_food.get("foodNutrients", []):
-                nutrient_id = str(nutrient.get("nutrientNumber", ""))
-                nutrient_name = nutrient.get("nutrientName", "").lower()
-                value = nutrient.get("value", 0)
-                unit = nutrient.get("unitName", "")
-                
-                # Map to standard nutrient names
-                if nutrient_id == "1008" or "energy" in nutrient_name or "calories" in nutrient_name:
-                    if unit.lower() in ["kcal", "calories"]:
-                        nutrients["calories"] = float(value)
-                elif nutrient_id == "1003" or "protein" in nutrient_name:
-                    nutrients["protein"] = float(value)
-                elif nutrient_id == "1004" or "fat" in nutrient_name or "lipid" in nutrient_name:
-                    nutrients["fat"] = float(value)
-                elif nutrient_id == "1005" or "carbohydrate" in nutrient_name:
-                    nutrients["carbohydrates"] = float(value)
-                elif nutrient_id == "1079" or "fiber" in nutrient_name:
-                    nutrients["fiber"] = float(value)
-                elif nutrient_id == "1093" or "sodium" in nutrient_name:
-                    nutrients["sodium"] = float(value)
-                elif nutrient_id == "1087" or "calcium" in nutrient_name:
-                    nutrients["calcium"] = float(value)
-                elif nutrient_id == "1089" or "iron" in nutrient_name:
-                    nutrients["iron"] = float(value)
-            
-            # Add food details
-            nutrients["food_name"] = best_food.get("description", food_name)
-            nutrients["serving_size"] = best_food.get("servingSize", 100)
-            nutrients["serving_unit"] = best_food.get("servingSizeUnit", "g")
-            nutrients["data_source"] = "USDA"
+            nutrients = self._usda_record(best_food, food_name)
             
             # Cache the result
-            self.usda_cache[query] = nutrients
+            self.remember_usda_result(query, nutrients)
             logger.info(f"USDA data found for {query}: {nutrients.get('calories', 0)} calories")
             return nutrients
             
+        except DeadlineExceeded:
+            # Not a failed lookup: the caller degrades the item instead of treating it as a USDA miss
+            raise
         except Exception as e:
             logger.warning(f"USDA API failed for {food_name}: {e}")
             return None
 
+    def fetch_usda_nutrition_many(self, food_items: List[Dict], limit: Optional[threading.Semaphore] = None) -> List[Optional[Dict]]:
+        """Bulk USDA path: concurrent searches pick candidates, then one /foods call fetches their full details."""
+        def pick(food_item: Dict):
+            food_name = food_item["name"]
+            cooking_method = food_item.get("cooking_method", "")
+            query = f"{cooking_method} {food_name}".strip()
+            local = self.lookup_usda_locally(query, food_name)
+            if local is not None and not self.is_usda_miss(local):
+                return query, local, None
+            with limit or nullcontext():
+                try:
+                    best_food = self.search_usda_food(query) if local is None else None
+                    if not best_food and local is None:
+                        self.remember_usda_miss(query)
+                    if not best_food and cooking_method:
+                        # The bare name may already be cached or indexed, or known to have no match
+                        name_local = self.lookup_usda_locally(food_name, food_name)
+                        if name_local is not None and not self.is_usda_miss(name_local):
+                            return query, name_local, None
+                        if name_local is None:
+                            logger.info(f"Detailed search failed, retrying with just: {food_name}")
+                            best_food = self.search_usda_food(food_name)
+                            if not best_food:
+                                self.remember_usda_miss(food_name)
+                except Exception as e:
+                    logger.warning(f"USDA API failed for {food_name}: {e}")
+                    best_food = None
+            return query, None, best_food
+        
+        workers = max(1, min(self.max_workers, len(food_items)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nutrition") as executor:
+            picks = [future.result() for future in
+                     [submit_in_context(executor, pick, food_item) for food_item in food_items]]
+        
+        details = {}
+        candidates = [best_food.get("fdcId") for _, _, best_food in picks if best_food]
+        if candidates:
+            try:
+                with limit or nullcontext():
+                    details = self.fetch_usda_food_details(candidates)
+            except Exception as e:
+                # Search results already carry nutrients, so details only enrich them
+                logger.warning(f"USDA bulk details request failed: {e}")
+        
+        results = []
+        for food_item, (query, local, best_food) in zip(food_items, picks):
+            if local is not None:
+                results.append(local)
+            elif best_food:
+                nutrients = self._usda_record(best_food, food_item["name"], details.get(best_food.get("fdcId")))
+                self.remember_usda_result(query, nutrients)
+                results.append(nutrients)
+            else:
+                logger.warning(f"No USDA data found for: {query}")
+                results.append(None)
+        return results
+
+    def get_cache_stats(self) -> Dict:
+        """Return hit/miss statistics for the USDA nutrition cache."""
+        return self.usda_cache.stats()
+
+    def get_single_flight_stats(self) -> Dict:
+        """Calls and the share of them served by another caller's in-flight request, per upstream."""
+        return {flight.name: flight.stats() for flight in (self.usda_flight, self.estimate_flight)}
+
+    def get_quota_stats(self) -> Dict:
+        """Queued calls and each key's current rate, tokens and pause, per API key pool."""
+        return {quota.name: quota.stats() for quota in (self.gemini_quota, self.usda_quota)}
+
     def calculate_portion_nutrition(self, usda_data: Dict, weight_grams: float) -> Dict:
         """Calculate nutrition for the specific portion size."""
         if not usda_data:
@@ -404,205 +1162,705 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
             
         multiplier = weight_grams / base_serving
         
-        portion_nutrition = {}
-        for key, value in usda_data.items():
-            if isinstance(value, (int, float)) and key not in ["serving_size"]:
-                portion_nutrition[key] = round(value * multiplier, 2)
-        
+        # Only the tracked nutrients scale with the portion (not fdc_id or serving metadata)
+        portion_nutrition = nutrient_dict(scale(nutrient_vector(usda_data), multiplier))
         portion_nutrition["portion_size_grams"] = weight_grams
         portion_nutrition["data_source"] = usda_data.get("data_source", "USDA")
         return portion_nutrition
 
-    def get_calories_from_image(self, image_path: Union[str, Path], user_corrections: str = "") -> Dict:
-        """Main function to get accurate calorie analysis from image with user corrections."""
+    def lookup_usda_for_item(self, food_item: Dict) -> Optional[Dict]:
+        """USDA lookup for one identified food item."""
+        food_name = food_item["name"]
+        cooking_method = food_item.get("cooking_method", "")
+        logger.info(f"Fetching nutrition data for: {food_name} ({cooking_method})")
+        with span("usda.lookup", food=food_name):
+            return self.fetch_usda_nutrition(food_name, cooking_method)
+
+    def estimate_nutrition_locally(self, food_item: Dict) -> Optional[Dict]:
+        """Portion nutrition from the local food table, or None when no dish matches well enough."""
+        if self.food_table is None:
+            return None
+        with span("food_table.lookup", food=food_item["name"]):
+            match = self.food_table.match(food_item["name"], food_item.get("cooking_method", ""),
+                                          min_score=FOOD_TABLE_MIN_SCORE)
+        record_cache("food_table", "miss" if match is None else "hit")
+        if match is None:
+            return None
+        
+        weight_grams = food_item.get("estimated_weight_grams", 100)
+        portion_nutrition = nutrient_dict(scale(nutrient_vector(match["nutrients"]), weight_grams / 100))
+        portion_nutrition["portion_size_grams"] = weight_grams
+        portion_nutrition["data_source"] = LOCAL_TABLE_SOURCE
+        portion_nutrition["estimation_confidence"] = "medium"
+        portion_nutrition["estimation_notes"] = (
+            f"Per-100 g values of '{match['name']}' from the local food table (match score {match['score']})"
+        )
+        return portion_nutrition
+
+    def detailed_item_without_llm(self, food_item: Dict, usda_data: Optional[Dict]) -> Optional[Dict]:
+        """Result entry from USDA data or the local food table; None when only Gemini can estimate it."""
+        if usda_data:
+            return self.build_detailed_item(food_item, usda_data=usda_data)
+        local_nutrition = self.estimate_nutrition_locally(food_item)
+        if local_nutrition:
+            return self.build_detailed_item(food_item, estimated_nutrition=local_nutrition)
+        return None
+
+    def resolve_food_item(self, food_item: Dict) -> Dict:
+        """Resolve nutrition for a single identified food item (USDA, the local food table, then Gemini,
+        then category defaults)."""
+        usda_deadline = self._usda_deadline()
+        timed_out = False
         try:
-            # Validate image file
-            image_path = Path(image_path)
-            if not image_path.exists():
-                return {"error": "Image file not found", "success": False}
-            
-            with open(image_path, "rb") as image:
-                image_data = image.read()
+            with deadline_at(usda_deadline):
+                usda_data = self.lookup_usda_for_item(food_item)
+        except DeadlineExceeded as e:
+            logger.warning(f"USDA lookup for {food_item['name']} ran out of time: {e}")
+            usda_data, timed_out = None, True
+        usda_degraded = "usda_deadline" if not usda_data and (timed_out or self._passed(usda_deadline)) else None
+        detailed_item = self.detailed_item_without_llm(food_item, usda_data)
+        if detailed_item:
+            return self._mark_degraded(detailed_item, usda_degraded)
+        
+        estimates, reason = self._estimate_misses([food_item])
+        return self._mark_degraded(self.build_detailed_item(food_item, estimated_nutrition=estimates[0]),
+                                   reason or usda_degraded)
+
+    @staticmethod
+    def _usda_deadline() -> Optional[float]:
+        """End of the USDA stage: the request deadline less the share reserved for Gemini estimates."""
+        left = deadlines.remaining()
+        if left is None:
+            return None
+        return time.monotonic() + left - min(DEADLINE_ESTIMATE_RESERVE_MS / 1000, left / 2)
+
+    @staticmethod
+    def _passed(deadline: Optional[float]) -> bool:
+        return deadline is not None and time.monotonic() >= deadline
+
+    @staticmethod
+    def _mark_degraded(detailed_item: Dict, reason: Optional[str]) -> Dict:
+        """Record on a result item that the deadline pushed it down to a cheaper nutrition source."""
+        if reason:
+            detailed_item["degraded"] = reason
+        return detailed_item
+
+    def _estimate_misses(self, food_items: List[Dict],
+                         limit: Optional[threading.Semaphore] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Gemini estimates for USDA misses, or category defaults and a degradation reason once the budget is spent."""
+        if not deadlines.expired():
+            try:
+                with limit or nullcontext():
+                    return deadlines.run(self.estimate_nutrition_batch_with_gemini, food_items,
+                                         name="gemini.estimate_batch"), None
+            except DeadlineExceeded as e:
+                logger.warning(f"Falling back to category defaults for {len(food_items)} items: {e}")
+        return [self.get_default_nutrition_estimate(item["name"], item.get("estimated_weight_grams", 100))
+                for item in food_items], "estimate_deadline"
+
+    def build_detailed_item(self, food_item: Dict, usda_data: Optional[Dict] = None,
+                            estimated_nutrition: Optional[Dict] = None) -> Dict:
+        """Build the result entry for a food item from its USDA data or its nutrition estimate."""
+        food_name = food_item["name"]
+        weight_grams = food_item.get("estimated_weight_grams", 100)
+        
+        if usda_data:
+            # Use USDA data
+            record = FoodRecord.from_food_item(
+                food_item, "USDA", self.calculate_portion_nutrition(usda_data, weight_grams),
+                details={"usda_reference": {
+                    "food_name": usda_data.get("food_name", food_name),
+                    "serving_size": usda_data.get("serving_size"),
+                    "serving_unit": usda_data.get("serving_unit")
+                }}
+            )
+        else:
+            # Gemini estimation (or its category-average fallback)
+            gemini_nutrition = estimated_nutrition or self.get_default_nutrition_estimate(food_name, weight_grams)
             
-            # Step 1: Analyze image with Gemini
-            logger.info("Analyzing image with Gemini AI...")
-            analysis = self.analyze_food_with_gemini(image_data)
+            if gemini_nutrition.get("data_source") == LOCAL_TABLE_SOURCE:
+                data_source = LOCAL_TABLE_SOURCE
+            elif gemini_nutrition.get("estimation_confidence") != "low":
+                data_source = "Gemini AI Estimation"
+            else:
+                data_source = "Category Estimate"
             
-            # Step 2: Apply user corrections if provided
-            if user_corrections and user_corrections.strip():
-                logger.info("Applying user corrections...")
-                # Try AI-based correction first, then fallback to manual processing
-                analysis = self.apply_user_corrections(analysis, user_corrections)
-                analysis = self.process_user_corrections_manually(analysis, user_corrections)
+            record = FoodRecord.from_food_item(
+                food_item, data_source, gemini_nutrition,
+                details={
+                    "estimation_confidence": gemini_nutrition.get("estimation_confidence", "low"),
+                    "estimation_notes": gemini_nutrition.get("estimation_notes", "")
+                }
+            )
+        
+        return record.to_dict()
+
+    @staticmethod
+    def _lookup_key(food_item: Dict) -> Tuple[str, str]:
+        """What a USDA lookup depends on, so early lookups can be matched to the final items."""
+        return food_item.get("name", ""), food_item.get("cooking_method", "")
+
+    def _limited_lookup(self, limit: Optional[threading.Semaphore]) -> Callable[[Dict], Optional[Dict]]:
+        if limit is None:
+            return self.lookup_usda_for_item
+        
+        # Batch runs share one nutrition-lookup limit across every image in flight
+        def lookup(food_item: Dict) -> Optional[Dict]:
+            with limit:
+                return self.lookup_usda_for_item(food_item)
+        return lookup
+
+    def iter_resolved_food_items(self, food_items: List[Dict], limit: Optional[threading.Semaphore] = None,
+                                 prefetched: Optional[Dict[Tuple[str, str], Future]] = None) -> Iterator[Tuple[int, Dict]]:
+        """Yield (index, detailed_item) pairs in the order their nutrition comes back.
+        
+        USDA hits and local food table matches stream out as each lookup finishes; the
+        remaining misses follow together once their single batched Gemini estimate returns. prefetched maps _lookup_key values to
+        lookups already started while the vision response was streaming.
+        
+        Under a request deadline, USDA lookups get the budget less DEADLINE_ESTIMATE_RESERVE_MS.
+        Items still waiting on USDA then fall through to the local table and Gemini, and items
+        still waiting on Gemini at the deadline get category defaults; both are marked "degraded".
+        """
+        if not food_items:
+            return
+        
+        usda_deadline = self._usda_deadline()
+        limited_lookup = self._limited_lookup(limit)
+        
+        def lookup(food_item: Dict) -> Optional[Dict]:
+            with deadline_at(usda_deadline):
+                return limited_lookup(food_item)
+        
+        prefetched = dict(prefetched or {})
+        misses = []
+        degraded = {}
+        
+        def resolved(index: int, usda_data: Optional[Dict], timed_out: bool = False) -> Iterator[Tuple[int, Dict]]:
+            if not usda_data and (timed_out or self._passed(usda_deadline)):
+                degraded[index] = "usda_deadline"
+            detailed_item = self.detailed_item_without_llm(food_items[index], usda_data)
+            if detailed_item:
+                yield index, self._mark_degraded(detailed_item, degraded.get(index))
+            else:
+                misses.append(index)
+        
+        def settled(index: int, result: Callable[[], Optional[Dict]]) -> Iterator[Tuple[int, Dict]]:
+            # A lookup that hit the deadline degrades its item rather than failing the whole request
+            try:
+                usda_data = result()
+            except DeadlineExceeded as e:
+                logger.warning(f"USDA lookup for {food_items[index]['name']} ran out of time: {e}")
+                return resolved(index, None, timed_out=True)
+            return resolved(index, usda_data)
+        
+        # Each USDA lookup is dominated by network waits, so threads overlap them well
+        # and latency tracks the slowest item instead of the sum of all items.
+        workers = max(1, min(self.max_workers, len(food_items)))
+        if self.usda_bulk_details and not prefetched:
+            with deadline_at(usda_deadline):
+                bulk = self.fetch_usda_nutrition_many(food_items, limit)
+            for i, usda_data in enumerate(bulk):
+                yield from resolved(i, usda_data)
+        elif workers == 1 and not prefetched:
+            for i, food_item in enumerate(food_items):
+                if self._passed(usda_deadline):
+                    yield from resolved(i, None)
+                else:
+                    yield from settled(i, partial(lookup, food_item))
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nutrition")
+            futures = {}
+            try:
+                for i, food_item in enumerate(food_items):
+                    future = prefetched.pop(self._lookup_key(food_item), None)
+                    futures[future or submit_in_context(executor, lookup, food_item)] = i
+                timeout = None if usda_deadline is None else max(0.0, usda_deadline - time.monotonic())
+                try:
+                    for future in as_completed(futures, timeout=timeout):
+                        yield from settled(futures.pop(future), future.result)
+                except TimeoutError:
+                    # Lookups still running at the USDA deadline are abandoned, not waited for
+                    logger.warning(f"USDA deadline passed with {len(futures)} lookups pending")
+                    for i in sorted(futures.values()):
+                        yield from resolved(i, None)
+            finally:
+                executor.shutdown(wait=not futures, cancel_futures=True)
+        
+        # Misses the local table cannot cover are estimated in a single Gemini round trip
+        if misses:
+            misses.sort()
+            batch, reason = self._estimate_misses([food_items[i] for i in misses], limit)
+            for i, estimated in zip(misses, batch):
+                detailed_item = self.build_detailed_item(food_items[i], estimated_nutrition=estimated)
+                yield i, self._mark_degraded(detailed_item, reason or degraded.get(i))
+
+    def resolve_food_items(self, food_items: List[Dict], limit: Optional[threading.Semaphore] = None) -> List[Dict]:
+        """Resolve nutrition for all food items in parallel, keeping the input order."""
+        detailed_items = [None] * len(food_items)
+        for i, detailed_item in self.iter_resolved_food_items(food_items, limit):
+            detailed_items[i] = detailed_item
+        return detailed_items
+
+    @staticmethod
+    def sum_nutrition(detailed_items: Iterable[Dict]) -> Dict:
+        """Total the headline nutrients over resolved items, rounded as in the result schema."""
+        return totals_of(detailed_items, TOTAL_NUTRIENTS)
+
+    def build_result(self, analysis: Dict, detailed_items: List[Dict], user_corrections: str = "") -> Dict:
+        """Aggregate resolved food items into the final result schema."""
+        # Per-item nutrients are stacked into one matrix and summed column-wise
+        total_nutrition = self.sum_nutrition(detailed_items)
+        
+        usda_items_found = 0
+        local_table_items = 0
+        gemini_estimated_items = 0
+        default_estimated_items = 0
+        user_corrected_items = 0
+        degraded_items = []
+        
+        for index, detailed_item in enumerate(detailed_items):
+            data_source = detailed_item["data_source"]
+            if data_source == "USDA":
+                usda_items_found += 1
+            elif data_source == LOCAL_TABLE_SOURCE:
+                local_table_items += 1
+            elif data_source == "Gemini AI Estimation":
+                gemini_estimated_items += 1
+            else:
+                default_estimated_items += 1
             
-            # Step 3: Get nutrition data for each food
-            detailed_items = []
-            total_nutrition = {
-                "calories": 0, "protein": 0, "fat": 0, 
-                "carbohydrates": 0, "fiber": 0, "sodium": 0
+            if detailed_item.get("user_corrected") or detailed_item.get("user_added"):
+                user_corrected_items += 1
+            if detailed_item.get("degraded"):
+                degraded_items.append({"index": index, "name": detailed_item["name"],
+                                       "reason": detailed_item["degraded"]})
+        
+        # Step 4: Generate health insights
+        health_insights = self.generate_health_insights(detailed_items, total_nutrition)
+        
+        # Step 5: Calculate enhanced accuracy score
+        accuracy_score = self.calculate_enhanced_accuracy_score(
+            usda_items_found, 
+            gemini_estimated_items, 
+            default_estimated_items,
+            user_corrected_items,
+            len(detailed_items),
+            local_table_items,
+            len(degraded_items)
+        )
+        
+        # Step 6: Prepare final result
+        result = {
+            "success": True,
+            "user_corrections": user_corrections if user_corrections and user_corrections.strip() else None,
+            "analysis": {
+                "reasoning": analysis.get("reasoning", "AI analysis completed"),
+                "meal_context": analysis.get("meal_context", ""),
+                "total_items_identified": len(detailed_items),
+                "user_corrections_applied": bool(user_corrections and user_corrections.strip()),
+                "user_corrected_items": user_corrected_items
+            },
+            "food_items": detailed_items,
+            "total_nutrition": total_nutrition,
+            "health_insights": health_insights,
+            "data_sources": {
+                "food_identification": "Google Gemini AI",
+                "nutrition_data_sources": {
+                    "usda_items": usda_items_found,
+                    "local_table_items": local_table_items,
+                    "gemini_estimated": gemini_estimated_items,
+                    "default_estimated": default_estimated_items,
+                    "user_corrected": user_corrected_items,
+                    "degraded": len(degraded_items),
+                    "total_items": len(detailed_items)
+                },
+                "degraded_items": degraded_items,
+                "accuracy_score": accuracy_score,
+                "accuracy_breakdown": {
+                    "usda_accuracy": round((usda_items_found / len(detailed_items)) * 100, 1) if detailed_items else 0,
+                    "user_enhancement": round((user_corrected_items / len(detailed_items)) * 100, 1) if detailed_items else 0
+                }
             }
+        }
+        
+        logger.info(f"Analysis completed: {len(detailed_items)} items, {accuracy_score}% accuracy")
+        return result
+
+    def read_image(self, image_path: Union[str, Path, bytes]) -> Optional[bytes]:
+        """Read image bytes from disk, or None if the file does not exist; bytes are returned as-is."""
+        if isinstance(image_path, (bytes, bytearray)):
+            return bytes(image_path)
+        image_path = Path(image_path)
+        if not image_path.exists():
+            return None
+        
+        with open(image_path, "rb") as image:
+            return image.read()
+
+    def prepare_image(self, image_path: Union[str, Path, bytes], preprocess_executor: Optional[Executor] = None) -> Optional[Dict]:
+        """Read and preprocess an image, optionally in a process pool; None if the file does not exist.
+        
+        image_path may also be the image bytes themselves, e.g. an upload held in memory.
+        """
+        if preprocess_executor is not None and not isinstance(image_path, (bytes, bytearray)):
+            return preprocess_executor.submit(
+                preprocess_image_file, image_path, self.image_preprocessor.options()
+            ).result()
+        
+        image_data = self.read_image(image_path)
+        if image_data is None:
+            return None
+        return self.image_preprocessor.process(image_data)
+
+    def get_calories_from_image(self, image_path: Union[str, Path, bytes], user_corrections: str = "",
+                                stage_limits: Optional[Dict[str, threading.Semaphore]] = None,
+                                preprocess_executor: Optional[Executor] = None,
+                                on_event: Optional[Callable[[Dict], None]] = None,
+                                deadline_ms: Optional[float] = None) -> Dict:
+        """Main function to get accurate calorie analysis from image with user corrections.
+        
+        Pass on_event to receive the progress events of iter_calories_from_image as they happen,
+        and deadline_ms to bound the latency (see iter_calories_from_image).
+        """
+        result = {"error": "Analysis produced no result", "success": False}
+        for event in self.iter_calories_from_image(image_path, user_corrections, stage_limits, preprocess_executor,
+                                                   deadline_ms):
+            if on_event is not None:
+                try:
+                    on_event(event)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {e}")
+            if event["event"] in ("complete", "error"):
+                result = event["result"]
+        return result
+
+    def iter_calories_from_image(self, image_path: Union[str, Path, bytes], user_corrections: str = "",
+                                 stage_limits: Optional[Dict[str, threading.Semaphore]] = None,
+                                 preprocess_executor: Optional[Executor] = None,
+                                 deadline_ms: Optional[float] = None) -> Iterator[Dict]:
+        """Analyze an image, yielding progress events as each stage finishes.
+        
+        Events, in order:
+        - items_identified: the vision step returned; carries the identified food_items
+        - item_resolved: one per food item as its nutrition arrives, with the running total_nutrition
+        - complete: the final result, identical to get_calories_from_image's return value
+        
+        Failures end the stream with an error event whose result is the usual error dict.
+        With include_timings the complete result also carries a timings block.
+        
+        deadline_ms (default ANALYSIS_DEADLINE_MS) is the latency budget of the whole analysis.
+        Every Gemini and USDA call is capped by what is left of it, and items that run out of
+        budget degrade to a cheaper nutrition source instead of holding up the result; they are
+        listed under data_sources.degraded_items.
+        """
+        budget = ANALYSIS_DEADLINE_MS if deadline_ms is None else deadline_ms
+
+        def events() -> Iterator[Dict]:
+            started = time.perf_counter()
+            with deadline_scope(budget), collect_timings(self.include_timings) as timings:
+                for event in self._iter_calories_from_image(image_path, user_corrections, stage_limits,
+                                                            preprocess_executor):
+                    if event["event"] == "complete" and timings is not None:
+                        event["result"]["timings"] = summarize_timings(timings, time.perf_counter() - started)
+                    yield event
+
+        # The scopes stay in a copied context: a consumer that breaks off must not keep the deadline
+        yield from iterate_in_context(events())
+
+    def _iter_calories_from_image(self, image_path: Union[str, Path, bytes], user_corrections: str,
+                                  stage_limits: Optional[Dict[str, threading.Semaphore]],
+                                  preprocess_executor: Optional[Executor]) -> Iterator[Dict]:
+        stage_limits = stage_limits or {}
+        try:
+            # Validate, read and preprocess image file
+            with stage_limits.get("read", nullcontext()), span("prepare_image"):
+                prepared = self.prepare_image(image_path, preprocess_executor)
+            if prepared is None:
+                yield {"event": "error", "result": {"error": "Image file not found", "success": False}}
+                return
             
-            usda_items_found = 0
-            gemini_estimated_items = 0
-            default_estimated_items = 0
-            user_corrected_items = 0
-            
-            for food_item in analysis.get("food_items", []):
-                food_name = food_item["name"]
-                cooking_method = food_item.get("cooking_method", "")
-                weight_grams = food_item.get("estimated_weight_grams", 100)
-                description = food_item.get("description", "")
-                confidence_score = food_item.get("confidence_score", 50)
-                user_corrected = food_item.get("user_corrected", False)
-                user_added = food_item.get("user_added", False)
-                
-                if user_corrected or user_added:
-                    user_corrected_items += 1
-                
-                logger.info(f"Fetching nutrition data for: {food_name} ({cooking_method})")
-                usda_data = self.fetch_usda_nutrition(food_name, cooking_method)
-                
-                if usda_data:
-                    # Use USDA data
-                    usda_items_found += 1
-                    portion_nutrition = self.calculate_portion_nutrition(usda_data, weight_grams)
-                    data_source = "USDA"
-                    
-                    detailed_item = {
-                        "name": food_name,
-                        "cooking_method": cooking_method,
-                        "estimated_weight_grams": weight_grams,
-                        "estimated_quantity": food_item.get("estimated_quantity", ""),
-                        "description": description,
-                        "confidence_score": confidence_score,
-                        "data_source": "USDA",
-                        "usda_reference": {
-                            "food_name": usda_data.get("food_name", food_name),
-                            "serving_size": usda_data.get("serving_size"),
-                            "serving_unit": usda_data.get("serving_unit")
-                        },
-                        "nutrition": portion_nutrition
-                    }
-                else:
-                    # Try Gemini estimation
-                    gemini_nutrition = self.estimate_nutrition_with_gemini(food_name, weight_grams, description, cooking_method)
-                    
-                    if gemini_nutrition.get("estimation_confidence") != "low":
-                        gemini_estimated_items += 1
-                        data_source = "Gemini AI Estimation"
-                    else:
-                        default_estimated_items += 1
-                        data_source = "Category Estimate"
+            # Step 1: Analyze image with Gemini
+            logger.info("Analyzing image with Gemini AI...")
+            analysis, cache_status = self._cached_analysis(prepared, user_corrections)
+            prefetched = {}
+            # USDA lookups start as soon as each item streams out of the vision response
+            prefetch_pool = None if analysis is not None or self.usda_bulk_details else ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="prefetch")
+            try:
+                if analysis is None:
+                    on_item = None
+                    if prefetch_pool is not None:
+                        lookup = self._limited_lookup(stage_limits.get("nutrition"))
+                        
+                        def on_item(food_item: Dict) -> None:
+                            if food_item.get("name") and self._lookup_key(food_item) not in prefetched:
+                                prefetched[self._lookup_key(food_item)] = submit_in_context(prefetch_pool, lookup, food_item)
                     
-                    detailed_item = {
-                        "name": food_name,
-                        "cooking_method": cooking_method,
-                        "estimated_weight_grams": weight_grams,
-                        "estimated_quantity": food_item.get("estimated_quantity", ""),
-                        "description": description,
-                        "confidence_score": confidence_score,
-                        "data_source": data_source,
-                        "estimation_confidence": gemini_nutrition.get("estimation_confidence", "low"),
-                        "estimation_notes": gemini_nutrition.get("estimation_notes", ""),
-                        "nutrition": gemini_nutrition
-                    }
+                    with stage_limits.get("vision", nullcontext()):
+                        # Corrections are folded into the vision prompt, so no second Gemini round trip is needed
+                        analysis = self.analyze_food_with_gemini(
+                            prepared["data"], user_corrections, prepared["mime_type"], on_item=on_item)
+                    self._store_analysis(prepared, user_corrections, analysis)
                 
-                # Add user correction flags
-                if user_corrected:
-                    detailed_item["user_corrected"] = True
-                    detailed_item["correction_notes"] = food_item.get("correction_notes", "User corrected")
-                if user_added:
-                    detailed_item["user_added"] = True
-                    detailed_item["correction_notes"] = "Added based on user input"
+                # Step 2: Apply user corrections if provided
+                if user_corrections and user_corrections.strip():
+                    logger.info("Applying user corrections...")
+                    with span("corrections.manual"):
+                        analysis = self.process_user_corrections_manually(analysis, user_corrections)
                 
-                detailed_items.append(detailed_item)
+                food_items = analysis.get("food_items", [])
+                yield {
+                    "event": "items_identified",
+                    "food_items": food_items,
+                    "meal_context": analysis.get("meal_context", ""),
+                    "total_items": len(food_items),
+                    "analysis_cache": cache_status
+                }
                 
-                # Update totals
-                nutrition_data = detailed_item["nutrition"]
-                for nutrient, value in nutrition_data.items():
-                    if nutrient in total_nutrition and isinstance(value, (int, float)):
-                        total_nutrition[nutrient] += value
+                # Step 3: Get nutrition data for each food, streaming items as they resolve
+                detailed_items = [None] * len(food_items)
+                resolved = 0
+                for i, detailed_item in self.iter_resolved_food_items(
+                        food_items, stage_limits.get("nutrition"), prefetched):
+                    detailed_items[i] = detailed_item
+                    resolved += 1
+                    yield {
+                        "event": "item_resolved",
+                        "index": i,
+                        "item": detailed_item,
+                        "resolved": resolved,
+                        "total_items": len(food_items),
+                        "total_nutrition": self.sum_nutrition(item for item in detailed_items if item)
+                    }
+            finally:
+                if prefetch_pool is not None:
+                    # Lookups for items the corrections removed are not worth waiting for
+                    prefetch_pool.shutdown(wait=False, cancel_futures=True)
             
-            # Step 4: Generate health insights
-            health_insights = self.generate_health_insights(detailed_items, total_nutrition)
+            with span("build_result"):
+                result = self._finalize_result(analysis, detailed_items, user_corrections, prepared, cache_status)
             
-            # Step 5: Calculate enhanced accuracy score
-            accuracy_score = self.calculate_enhanced_accuracy_score(
-                usda_items_found, 
-                gemini_estimated_items, 
-                default_estimated_items,
-                user_corrected_items,
-                len(detailed_items)
-            )
+        except Exception as e:
+            logger.error(f"Calorie analysis error: {e}")
+            yield {"event": "error", "result": {"error": str(e), "success": False}}
+            return
+        
+        yield {"event": "complete", "result": result}
+
+    def _cached_analysis(self, prepared: Dict, user_corrections: str) -> Tuple[Optional[Dict], Dict]:
+        """Look the prepared image up in the analysis cache; returns (analysis or None, cache status)."""
+        if self.analysis_cache is None:
+            return None, {"status": "disabled"}
+        analysis, cache_status = self.analysis_cache.get(
+            prepared["content_hash"], user_corrections, prepared.get("perceptual_hash")
+        )
+        record_cache("analysis", cache_status["status"])
+        if analysis is not None:
+            logger.info(f"Vision analysis served from cache ({cache_status['status']})")
+        return analysis, cache_status
+
+    def _store_analysis(self, prepared: Dict, user_corrections: str, analysis: Dict) -> None:
+        if self.analysis_cache is not None:
+            self.analysis_cache.set(prepared["content_hash"], user_corrections, analysis, prepared.get("perceptual_hash"))
+
+    def _finalize_result(self, analysis: Dict, detailed_items: List[Dict], user_corrections: str,
+                         prepared: Dict, cache_status: Dict) -> Dict:
+        result = self.build_result(analysis, detailed_items, user_corrections)
+        result["data_sources"]["image_preprocessing"] = preprocessing_report(prepared)
+        result["data_sources"]["analysis_cache"] = cache_status
+        return result
+
+    @staticmethod
+    def _item_signature(food_item: Dict) -> Tuple[str, str]:
+        """Identity of a food item for diffing: normalized name and cooking method."""
+        return (
+            str(food_item.get("name", "")).strip().lower(),
+            str(food_item.get("cooking_method", "")).strip().lower()
+        )
+
+    @staticmethod
+    def _rescale_detailed_item(detailed_item: Dict, weight_grams: float) -> Dict:
+        """Copy a resolved item with its nutrition scaled to a new portion weight."""
+        return FoodRecord.from_dict(detailed_item).rescaled(weight_grams).to_dict()
+
+    @staticmethod
+    def _analysis_from_result(previous_result: Dict) -> Dict:
+        """Rebuild the vision-analysis shape (food items, reasoning, context) from a previous result."""
+        previous_analysis = previous_result.get("analysis", {})
+        return {
+            "food_items": [
+                {key: item[key] for key in (
+                    "name", "cooking_method", "estimated_quantity", "estimated_weight_grams",
+                    "description", "confidence_score", "user_corrected", "user_added", "correction_notes"
+                ) if key in item}
+                for item in previous_result.get("food_items", [])
+            ],
+            "reasoning": previous_analysis.get("reasoning", ""),
+            "meal_context": previous_analysis.get("meal_context", "")
+        }
+
+    def _merge_corrected_items(self, previous_items: List[Dict], analysis: Dict) -> Tuple[List[Optional[Dict]], List[Tuple[int, Dict]], Dict]:
+        """Diff corrected food items against previous results.
+        
+        Returns the merged item list (None where a lookup is needed), the (position, food_item)
+        pairs to resolve, and the diff counts.
+        """
+        # Index previous items by identity so repeated dishes are matched one-to-one
+        available: Dict[Tuple[str, str], List[Dict]] = {}
+        for item in previous_items:
+            available.setdefault(self._item_signature(item), []).append(item)
+        
+        detailed_items: List[Optional[Dict]] = []
+        to_resolve = []
+        reused = rescaled = 0
+        for food_item in analysis.get("food_items", []):
+            matches = available.get(self._item_signature(food_item))
+            if not matches:
+                to_resolve.append((len(detailed_items), food_item))
+                detailed_items.append(None)
+                continue
             
-            # Step 6: Prepare final result
-            result = {
-                "success": True,
-                "user_corrections": user_corrections if user_corrections and user_corrections.strip() else None,
-                "analysis": {
-                    "reasoning": analysis.get("reasoning", "AI analysis completed"),
-                    "meal_context": analysis.get("meal_context", ""),
-                    "total_items_identified": len(detailed_items),
-                    "user_corrections_applied": bool(user_corrections and user_corrections.strip()),
-                    "user_corrected_items": user_corrected_items
-                },
-                "food_items": detailed_items,
-                "total_nutrition": {
-                    "calories": round(total_nutrition["calories"], 2),
-                    "protein": round(total_nutrition["protein"], 2),
-                    "fat": round(total_nutrition["fat"], 2),
-                    "carbohydrates": round(total_nutrition["carbohydrates"], 2),
-                    "fiber": round(total_nutrition["fiber"], 2),
-                    "sodium": round(total_nutrition["sodium"], 2)
-                },
-                "health_insights": health_insights,
-                "data_sources": {
-                    "food_identification": "Google Gemini AI",
-                    "nutrition_data_sources": {
-                        "usda_items": usda_items_found,
-                        "gemini_estimated": gemini_estimated_items,
-                        "default_estimated": default_estimated_items,
-                        "user_corrected": user_corrected_items,
-                        "total_items": len(detailed_items)
-                    },
-                    "accuracy_score": accuracy_score,
-                    "accuracy_breakdown": {
-                        "usda_accuracy": round((usda_items_found / len(detailed_items)) * 100, 1) if detailed_items else 0,
-                        "user_enhancement": round((user_corrected_items / len(detailed_items)) * 100, 1) if detailed_items else 0
-                    }
-                }
-            }
+            previous_item = matches.pop(0)
+            weight_grams = food_item.get("estimated_weight_grams", 100)
+            if weight_grams == previous_item.get("estimated_weight_grams"):
+                detailed_item = dict(previous_item)
+                reused += 1
+            else:
+                detailed_item = self._rescale_detailed_item(previous_item, weight_grams)
+                rescaled += 1
             
-            logger.info(f"Analysis completed: {len(detailed_items)} items, {accuracy_score}% accuracy")
-            return result
+            detailed_item["estimated_quantity"] = food_item.get("estimated_quantity", detailed_item.get("estimated_quantity", ""))
+            if food_item.get("user_corrected"):
+                detailed_item["user_corrected"] = True
+                detailed_item["correction_notes"] = food_item.get("correction_notes", "User corrected")
+            detailed_items.append(detailed_item)
+        
+        diff = {
+            "reused_items": reused,
+            "rescaled_items": rescaled,
+            "recomputed_items": len(to_resolve),
+            "removed_items": sum(len(items) for items in available.values())
+        }
+        return detailed_items, to_resolve, diff
+
+    def _finish_incremental(self, previous_result: Dict, user_corrections: str, analysis: Dict,
+                            detailed_items: List[Dict], diff: Dict) -> Dict:
+        all_corrections = "; ".join(
+            text for text in (previous_result.get("user_corrections"), user_corrections.strip()) if text
+        )
+        result = self.build_result(analysis, detailed_items, all_corrections)
+        result["analysis"]["incremental_update"] = diff
+        return result
+
+    def reanalyze_with_corrections(self, previous_result: Dict, user_corrections: str) -> Dict:
+        """Apply corrections to a previous result, recomputing nutrition only for items that changed.
+        
+        The image is not re-sent: corrections are applied to the previous food items, unchanged items
+        are reused as-is, items whose only change is the portion weight are rescaled, and only added
+        or renamed items go through nutrition lookup again.
+        """
+        try:
+            if not previous_result.get("success"):
+                return {"error": "Previous result is not a successful analysis", "success": False}
+            if not user_corrections or not user_corrections.strip():
+                return previous_result
+            
+            logger.info("Applying user corrections incrementally...")
+            analysis = self.apply_user_corrections(self._analysis_from_result(previous_result), user_corrections)
+            analysis = self.process_user_corrections_manually(analysis, user_corrections)
+            
+            detailed_items, to_resolve, diff = self._merge_corrected_items(previous_result.get("food_items", []), analysis)
+            resolved = self.resolve_food_items([food_item for _, food_item in to_resolve])
+            for (position, _), detailed_item in zip(to_resolve, resolved):
+                detailed_items[position] = detailed_item
+            
+            return self._finish_incremental(previous_result, user_corrections, analysis, detailed_items, diff)
             
         except Exception as e:
-            logger.error(f"Calorie analysis error: {e}")
+            logger.error(f"Incremental correction error: {e}")
             return {"error": str(e), "success": False}
 
+    def get_calories_for_images(self, images: Iterable[Union[str, Path, Tuple[Union[str, Path], str]]],
+                                concurrency: int = 4, read_concurrency: Optional[int] = None,
+                                vision_concurrency: Optional[int] = None,
+                                nutrition_concurrency: Optional[int] = None,
+                                preprocess_processes: Optional[int] = None,
+                                deadline_ms: Optional[float] = None) -> Iterator[Dict]:
+        """Analyze many images, yielding each result (tagged with image_path) as soon as it finishes.
+        
+        Items are image paths or (image_path, user_corrections) tuples. At most ``concurrency``
+        images are in flight, and image reads, Gemini vision calls and nutrition lookups each have
+        their own limit, so memory stays flat regardless of batch size. With ``preprocess_processes``
+        image decoding and re-encoding runs in a process pool instead of the calling threads.
+        deadline_ms bounds each image's analysis from the moment it starts. Batch analyses queue
+        for the API key quotas behind interactive ones.
+        """
+        stage_limits = {
+            "read": threading.BoundedSemaphore(read_concurrency or concurrency),
+            "vision": threading.BoundedSemaphore(vision_concurrency or concurrency),
+            "nutrition": threading.BoundedSemaphore(nutrition_concurrency or concurrency * self.max_workers)
+        }
+        
+        def run(entry) -> Dict:
+            image_path, user_corrections = entry if isinstance(entry, tuple) else (entry, "")
+            with priority_scope(BATCH):
+                result = self.get_calories_from_image(image_path, user_corrections, stage_limits, preprocess_pool,
+                                                      deadline_ms=deadline_ms)
+            result["image_path"] = str(image_path)
+            return result
+        
+        entries = iter(images)
+        preprocess_pool = ProcessPoolExecutor(max_workers=preprocess_processes) if preprocess_processes else None
+        with preprocess_pool or nullcontext(), \
+                ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+            pending = set()
+            for entry in entries:
+                pending.add(executor.submit(run, entry))
+                if len(pending) >= concurrency:
+                    break
+            
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                    # Top up the window only as results drain so the path iterator is consumed lazily
+                    next_entry = next(entries, None)
+                    if next_entry is not None:
+                        pending.add(executor.submit(run, next_entry))
+
     def calculate_enhanced_accuracy_score(self, usda_items: int, gemini_estimated: int, 
-                                       default_estimated: int, user_corrected: int, total_items: int) -> float:
-        """Calculate an enhanced accuracy score that considers user corrections."""
+                                       default_estimated: int, user_corrected: int, total_items: int,
+                                       local_table_items: int = 0, degraded_items: int = 0) -> float:
+        """Calculate an enhanced accuracy score that considers user corrections.
+        
+        Items the deadline degraded already score by the cheaper source they ended up with, and
+        also carry a penalty for the better source they missed.
+        """
         if total_items == 0:
             return 0.0
         
         # Weight different data sources
         usda_weight = 1.0      # Most accurate
+        local_table_weight = 0.8  # Reference composition of a matched dish
         gemini_weight = 0.7    # AI estimation
         default_weight = 0.4   # Category averages
         user_correction_bonus = 0.1  # Bonus for user corrections
+        degraded_penalty = 0.1  # Penalty for items cut short by the deadline
         
         # Base score from data sources
         base_score = (
             (usda_items * usda_weight) + 
+            (local_table_items * local_table_weight) + 
             (gemini_estimated * gemini_weight) + 
             (default_estimated * default_weight)
         ) / total_items
         
         # Add bonus for user corrections (they improve accuracy)
         user_bonus = (user_corrected * user_correction_bonus) / total_items
+        degraded_malus = (degraded_items * degraded_penalty) / total_items
         
-        final_score = min(100, (base_score + user_bonus) * 100)
+        final_score = max(0, min(100, (base_score + user_bonus - degraded_malus) * 100))
         return round(final_score, 1)
 
     def generate_health_insights(self, food_items: List[Dict], total_nutrition: Dict) -> List[str]:
@@ -610,9 +1868,6 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
         insights = []
         
         calories = total_nutrition["calories"]
-        protein = total_nutrition["protein"]
-        fat = total_nutrition["fat"]
-        carbs = total_nutrition["carbohydrates"]
         fiber = total_nutrition["fiber"]
         
         # Calorie-based insights
@@ -626,10 +1881,9 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
             insights.append("Very high calorie meal - monitor intake")
         
         # Macronutrient balance
-        if calories > 0:
-            protein_pct = (protein * 4) / calories * 100
-            carbs_pct = (carbs * 4) / calories * 100
-            fat_pct = (fat * 9) / calories * 100
+        macros = macro_percentages(total_nutrition)
+        if macros:
+            protein_pct, carbs_pct, fat_pct = macros["protein"], macros["carbohydrates"], macros["fat"]
             
             if protein_pct > 25:
                 insights.append("High protein content - great for muscle maintenance")
@@ -670,20 +1924,124 @@ Important: Provide values for the exact portion size of {weight_grams} grams, no
         return insights
 
 # For backward compatibility
+_shared_counter = None
+
+def get_shared_counter() -> AccurateCalorieCounter:
+    """Return the process-wide counter; it is safe to use from many threads at once."""
+    global _shared_counter
+    if _shared_counter is None:
+        with _shared_usda_cache_lock:
+            if _shared_counter is None:
+                _shared_counter = AccurateCalorieCounter()
+    return _shared_counter
+
+def warmup(gemini: bool = True, usda: bool = True) -> Dict:
+    """Warm up the shared counter, e.g. right after a worker process starts."""
+    return get_shared_counter().warmup(gemini=gemini, usda=usda)
+
 def get_calories_from_image(image_path: Union[str, Path], user_corrections: str = "") -> Dict:
     """Legacy function for compatibility."""
-    counter = AccurateCalorieCounter()
-    return counter.get_calories_from_image(image_path, user_corrections)
+    return get_shared_counter().get_calories_from_image(image_path, user_corrections)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif", ".gif", ".bmp"}
+
+def iter_batch_inputs(source: Union[str, Path]) -> Iterator[Union[Path, Tuple[Path, str]]]:
+    """Yield batch entries from a directory of images or a manifest file.
+    
+    Manifest lines are either a bare image path or a JSON object with ``image_path`` and an
+    optional ``user_corrections``; relative paths are resolved against the manifest's directory.
+    """
+    source = Path(source)
+    if source.is_dir():
+        for path in sorted(source.iterdir()):
+            if path.suffix.lower() in IMAGE_EXTENSIONS and path.is_file():
+                yield path
+        return
+    
+    with open(source, encoding="utf-8") as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                image_path = source.parent / entry["image_path"]
+                yield (image_path, entry.get("user_corrections", ""))
+            else:
+                yield source.parent / line
+
+def get_calories_for_images(images: Iterable[Union[str, Path, Tuple[Union[str, Path], str]]],
+                            concurrency: int = 4, **stage_concurrency) -> Iterator[Dict]:
+    """Module-level batch helper; see AccurateCalorieCounter.get_calories_for_images."""
+    yield from get_shared_counter().get_calories_for_images(images, concurrency=concurrency, **stage_concurrency)
 
 if __name__ == "__main__":
+    import argparse
     import sys
-    if len(sys.argv) < 2:
+    
+    import instrumentation
+    
+    parser = argparse.ArgumentParser(description="Accurate calorie analysis of food images")
+    parser.add_argument("image_path", nargs="?", help="image to analyze")
+    parser.add_argument("user_corrections", nargs="?", default="", help="free-text corrections to apply")
+    parser.add_argument("--batch", metavar="DIR_OR_MANIFEST",
+                        help="analyze every image in a directory or manifest and print JSONL as each finishes")
+    parser.add_argument("--concurrency", type=int, default=4, help="images in flight in batch mode")
+    parser.add_argument("--vision-concurrency", type=int, help="concurrent Gemini vision calls in batch mode")
+    parser.add_argument("--nutrition-concurrency", type=int, help="concurrent nutrition lookups in batch mode")
+    parser.add_argument("--preprocess-processes", type=int, help="worker processes for image preprocessing in batch mode")
+    parser.add_argument("--deadline-ms", type=float, help="latency budget per image; late items degrade to cheaper sources")
+    parser.add_argument("--timings", action="store_true", help="add a per-stage timings block to each result")
+    parser.add_argument("--metrics", action="store_true", help="print Prometheus metrics to stderr when done")
+    cassette_mode = parser.add_mutually_exclusive_group()
+    cassette_mode.add_argument("--record", metavar="CASSETTE",
+                               help="record the Gemini and FoodData Central traffic to a cassette (cassettes.py)")
+    cassette_mode.add_argument("--replay", metavar="CASSETTE",
+                               help="answer Gemini and FoodData Central calls from a recorded cassette")
+    args = parser.parse_args()
+    
+    if args.metrics:
+        instrumentation.set_enabled(True)
+    
+    if not args.batch and not args.image_path:
         print("Usage: python calorie_counter.py <image_path> [user_corrections]")
+        print("       python calorie_counter.py --batch <directory|manifest> [--concurrency N]")
         sys.exit(1)
     
-    image_path = sys.argv[1]
-    user_corrections = sys.argv[2] if len(sys.argv) > 2 else ""
+    cassette = None
+    if args.record or args.replay:
+        from cassettes import Cassette
+        cassette = Cassette(args.record, "record") if args.record else Cassette(args.replay)
+        cassette.install()
+    
+    counter = AccurateCalorieCounter(include_timings=args.timings or None)
+    if args.batch:
+        inputs = iter_batch_inputs(args.batch)
+        if cassette is not None:
+            def recorded_inputs(entries):
+                for entry in entries:
+                    image_path, corrections = entry if isinstance(entry, tuple) else (entry, "")
+                    cassette.record_analysis(image_path, corrections, args.deadline_ms, BATCH)
+                    yield entry
+            inputs = recorded_inputs(inputs)
+        results = counter.get_calories_for_images(
+            inputs,
+            concurrency=args.concurrency,
+            vision_concurrency=args.vision_concurrency,
+            nutrition_concurrency=args.nutrition_concurrency,
+            preprocess_processes=args.preprocess_processes,
+            deadline_ms=args.deadline_ms
+        )
+        for result in results:
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    else:
+        if cassette is not None:
+            cassette.record_analysis(args.image_path, args.user_corrections, args.deadline_ms)
+        result = counter.get_calories_from_image(args.image_path, args.user_corrections, deadline_ms=args.deadline_ms)
+        print(json.dumps(result, indent=2))
+    if cassette is not None:
+        cassette.close()
     
-    counter = AccurateCalorieCounter()
-    result = counter.get_calories_from_image(image_path, user_corrections)
-    print(json.dumps(result, indent=2))
+    if args.metrics:
+        sys.stderr.write(instrumentation.prometheus_text())
@@ -0,0 +1,449 @@
+"""HTTP service mode for the calorie analysis pipeline.
+
+    python calorie_service.py --port 8080 --workers 4 --queue-size 16
+    curl -F image=@meal.jpg -F corrections="missing: raita" localhost:8080/analyze
+
+Endpoints:
+- POST /analyze: the image is either the raw request body or the ``image`` field of a
+  multipart/form-data upload. User corrections come from the ``corrections`` form field,
+  the ``corrections`` query parameter or an X-User-Corrections header. The response is the
+  result dict of get_calories_from_image (200 on success, 502 when the analysis failed).
+- GET /healthz: liveness, 200 while the process serves requests.
+- GET /readyz: readiness, 200 once warmed up; 503 while starting, draining or with a full queue.
+- GET /metrics: Prometheus text of the pipeline and service metrics.
+
+Analyses run on a fixed pool of worker threads fed by a bounded queue. A full queue answers
+429 with Retry-After and a draining service answers 503, so callers back off instead of
+piling up. Each request has a deadline (SERVICE_DEADLINE_SECONDS, or a shorter
+``deadline_ms`` query parameter). A running analysis gets what is left of it as its pipeline
+deadline_ms, so slow items degrade to cheaper nutrition sources; a request still queued at
+its deadline is dropped and answered 504. ``priority=batch`` queues a request's Gemini and
+FoodData Central calls behind interactive ones for the API key quotas (see quota.py). SIGTERM and SIGINT
+stop new work, let accepted requests finish (up to --drain-timeout) and then exit.
+
+--fake-backends answers from the Gemini and FoodData Central stand-ins in benchmarks/fakes.py,
+so the service can be exercised locally without API keys or quota. --record writes the
+requests and all upstream traffic to a cassette, which ``python cassettes.py replay`` reruns
+offline and --replay serves upstream answers from (see cassettes.py).
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import logging
+import math
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import instrumentation
+from calorie_counter import AccurateCalorieCounter
+from instrumentation import count, registry
+from quota import BATCH, INTERACTIVE, priority_scope
+
+logger = logging.getLogger(__name__)
+
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", "4"))
+# Requests accepted beyond the ones being worked on; more than this get 429
+SERVICE_QUEUE_SIZE = int(os.getenv("SERVICE_QUEUE_SIZE", "16"))
+SERVICE_DEADLINE_SECONDS = float(os.getenv("SERVICE_DEADLINE_SECONDS", "60"))
+SERVICE_DRAIN_SECONDS = float(os.getenv("SERVICE_DRAIN_SECONDS", "30"))
+SERVICE_MAX_UPLOAD_BYTES = int(os.getenv("SERVICE_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Values of the priority query parameter
+_PRIORITIES = {"interactive": INTERACTIVE, "batch": BATCH}
+
+service_requests = registry.counter(
+    "calorie_service_requests_total", "HTTP requests by endpoint and status")
+service_request_seconds = registry.histogram(
+    "calorie_service_request_seconds", "Time from receiving an analyze request to answering it")
+service_queue_depth = registry.gauge(
+    "calorie_service_queue_depth", "Analyze requests waiting for a worker")
+service_in_flight = registry.gauge(
+    "calorie_service_in_flight", "Analyze requests being worked on")
+
+
+class QueueFull(Exception):
+    """The request queue is at capacity; the caller should retry later (429)."""
+
+
+class ServiceUnavailable(Exception):
+    """The service is starting up or draining and accepts no new work (503)."""
+
+
+class _Job:
+    __slots__ = ("image", "corrections", "deadline", "priority", "future")
+
+    def __init__(self, image: bytes, corrections: str, deadline: float, priority: int = INTERACTIVE):
+        self.image = image
+        self.corrections = corrections
+        # time.monotonic() by which the response is due
+        self.deadline = deadline
+        self.priority = priority
+        self.future: Future = Future()
+
+
+class AnalysisService:
+    """A worker pool with a bounded queue in front of an AccurateCalorieCounter."""
+
+    def __init__(self, counter: Optional[AccurateCalorieCounter] = None, workers: int = SERVICE_WORKERS,
+                 queue_size: int = SERVICE_QUEUE_SIZE, deadline_seconds: float = SERVICE_DEADLINE_SECONDS,
+                 cassette=None):
+        self.counter = counter or AccurateCalorieCounter()
+        # A recording cassettes.Cassette also gets every accepted request, for replaying the traffic later
+        self.cassette = cassette
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.deadline_seconds = deadline_seconds
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue(maxsize=self.queue_size)
+        self._threads = []
+        self._ready = threading.Event()
+        self._draining = threading.Event()
+        self._lock = threading.Condition()
+        self._in_flight = 0
+        # Analyze requests between arrival and their response being written; drain waits for zero
+        self._open_requests = 0
+        # Moving average of analysis time, for Retry-After
+        self._mean_seconds = 0.0
+
+    def start(self, warmup: bool = True) -> "AnalysisService":
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"analysis-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if warmup:
+            threading.Thread(target=self._warmup, name="analysis-warmup", daemon=True).start()
+        else:
+            self._ready.set()
+        return self
+
+    def _warmup(self) -> None:
+        logger.info(f"Warmup finished: {self.counter.warmup()}")
+        self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and not self._draining.is_set()
+
+    @property
+    def draining(self) -> bool:
+        return self._draining.is_set()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot is likely free: one round of the queue over the workers."""
+        seconds = (self._mean_seconds or 1.0) * self.queue_depth() / self.workers
+        return max(1, math.ceil(seconds))
+
+    def submit(self, image: bytes, corrections: str = "", deadline_seconds: Optional[float] = None,
+               priority: int = INTERACTIVE) -> Future:
+        """Queue an analysis; raises ServiceUnavailable while draining and QueueFull at capacity."""
+        if self._draining.is_set():
+            raise ServiceUnavailable("Service is draining")
+        job = _Job(image, corrections, time.monotonic() + (deadline_seconds or self.deadline_seconds), priority)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFull(f"{self.queue_size} requests already queued") from None
+        if self.cassette is not None:
+            self.cassette.record_analysis(image, corrections, (deadline_seconds or self.deadline_seconds) * 1000,
+                                          priority)
+        return job.future
+
+    def analyze(self, image: bytes, corrections: str = "", deadline_seconds: Optional[float] = None,
+                priority: int = INTERACTIVE) -> Dict:
+        """Submit an analysis and wait for it; raises TimeoutError when the deadline passes first."""
+        future = self.submit(image, corrections, deadline_seconds, priority)
+        try:
+            return future.result(timeout=deadline_seconds or self.deadline_seconds)
+        except FutureTimeoutError:
+            # Still queued: drop it so no worker spends time on an answer nobody waits for
+            future.cancel()
+            raise TimeoutError("Analysis deadline exceeded") from None
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            with self._lock:
+                self._in_flight += 1
+            started = time.perf_counter()
+            try:
+                # The pipeline gets most of what is left of the request's deadline, so slow items
+                # degrade instead of the whole request running into a 504
+                budget_ms = max(1.0, (job.deadline - time.monotonic()) * 900)
+                with priority_scope(job.priority):
+                    job.future.set_result(self.counter.get_calories_from_image(
+                        job.image, job.corrections, deadline_ms=budget_ms))
+            except Exception as e:
+                logger.error(f"Analysis failed: {e}")
+                job.future.set_exception(e)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self._in_flight -= 1
+                    self._mean_seconds = elapsed if not self._mean_seconds else 0.8 * self._mean_seconds + 0.2 * elapsed
+
+    def open_request(self) -> None:
+        with self._lock:
+            self._open_requests += 1
+
+    def close_request(self) -> None:
+        with self._lock:
+            self._open_requests -= 1
+            self._lock.notify_all()
+
+    def drain(self, timeout: float = SERVICE_DRAIN_SECONDS) -> bool:
+        """Stop accepting work and wait for accepted requests to be answered; True if all were."""
+        self._draining.set()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            drained = self._lock.wait_for(lambda: self._open_requests == 0, timeout=timeout)
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        return drained
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, bytes]:
+    """Fields of a multipart/form-data body by name."""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise ValueError("Malformed multipart body")
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            fields[name] = part.get_payload(decode=True) or b""
+    return fields
+
+
+def make_handler(service: AnalysisService, max_upload_bytes: int = SERVICE_MAX_UPLOAD_BYTES):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        server_version = "CalorieService"
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+        def _send(self, status: int, payload, endpoint: str, content_type: str = "application/json",
+                  headers: Optional[Dict[str, str]] = None) -> None:
+            body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            count(service_requests, endpoint=endpoint, status=status)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/healthz":
+                return self._send(200, {"status": "ok"}, "healthz")
+            if path == "/readyz":
+                full = service.queue_depth() >= service.queue_size
+                status = "draining" if service.draining else "starting" if not service.ready else \
+                    "saturated" if full else "ready"
+                return self._send(200 if status == "ready" else 503, {
+                    "status": status, "queue_depth": service.queue_depth(), "in_flight": service.in_flight()
+                }, "readyz")
+            if path == "/metrics":
+                service_queue_depth.set(service.queue_depth())
+                service_in_flight.set(service.in_flight())
+                return self._send(200, instrumentation.prometheus_text().encode(), "metrics",
+                                  content_type="text/plain; version=0.0.4")
+            self._send(404, {"error": "Not found"}, "other")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/analyze":
+                self.close_connection = True
+                return self._send(404, {"error": "Not found"}, "other")
+            service.open_request()
+            started = time.perf_counter()
+            try:
+                self._analyze(parse_qs(url.query))
+            finally:
+                service.close_request()
+                if instrumentation.METRICS_ENABLED:
+                    service_request_seconds.observe(time.perf_counter() - started)
+
+        def _read_upload(self, params: Dict) -> Tuple[Optional[bytes], str, Optional[Tuple[int, str]]]:
+            """(image, corrections, error) of an analyze request; error is (status, message)."""
+            corrections = params.get("corrections", [""])[0] or self.headers.get("X-User-Corrections", "")
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked" or "Content-Length" not in self.headers:
+                self.close_connection = True
+                return None, corrections, (411, "Content-Length is required")
+            length = int(self.headers["Content-Length"])
+            if length > max_upload_bytes:
+                self.close_connection = True
+                return None, corrections, (413, f"Upload exceeds {max_upload_bytes} bytes")
+            body = self.rfile.read(length)
+            content_type = self.headers.get("Content-Type", "")
+            if content_type.startswith("multipart/form-data"):
+                try:
+                    fields = parse_multipart(content_type, body)
+                except ValueError as e:
+                    return None, corrections, (400, str(e))
+                body = fields.get("image", b"")
+                if fields.get("corrections"):
+                    corrections = fields["corrections"].decode("utf-8", "replace")
+            if not body:
+                return None, corrections, (400, "No image in request")
+            return body, corrections, None
+
+        def _analyze(self, params: Dict) -> None:
+            image, corrections, error = self._read_upload(params)
+            if error is not None:
+                return self._send(error[0], {"error": error[1], "success": False}, "analyze")
+            deadline = service.deadline_seconds
+            try:
+                deadline = min(deadline, float(params.get("deadline_ms", ["inf"])[0]) / 1000)
+            except ValueError:
+                return self._send(400, {"error": "deadline_ms must be a number", "success": False}, "analyze")
+            priority = _PRIORITIES.get(params.get("priority", ["interactive"])[0])
+            if priority is None:
+                return self._send(400, {"error": "priority must be interactive or batch", "success": False}, "analyze")
+            if not service.ready and not service.draining:
+                return self._send(503, {"error": "Service is starting", "success": False}, "analyze",
+                                  headers={"Retry-After": "1"})
+            try:
+                result = service.analyze(image, corrections, deadline, priority)
+            except QueueFull as e:
+                return self._send(429, {"error": str(e), "success": False}, "analyze",
+                                  headers={"Retry-After": str(service.retry_after())})
+            except ServiceUnavailable as e:
+                return self._send(503, {"error": str(e), "success": False}, "analyze",
+                                  headers={"Retry-After": str(service.retry_after())})
+            except TimeoutError as e:
+                return self._send(504, {"error": str(e), "success": False}, "analyze")
+            except Exception as e:
+                return self._send(500, {"error": str(e), "success": False}, "analyze")
+            self._send(200 if result.get("success") else 502, result, "analyze")
+
+    return Handler
+
+
+def install_fake_backends():
+    """Serve from the benchmark stand-ins for Gemini and FoodData Central; returns a cleanup function."""
+    sys.path.insert(0, str(Path(__file__).resolve().parent / "benchmarks"))
+    from fakes import FakeFoodDataCentral, FakeGemini, install
+
+    fdc = FakeFoodDataCentral().start()
+    restore = install(FakeGemini(), fdc)
+
+    def cleanup() -> None:
+        restore()
+        fdc.stop()
+    return cleanup
+
+
+class ServiceServer(ThreadingHTTPServer):
+    """Threaded HTTP server in front of an AnalysisService, with a graceful stop."""
+
+    daemon_threads = True
+
+    def __init__(self, service: AnalysisService, host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                 drain_seconds: float = SERVICE_DRAIN_SECONDS, max_upload_bytes: int = SERVICE_MAX_UPLOAD_BYTES):
+        super().__init__((host, port), make_handler(service, max_upload_bytes))
+        self.service = service
+        self.drain_seconds = drain_seconds
+        self.stopped = threading.Event()
+
+    def start(self) -> "ServiceServer":
+        threading.Thread(target=self.serve_forever, name="calorie-service", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Drain the service, then stop listening."""
+        logger.info("Draining analysis service...")
+        if not self.service.drain(self.drain_seconds):
+            logger.warning(f"Requests still open after the {self.drain_seconds}s drain")
+        self.shutdown()
+        self.server_close()
+        self.stopped.set()
+
+    def stop_on_signals(self) -> None:
+        """Stop gracefully on SIGTERM and SIGINT; call from the main thread."""
+        def on_signal(signum, frame) -> None:
+            # Off the signal handler: drain blocks and shutdown() waits for serve_forever
+            threading.Thread(target=self.stop, name="calorie-service-drain").start()
+        signal.signal(signal.SIGTERM, on_signal)
+        signal.signal(signal.SIGINT, on_signal)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HTTP service for calorie analysis of food images")
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="analyses run concurrently")
+    parser.add_argument("--queue-size", type=int, default=SERVICE_QUEUE_SIZE,
+                        help="requests waiting for a worker before new ones get 429")
+    parser.add_argument("--deadline", type=float, default=SERVICE_DEADLINE_SECONDS,
+                        help="seconds a request may take before it is answered 504")
+    parser.add_argument("--drain-timeout", type=float, default=SERVICE_DRAIN_SECONDS,
+                        help="seconds to let accepted requests finish on shutdown")
+    parser.add_argument("--max-upload-bytes", type=int, default=SERVICE_MAX_UPLOAD_BYTES)
+    parser.add_argument("--no-warmup", action="store_true", help="report ready without warming up")
+    parser.add_argument("--no-metrics", action="store_true", help="do not collect Prometheus metrics")
+    parser.add_argument("--fake-backends", action="store_true",
+                        help="answer from local Gemini and FoodData Central stand-ins (benchmarks/fakes.py)")
+    cassette_mode = parser.add_mutually_exclusive_group()
+    cassette_mode.add_argument("--record", metavar="CASSETTE",
+                               help="record requests and Gemini/FoodData Central traffic to a cassette (cassettes.py)")
+    cassette_mode.add_argument("--replay", metavar="CASSETTE",
+                               help="answer Gemini and FoodData Central calls from a recorded cassette")
+    args = parser.parse_args(argv)
+
+    instrumentation.set_enabled(not args.no_metrics)
+    cleanup = install_fake_backends() if args.fake_backends else None
+    cassette = uninstall = None
+    if args.record or args.replay:
+        from cassettes import Cassette
+        cassette = Cassette(args.record, "record") if args.record else Cassette(args.replay)
+        uninstall = cassette.install()
+    service = AnalysisService(workers=args.workers, queue_size=args.queue_size, deadline_seconds=args.deadline,
+                              cassette=cassette if args.record else None).start(warmup=not args.no_warmup)
+    server = ServiceServer(service, args.host, args.port, args.drain_timeout, args.max_upload_bytes).start()
+    server.stop_on_signals()
+    logger.info(f"Serving on http://{args.host}:{server.server_port} with {service.workers} workers, "
+                f"queue of {service.queue_size}")
+    try:
+        server.stopped.wait()
+    finally:
+        if cassette is not None:
+            uninstall()
+            cassette.close()
+        if cleanup is not None:
+            cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
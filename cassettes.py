@@ -0,0 +1,760 @@
+"""Record-and-replay cassettes of Gemini and FoodData Central traffic.
+
+Recording captures every Gemini generate_content call (prompt, response text, streamed chunks
+with their timing, token usage, or the error it raised) and every FoodData Central request and
+response, together with the analyses that caused them:
+
+    python calorie_service.py --record traffic.cas      # serve real traffic, recording it
+    python cassettes.py info traffic.cas
+    python cassettes.py replay traffic.cas --speed 10   # rerun the recorded analyses offline
+
+Replay answers from the cassette without network access, after the recorded latency times
+latency_scale. Calls are matched on a digest of the request: model, prompt text, image bytes and
+generation config for Gemini; method, path, query (without the API key) and JSON body for
+FoodData Central. A request recorded N times is answered with its N recordings in order. A
+request the cassette never saw raises CassetteMiss, which the pipeline handles like any
+upstream failure; replaying with different cache or batching settings can cause some.
+
+File layout: a magic header, then records of zlib-compressed JSON (image bytes stored raw
+after it), then a compressed index of record offsets by request digest and a fixed-size
+trailer pointing at it. A cassette whose recording was cut short has no index; it is rebuilt
+by scanning the records.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import mmap
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+import async_calorie_counter
+import calorie_counter
+from instrumentation import count, registry
+
+try:
+    import httpx
+except ImportError:  # only needed to record or replay the asyncio counter
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+cassette_calls = registry.counter(
+    "calorie_counter_cassette_calls_total", "Upstream calls recorded to or replayed from a cassette, by api and outcome")
+
+_MAGIC = b"CALCAS1\0"
+_INDEX_MAGIC = b"CALIDX1\0"
+# Record header: compressed JSON length, raw payload length
+_RECORD = struct.Struct("<II")
+# Trailer: index offset, index length, magic
+_TRAILER = struct.Struct("<QI8s")
+# Response headers the pipeline looks at
+_KEPT_HEADERS = ("content-type", "retry-after")
+_USAGE_FIELDS = ("prompt_token_count", "candidates_token_count", "total_token_count")
+
+
+class CassetteMiss(LookupError):
+    """Replay was asked for a call the cassette has no recording of."""
+
+
+class RecordedError(Exception):
+    """An upstream error replayed from a cassette; code is its HTTP status when it had one."""
+
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+
+def _digest(request: Dict) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(",", ":"),
+                                     default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def _gemini_request(model_name: str, contents, generation_config, stream: bool) -> Dict:
+    """The matched part of a generate_content call; image parts are reduced to their hash."""
+    parts = []
+    for part in contents if isinstance(contents, (list, tuple)) else [contents]:
+        if isinstance(part, dict) and "data" in part:
+            data = part["data"].encode("utf-8") if isinstance(part["data"], str) else bytes(part["data"])
+            parts.append({"mime_type": part.get("mime_type"), "sha256": hashlib.sha256(data).hexdigest()})
+        else:
+            parts.append(str(part))
+    return {"api": "gemini", "model": model_name, "contents": parts, "generation_config": generation_config,
+            "stream": bool(stream)}
+
+
+def _http_request(method: str, url: str, body: Union[bytes, str, None]) -> Dict:
+    """The matched part of a FoodData Central request: no host (so recordings survive a base URL change) and no API key."""
+    parts = urlsplit(url)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True) if name != "api_key")
+    payload = None
+    if body:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = hashlib.sha256(body if isinstance(body, bytes) else body.encode("utf-8")).hexdigest()
+    return {"api": "usda", "method": method.upper(), "path": parts.path, "query": query, "json": payload}
+
+
+def _error(error: BaseException) -> Dict:
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(getattr(error, "response", None), "status_code", None)
+    return {"type": type(error).__name__, "message": str(error), "code": code}
+
+
+def _text(response) -> str:
+    try:
+        return response.text or ""
+    except (AttributeError, ValueError):
+        return ""
+
+
+def _usage(response) -> Optional[Dict]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {field: getattr(usage, field, 0) or 0 for field in _USAGE_FIELDS}
+
+
+def _timeout_of(request_options) -> Optional[float]:
+    timeout = (request_options or {}).get("timeout") if isinstance(request_options, dict) else None
+    return timeout if isinstance(timeout, (int, float)) else None
+
+
+class Cassette:
+    """One cassette file, open for recording (mode="record") or replay (mode="replay").
+
+        with Cassette("traffic.cas", "record") as cassette:
+            restore = cassette.install()
+            ...                        # every counter created from here on is recorded
+            restore()
+    """
+
+    def __init__(self, path: Union[str, Path], mode: str = "replay", latency_scale: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode!r}")
+        self.path = Path(path)
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Request digest -> offsets of its recordings, in call order
+        self._calls: Dict[str, List[int]] = {}
+        self._analyses: List[int] = []
+        self._blobs: Dict[str, int] = {}
+        self._cursors: Dict[str, int] = {}
+        self._mmap = None
+        if mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "wb")
+            self._file.write(_MAGIC)
+            self._offset = len(_MAGIC)
+            self._started = time.monotonic()
+        else:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._mmap[:len(_MAGIC)] != _MAGIC:
+                self.close()
+                raise ValueError(f"{self.path} is not a calorie counter cassette")
+            self._load_index()
+
+    def __enter__(self) -> "Cassette":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Finish the file: a recording gets its index and trailer."""
+        with self._lock:
+            if self._file is None:
+                return
+            if self.mode == "record":
+                index = zlib.compress(json.dumps({"calls": self._calls, "analyses": self._analyses,
+                                                  "blobs": self._blobs}, separators=(",", ":")).encode("utf-8"))
+                self._file.write(index)
+                self._file.write(_TRAILER.pack(self._offset, len(index), _INDEX_MAGIC))
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._file.close()
+            self._file = None
+
+    # Storage
+
+    def _append(self, record: Dict, payload: bytes = b"") -> None:
+        data = zlib.compress(json.dumps(record, separators=(",", ":"), default=str).encode("utf-8"))
+        with self._lock:
+            if self._file is None:
+                return
+            offset = self._offset
+            self._file.write(_RECORD.pack(len(data), len(payload)) + data + payload)
+            self._offset += _RECORD.size + len(data) + len(payload)
+            self._register(record, offset)
+
+    def _register(self, record: Dict, offset: int) -> None:
+        kind = record["kind"]
+        if kind == "call":
+            self._calls.setdefault(record["key"], []).append(offset)
+        elif kind == "analysis":
+            self._analyses.append(offset)
+        elif kind == "blob":
+            self._blobs.setdefault(record["key"], offset)
+
+    def _read(self, offset: int) -> Tuple[Dict, bytes]:
+        length, payload_length = _RECORD.unpack_from(self._mmap, offset)
+        start = offset + _RECORD.size
+        record = json.loads(zlib.decompress(self._mmap[start:start + length]))
+        return record, self._mmap[start + length:start + length + payload_length]
+
+    def _load_index(self) -> None:
+        size = len(self._mmap)
+        if size >= len(_MAGIC) + _TRAILER.size:
+            offset, length, magic = _TRAILER.unpack_from(self._mmap, size - _TRAILER.size)
+            if magic == _INDEX_MAGIC:
+                index = json.loads(zlib.decompress(self._mmap[offset:offset + length]))
+                self._calls, self._analyses, self._blobs = index["calls"], index["analyses"], index["blobs"]
+                return
+        logger.warning(f"Cassette {self.path} has no index (recording cut short?); scanning its records")
+        offset = len(_MAGIC)
+        while offset + _RECORD.size <= size:
+            length, payload_length = _RECORD.unpack_from(self._mmap, offset)
+            end = offset + _RECORD.size + length + payload_length
+            if end > size:
+                break
+            try:
+                record, _ = self._read(offset)
+            except (zlib.error, ValueError):
+                break
+            self._register(record, offset)
+            offset = end
+
+    # Recording
+
+    def _record_call(self, request: Dict, started: float, response: Dict) -> None:
+        now = time.monotonic()
+        self._append({"kind": "call", "key": _digest(request), "t": round(started - self._started, 4),
+                      "latency": round(now - started, 4), "request": request, "response": response})
+        count(cassette_calls, api=request["api"], outcome="recorded")
+
+    def record_analysis(self, image: Union[bytes, str, Path], user_corrections: str = "",
+                        deadline_ms: Optional[float] = None, priority: Optional[int] = None) -> None:
+        """Record an analysis request (its image, corrections, request deadline and priority) and when it arrived."""
+        if self.mode != "record":
+            return
+        data = image if isinstance(image, bytes) else Path(image).read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._blobs:
+            # Two threads may both store the same image; the index keeps the first copy
+            self._append({"kind": "blob", "key": digest}, data)
+        self._append({"kind": "analysis", "t": round(time.monotonic() - self._started, 4), "image": digest,
+                      "corrections": user_corrections or "", "deadline_ms": deadline_ms, "priority": priority})
+
+    # Replay
+
+    def _next_call(self, request: Dict) -> Dict:
+        """The next recording of request, cycling through them when replay asks more often than recorded."""
+        key = _digest(request)
+        with self._lock:
+            offsets = self._calls.get(key)
+            if not offsets:
+                self.misses += 1
+            else:
+                position = self._cursors.get(key, 0)
+                self._cursors[key] = position + 1
+        if not offsets:
+            count(cassette_calls, api=request["api"], outcome="miss")
+            raise CassetteMiss(f"Cassette {self.path.name} has no recording of this {request['api']} call ({key})")
+        count(cassette_calls, api=request["api"], outcome="replayed")
+        return self._read(offsets[position % len(offsets)])[0]
+
+    def _delay(self, seconds: float) -> float:
+        return max(0.0, seconds * self.latency_scale)
+
+    def analyses(self) -> Iterator[Dict]:
+        """The recorded analyses in arrival order, each with its image bytes."""
+        for offset in self._analyses:
+            analysis, _ = self._read(offset)
+            blob, data = self._read(self._blobs[analysis["image"]])
+            analysis["image"] = bytes(data)
+            yield analysis
+
+    def info(self) -> Dict:
+        """Counts of the recorded calls by api and endpoint, and the recording's duration."""
+        endpoints: Dict[str, Dict] = {}
+        duration = 0.0
+        for offsets in self._calls.values():
+            for offset in offsets:
+                record, _ = self._read(offset)
+                request = record["request"]
+                name = (f"gemini {request['model']}" + (" stream" if request["stream"] else "")
+                        if request["api"] == "gemini" else f"usda {request['method']} {request['path']}")
+                stats = endpoints.setdefault(name, {"calls": 0, "errors": 0, "latency_seconds": 0.0})
+                stats["calls"] += 1
+                stats["errors"] += bool(record["response"].get("error"))
+                stats["latency_seconds"] += record["latency"]
+                duration = max(duration, record["t"] + record["latency"])
+        for stats in endpoints.values():
+            stats["mean_latency_ms"] = round(stats.pop("latency_seconds") / stats["calls"] * 1000, 1)
+        return {"path": str(self.path), "bytes": len(self._mmap) if self._mmap is not None else self._offset,
+                "analyses": len(self._analyses), "images": len(self._blobs),
+                "distinct_calls": len(self._calls), "duration_seconds": round(duration, 2),
+                "calls": dict(sorted(endpoints.items()))}
+
+    def install(self) -> Callable[[], None]:
+        """Route calorie_counter's Gemini and FoodData Central traffic through this cassette.
+
+        Install before creating counters: a counter keeps the Gemini model and HTTP clients it
+        already has. Replay also lifts the client-side rate limits, which only slow it down.
+        Returns a function undoing the installation.
+        """
+        previous = (calorie_counter._genai, calorie_counter._gemini_pool_models, calorie_counter._shared_usda_session,
+                    async_calorie_counter.usda_transport, calorie_counter.GEMINI_RATE_LIMIT,
+                    calorie_counter.USDA_RATE_LIMIT)
+        session = requests.Session()
+        if self.mode == "record":
+            genai = calorie_counter.get_genai()
+            adapter = _RecordingAdapter(self, calorie_counter.get_usda_session().get_adapter(
+                calorie_counter.USDA_API_BASE_URL))
+            calorie_counter._genai = _GenAI(lambda name, **kwargs: _RecordingModel(
+                self, genai.GenerativeModel(name, **kwargs), name))
+            if httpx is not None:
+                async_calorie_counter.usda_transport = _RecordingTransport(self, httpx.AsyncHTTPTransport(
+                    limits=httpx.Limits(max_connections=calorie_counter.USDA_POOL_SIZE)))
+        else:
+            adapter = _ReplayAdapter(self)
+            calorie_counter._genai = _GenAI(lambda name, **kwargs: _ReplayModel(self, name))
+            if httpx is not None:
+                async_calorie_counter.usda_transport = _ReplayTransport(self)
+            calorie_counter.GEMINI_RATE_LIMIT = calorie_counter.USDA_RATE_LIMIT = "0"
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        calorie_counter._shared_usda_session = session
+        calorie_counter._gemini_pool_models = {}
+
+        def restore() -> None:
+            (calorie_counter._genai, calorie_counter._gemini_pool_models, calorie_counter._shared_usda_session,
+             async_calorie_counter.usda_transport, calorie_counter.GEMINI_RATE_LIMIT,
+             calorie_counter.USDA_RATE_LIMIT) = previous
+        return restore
+
+
+class _GenAI:
+    """Stands in for google.generativeai while a cassette is installed."""
+
+    def __init__(self, factory: Callable):
+        self._factory = factory
+
+    def GenerativeModel(self, model_name: str = "", **kwargs):
+        return self._factory(model_name, **kwargs)
+
+    def configure(self, **kwargs) -> None:
+        pass
+
+
+# Gemini recording
+
+class _RecordingModel:
+    """A Gemini model whose calls are written to a cassette; anything else goes to the real model."""
+
+    def __init__(self, cassette: Cassette, model, model_name: str):
+        object.__setattr__(self, "_cassette", cassette)
+        object.__setattr__(self, "_model", model)
+        object.__setattr__(self, "_model_name", model_name)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def __setattr__(self, name, value) -> None:
+        # get_gemini_pool_model gives the real model the client of its key
+        setattr(self._model, name, value)
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        request = _gemini_request(self._model_name, contents, generation_config, stream)
+        started = time.monotonic()
+        try:
+            response = self._model.generate_content(contents, generation_config=generation_config, stream=stream,
+                                                    **kwargs)
+        except Exception as e:
+            self._cassette._record_call(request, started, {"error": _error(e)})
+            raise
+        return self._recorded(request, started, response, stream)
+
+    async def generate_content_async(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        request = _gemini_request(self._model_name, contents, generation_config, stream)
+        started = time.monotonic()
+        try:
+            response = await self._model.generate_content_async(contents, generation_config=generation_config,
+                                                                stream=stream, **kwargs)
+        except Exception as e:
+            self._cassette._record_call(request, started, {"error": _error(e)})
+            raise
+        return self._recorded(request, started, response, stream)
+
+    def _recorded(self, request: Dict, started: float, response, stream: bool):
+        if stream:
+            return _RecordingStream(self._cassette, request, started, response)
+        self._cassette._record_call(request, started, {"text": _text(response), "usage": _usage(response)})
+        return response
+
+
+class _RecordingStream:
+    """A streamed response that records its chunks, with their arrival times, once consumed."""
+
+    def __init__(self, cassette: Cassette, request: Dict, started: float, response):
+        self._cassette = cassette
+        self._request = request
+        self._started = started
+        self._response = response
+        self._chunks: List[List] = []
+        self._recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def _chunk(self, chunk) -> None:
+        self._chunks.append([round(time.monotonic() - self._started, 4), _text(chunk)])
+
+    def _finish(self, error: Optional[BaseException] = None, complete: bool = True) -> None:
+        if self._recorded:
+            return
+        self._recorded = True
+        response = {"text": "".join(text for _, text in self._chunks), "chunks": self._chunks,
+                    "usage": _usage(self._response), "complete": complete}
+        if error is not None:
+            response["error"] = _error(error)
+        self._cassette._record_call(self._request, self._started, response)
+
+    def __iter__(self):
+        complete = False
+        try:
+            for chunk in self._response:
+                self._chunk(chunk)
+                yield chunk
+            complete = True
+        except Exception as e:
+            self._finish(e)
+            raise
+        finally:
+            # A consumer that stops early (e.g. at its deadline) leaves a truncated recording
+            self._finish(complete=complete)
+
+    async def __aiter__(self):
+        complete = False
+        try:
+            async for chunk in self._response:
+                self._chunk(chunk)
+                yield chunk
+            complete = True
+        except Exception as e:
+            self._finish(e)
+            raise
+        finally:
+            self._finish(complete=complete)
+
+
+# Gemini replay
+
+class _ReplayModel:
+    """A Gemini model answering from a cassette."""
+
+    def __init__(self, cassette: Cassette, model_name: str):
+        self._cassette = cassette
+        self._model_name = model_name
+
+    def _lookup(self, contents, generation_config, stream: bool, request_options) -> Tuple[Dict, float, bool]:
+        """The recording to replay, how long to wait before answering, and whether the wait times out."""
+        record = self._cassette._next_call(_gemini_request(self._model_name, contents, generation_config, stream))
+        response = record["response"]
+        chunks = response.get("chunks")
+        delay = self._cassette._delay(chunks[0][0] if chunks else record["latency"])
+        timeout = _timeout_of(request_options)
+        if timeout is not None and delay > timeout:
+            return response, timeout, True
+        return response, delay, False
+
+    @staticmethod
+    def _answer(response: Dict, stream: bool, cassette: Cassette):
+        error = response.get("error")
+        if error and not response.get("chunks"):
+            raise RecordedError(error["message"], error.get("code"))
+        if stream:
+            return _ReplayStream(response, cassette)
+        return _ReplayResponse(response)
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, request_options=None,
+                         **kwargs):
+        response, delay, timed_out = self._lookup(contents, generation_config, stream, request_options)
+        time.sleep(delay)
+        if timed_out:
+            raise TimeoutError(f"Replayed Gemini call exceeded its {delay:.2f}s timeout")
+        return self._answer(response, stream, self._cassette)
+
+    async def generate_content_async(self, contents, generation_config=None, stream: bool = False,
+                                     request_options=None, **kwargs):
+        response, delay, timed_out = self._lookup(contents, generation_config, stream, request_options)
+        await asyncio.sleep(delay)
+        if timed_out:
+            raise TimeoutError(f"Replayed Gemini call exceeded its {delay:.2f}s timeout")
+        return self._answer(response, stream, self._cassette)
+
+
+class _ReplayResponse:
+    def __init__(self, response: Dict):
+        self.text = response.get("text", "")
+        usage = response.get("usage")
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+
+
+class _ReplayStream(_ReplayResponse):
+    """Replays recorded chunks at their recorded (scaled) offsets from the first one."""
+
+    def __init__(self, response: Dict, cassette: Cassette):
+        super().__init__(response)
+        self._chunks = response["chunks"]
+        self._error = response.get("error")
+        self._cassette = cassette
+
+    def _schedule(self) -> Iterator[Tuple[float, str]]:
+        first = self._chunks[0][0] if self._chunks else 0.0
+        for offset, text in self._chunks:
+            yield self._cassette._delay(offset - first), text
+
+    def _raise_error(self) -> None:
+        if self._error:
+            raise RecordedError(self._error["message"], self._error.get("code"))
+
+    def __iter__(self):
+        started = time.monotonic()
+        for offset, text in self._schedule():
+            time.sleep(max(0.0, started + offset - time.monotonic()))
+            yield SimpleNamespace(text=text)
+        self._raise_error()
+
+    async def __aiter__(self):
+        started = time.monotonic()
+        for offset, text in self._schedule():
+            await asyncio.sleep(max(0.0, started + offset - time.monotonic()))
+            yield SimpleNamespace(text=text)
+        self._raise_error()
+
+
+# FoodData Central, requests
+
+def _http_response(response_status: int, headers, body: bytes) -> Dict:
+    return {"status": response_status, "body": body.decode("utf-8", errors="replace"),
+            "headers": {name: headers[name] for name in _KEPT_HEADERS if name in headers}}
+
+
+def _read_timeout(timeout) -> Optional[float]:
+    if isinstance(timeout, tuple):
+        timeout = timeout[-1]
+    return timeout if isinstance(timeout, (int, float)) else None
+
+
+class _RecordingAdapter(BaseAdapter):
+    """Transport adapter that sends through the real one and records each exchange."""
+
+    def __init__(self, cassette: Cassette, adapter: BaseAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        recorded = _http_request(request.method, request.url, request.body)
+        started = time.monotonic()
+        try:
+            response = self.adapter.send(request, **kwargs)
+        except requests.RequestException as e:
+            self.cassette._record_call(recorded, started, {"error": _error(e)})
+            raise
+        self.cassette._record_call(recorded, started, _http_response(response.status_code, response.headers,
+                                                                      response.content))
+        return response
+
+    def close(self) -> None:
+        self.adapter.close()
+
+
+class _ReplayAdapter(BaseAdapter):
+    """Transport adapter answering from a cassette."""
+
+    def __init__(self, cassette: Cassette):
+        super().__init__()
+        self.cassette = cassette
+
+    def send(self, request, timeout=None, **kwargs):
+        record = self.cassette._next_call(_http_request(request.method, request.url, request.body))
+        delay = self.cassette._delay(record["latency"])
+        timeout = _read_timeout(timeout)
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise requests.exceptions.ReadTimeout(f"Replayed request exceeded its {timeout:.2f}s timeout",
+                                                  request=request)
+        time.sleep(delay)
+        recorded = record["response"]
+        error = recorded.get("error")
+        if error:
+            exception = requests.exceptions.Timeout if "Timeout" in error["type"] else requests.ConnectionError
+            raise exception(error["message"], request=request)
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = recorded["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+# FoodData Central, httpx
+
+_AsyncTransport = httpx.AsyncBaseTransport if httpx is not None else object
+
+
+class _RecordingTransport(_AsyncTransport):
+    """httpx transport that sends through the real one and records each exchange."""
+
+    def __init__(self, cassette: Cassette, transport):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        recorded = _http_request(request.method, str(request.url), request.content)
+        started = time.monotonic()
+        try:
+            response = await self.transport.handle_async_request(request)
+            body = await response.aread()
+        except httpx.HTTPError as e:
+            self.cassette._record_call(recorded, started, {"error": _error(e)})
+            raise
+        self.cassette._record_call(recorded, started, _http_response(response.status_code, response.headers, body))
+        return httpx.Response(response.status_code, headers=response.headers, content=body, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class _ReplayTransport(_AsyncTransport):
+    """httpx transport answering from a cassette."""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+
+    async def handle_async_request(self, request):
+        record = self.cassette._next_call(_http_request(request.method, str(request.url), request.content))
+        delay = self.cassette._delay(record["latency"])
+        timeout = _read_timeout(request.extensions.get("timeout", {}).get("read"))
+        if timeout is not None and delay > timeout:
+            await asyncio.sleep(timeout)
+            raise httpx.ReadTimeout(f"Replayed request exceeded its {timeout:.2f}s timeout", request=request)
+        await asyncio.sleep(delay)
+        recorded = record["response"]
+        error = recorded.get("error")
+        if error:
+            exception = httpx.TimeoutException if "Timeout" in error["type"] else httpx.ConnectError
+            raise exception(error["message"], request=request)
+        return httpx.Response(recorded["status"], headers=recorded["headers"],
+                              content=recorded["body"].encode("utf-8"), request=request)
+
+
+# Replaying recorded traffic
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(fraction: float) -> float:
+        # Nearest-rank percentile
+        return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+    return {"p50": round(rank(0.50), 1), "p95": round(rank(0.95), 1), "p99": round(rank(0.99), 1),
+            "max": round(ordered[-1], 1)}
+
+
+def replay_traffic(cassette: Cassette, speed: float = 1.0, workers: int = 16,
+                   counter: Optional[calorie_counter.AccurateCalorieCounter] = None) -> Dict:
+    """Rerun the cassette's analyses at their recorded arrival times divided by speed.
+
+    Install the cassette (with latency_scale=1/speed to compress upstream latency too) before
+    calling. Returns latency percentiles, failures, degraded items and cassette misses.
+    """
+    from quota import INTERACTIVE, priority_scope
+
+    counter = counter or calorie_counter.AccurateCalorieCounter()
+    analyses = list(cassette.analyses())
+    misses_before = cassette.misses
+    started = time.monotonic()
+
+    def run(analysis: Dict) -> Tuple[float, Dict]:
+        time.sleep(max(0.0, started + analysis["t"] / speed - time.monotonic()))
+        began = time.perf_counter()
+        priority = analysis.get("priority")
+        with priority_scope(INTERACTIVE if priority is None else priority):
+            result = counter.get_calories_from_image(analysis["image"], analysis["corrections"],
+                                                     deadline_ms=analysis.get("deadline_ms"))
+        return (time.perf_counter() - began) * 1000, result
+
+    latencies, failures, degraded = [], 0, 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="replay") as pool:
+        for milliseconds, result in pool.map(run, analyses):
+            latencies.append(milliseconds)
+            failures += not result.get("success")
+            degraded += len(result.get("degraded_items") or [])
+    wall = time.monotonic() - started
+    return {"analyses": len(analyses), "failures": failures, "degraded_items": degraded,
+            "cassette_misses": cassette.misses - misses_before, "wall_seconds": round(wall, 2),
+            "analyses_per_second": round(len(analyses) / wall, 2) if wall else None,
+            "latency_ms": _percentiles(latencies)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect and replay recorded Gemini and FoodData Central traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="summarize a cassette")
+    info.add_argument("cassette")
+    replay = commands.add_parser("replay", help="rerun a cassette's analyses offline")
+    replay.add_argument("cassette")
+    replay.add_argument("--speed", type=float, default=1.0,
+                        help="replay N times faster: arrivals and upstream latencies are divided by N")
+    replay.add_argument("--workers", type=int, default=16, help="analyses run concurrently")
+    replay.add_argument("--verbose", action="store_true", help="keep the pipeline's INFO/WARNING logging")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        with Cassette(args.cassette) as cassette:
+            print(json.dumps(cassette.info(), indent=2))
+        return 0
+
+    if not args.verbose:
+        logging.disable(logging.WARNING)
+    with Cassette(args.cassette, latency_scale=1 / args.speed) as cassette:
+        restore = cassette.install()
+        try:
+            print(json.dumps(replay_traffic(cassette, speed=args.speed, workers=args.workers), indent=2))
+        finally:
+            restore()
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
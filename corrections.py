@@ -0,0 +1,526 @@
+"""Local, deterministic parsing and application of user corrections.
+
+The grammar covers the corrections users type most often:
+- quantities: "2 chapatis", "200g rice", "rice was 1.5 cups", "half the dal", "one more roti"
+- replacements: "actually paneer instead of tofu", "replace rice with quinoa", "actually 3 instead of 2"
+- additions: "missing: raita", "add 2 papads", "also had a lassi"
+- removals: "no raita", "remove the pickle", "the salad wasn't there"
+- cooking methods: "the chicken was fried"
+
+Quantities become weights through per-food piece weights and household measures, so portions
+are really rescaled:
+
+    outcome = apply_corrections(analysis, "3 rotis, no raita")
+    outcome.analysis   # corrected copy of the analysis
+    outcome.unparsed   # clauses the engine could not apply ("" when it applied all of them)
+
+Only what is left in ``unparsed`` needs the Gemini corrections call.
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from food_names import COOKING_METHODS, canonical_tokens, singularize
+from instrumentation import registry
+
+corrections_applied = registry.counter(
+    "calorie_counter_corrections_total",
+    "User corrections by how they were applied: locally, or with a Gemini call for what the engine could not parse")
+
+# Grams per piece of countable foods (per slice for bread, pizza and cake), keyed by canonical token
+PIECE_WEIGHTS = {
+    "chapati": 40, "naan": 90, "paratha": 80, "puri": 25, "bhatura": 70, "kulcha": 80, "thepla": 35,
+    "idli": 40, "dosa": 120, "uttapam": 120, "vada": 50, "appam": 50, "dhokla": 30, "papad": 12,
+    "samosa": 70, "kachori": 60, "pakora": 20, "bhaji": 25, "tikki": 60, "cutlet": 60, "momo": 25,
+    "ladoo": 40, "laddu": 40, "jamun": 40, "jalebi": 30, "barfi": 30, "rasgulla": 45, "modak": 40,
+    "egg": 50, "banana": 120, "apple": 180, "orange": 130, "mango": 200, "pear": 180, "peach": 150,
+    "kiwi": 75, "plum": 65, "guava": 100, "date": 8, "strawberry": 12, "tomato": 120, "onion": 110,
+    "potato": 170, "carrot": 60, "cucumber": 200,
+    "bread": 30, "toast": 30, "bun": 50, "bagel": 100, "muffin": 110, "croissant": 60, "pancake": 40,
+    "waffle": 75, "tortilla": 45, "taco": 100, "burrito": 250, "burger": 220, "sandwich": 200,
+    "pizza": 110, "cake": 80, "cookie": 15, "biscuit": 10, "donut": 60, "doughnut": 60,
+    "nugget": 18, "wing": 30, "drumstick": 100, "meatball": 30, "sausage": 50, "falafel": 17,
+    "kebab": 50, "dumpling": 25,
+}
+
+# Mass units in grams and household measures in millilitres, by canonical unit name
+MASS_UNITS = {"g": 1.0, "kg": 1000.0, "oz": 28.35, "lb": 453.6}
+VOLUME_UNITS = {
+    "ml": 1.0, "l": 1000.0, "cup": 240.0, "bowl": 250.0, "katori": 150.0, "glass": 250.0, "mug": 300.0,
+    "ladle": 60.0, "scoop": 60.0, "tablespoon": 15.0, "teaspoon": 5.0,
+}
+# Units counting pieces; "serving"-like units only have a weight when the item's own quantity uses them
+PIECE_UNITS = frozenset({"piece", "slice", "whole", "serving", "plate", "portion", "helping", "handful"})
+_UNIT_ALIASES = {
+    "gram": "g", "gm": "g", "gms": "g", "gr": "g", "grams": "g", "kilogram": "kg", "kilo": "kg", "kgs": "kg",
+    "ounce": "oz", "pound": "lb", "lbs": "lb", "millilitre": "ml", "milliliter": "ml", "mls": "ml",
+    "litre": "l", "liter": "l", "ltr": "l", "tbsp": "tablespoon", "tbs": "tablespoon", "tsp": "teaspoon",
+    "pc": "piece", "pcs": "piece", "nos": "piece", "katoris": "katori",
+}
+# Grams per millilitre, for household measures of foods much lighter or heavier than water
+DENSITIES = {
+    "rice": 0.8, "biryani": 0.8, "pulao": 0.8, "khichdi": 0.9, "poha": 0.6, "upma": 0.9, "oat": 0.9,
+    "cereal": 0.15, "cornflake": 0.12, "granola": 0.45, "salad": 0.4, "spinach": 0.2, "lettuce": 0.2,
+    "flour": 0.53, "sugar": 0.85, "oil": 0.92, "ghee": 0.91, "butter": 0.96, "honey": 1.42,
+    "milk": 1.03, "yogurt": 1.03, "lassi": 1.03, "raita": 1.0, "dal": 1.0,
+}
+# Size words in front of a unit ("2 large bowls")
+SIZE_FACTORS = {"small": 0.75, "medium": 1.0, "regular": 1.0, "large": 1.3, "big": 1.3}
+# Weight of an added item without a quantity, as the Gemini corrections prompt assumes
+DEFAULT_ADDED_WEIGHT_GRAMS = 100
+
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "single": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12, "couple": 2, "half": 0.5,
+    "quarter": 0.25,
+}
+_SCALE_WORDS = {"double": 2.0, "twice": 2.0, "triple": 3.0, "half": 0.5, "halve": 0.5}
+
+_NUMBER = (r"(?:\d+\s+\d+/\d+|\d+/\d+|\d*\.\d+|\d+"
+           r"|(?:a\s+)?half(?:\s+an?)?\b|(?:a\s+)?quarter(?:\s+of)?\b|(?:a\s+)?couple(?:\s+of)?\b|(?:a\s+)?dozen\b"
+           r"|(?:one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|single|an?)\b)")
+_UNIT_NAMES = sorted(set(MASS_UNITS) | set(VOLUME_UNITS) | PIECE_UNITS | set(_UNIT_ALIASES), key=len, reverse=True)
+_UNIT = r"(?:" + "|".join(_UNIT_NAMES) + r")(?:e?s)?\b"
+_MORE = r"(?:more|extra|additional)"
+
+_QUANTITY = re.compile(
+    rf"^(?P<count>{_NUMBER})\s*(?:(?P<more>{_MORE})\s+)?(?:(?P<size>{'|'.join(SIZE_FACTORS)})\s+)?"
+    rf"(?:(?P<unit>{_UNIT})\s*(?:of\s+)?)?(?:(?P<more_after>{_MORE})\s+)?(?:(?:the|my|some)\s+)?(?P<food>.*)$")
+_QUANTITY_LAST = re.compile(
+    rf"^(?P<food>[a-z][a-z '&-]*?)\s*(?:[:=-]\s*|\s)(?:x\s*)?(?P<quantity>{_NUMBER}\s*(?:{_UNIT})?)$")
+_ANOTHER = re.compile(r"^(?:another|one\s+more)\s+(?P<food>.+)$")
+_REMOVAL = re.compile(
+    r"^(?:remove|delete|drop|exclude|take\s+out|minus|no|without|there\s+(?:is|was|are|were)\s+no|there'?s\s+no"
+    r"|(?:i\s+)?(?:did\s*n'?t|did\s+not)\s+(?:have|eat|drink))\s+(?:the\s+|any\s+)?(?P<food>.+)$")
+_ABSENT = re.compile(
+    r"^(?:the\s+)?(?P<food>.+?)\s+(?:is|was|are|were)\s*(?:n'?t|\s+not)\s+"
+    r"(?:there|present|included|in\s+(?:the\s+)?(?:photo|picture|image|meal|plate))$")
+_INSTEAD = re.compile(
+    r"^(?:actually\s+)?(?:it\s+(?:is|was)\s+|it'?s\s+|that\s+(?:is|was)\s+|that'?s\s+|those\s+(?:are|were)\s+)?"
+    r"(?P<new>.+?),?\s+(?:instead\s+of|rather\s+than|not)\s+(?:the\s+)?(?P<old>.+)$")
+_REPLACE = re.compile(r"^(?:replace|swap|change|switch)\s+(?:the\s+)?(?P<old>.+?)\s+(?:with|for|to|into)\s+(?P<new>.+)$")
+_ADDITION = re.compile(
+    r"^(?:missing|forgot|forgotten|add|added|plus|also|(?:i|we)\s+also\s+(?:had|ate|drank))\b\s*:?\s*"
+    r"(?:(?:had|ate|drank|add)\s+)?(?P<what>.+)$")
+_SCALE = re.compile(
+    rf"^(?P<factor>{'|'.join(_SCALE_WORDS)})\s+(?:(?:the|my|that)\s+|(?:amount|portion|quantity)\s+of\s+(?:the\s+)?)"
+    r"(?P<food>.+)$")
+_IS = re.compile(
+    r"^(?:the\s+)?(?P<old>.+?)\s+(?:is|was|are|were|should\s+be|should\s+have\s+been)\s+"
+    r"(?:actually\s+|only\s+|just\s+|about\s+|around\s+|roughly\s+)?(?P<new>.+)$")
+_FILLER = re.compile(r"^(?:(?:please|ok(?:ay)?|oh|so|well|hmm)\b[\s,]*|(?:i|we)\s+(?:had|ate|drank)\s+"
+                     r"|there\s+(?:is|are|was|were)\s+(?!no\b)|it\s+had\s+)+")
+# Commas split clauses except in front of "not"/"instead", as in "3 rotis, not 2"
+_CLAUSE_SPLIT = re.compile(r"[;\n]+|,(?!\d)(?!\s*(?:not|instead|rather)\b)|\.(?!\d)|!|\s+(?:and|but|then)\s+")
+# Subjects that name no food ("it was fried")
+_PRONOUNS = frozenset({"it", "that", "this", "these", "those", "they", "there", "everything", "all"})
+_FRYING_STYLES = ("deep", "pan", "stir", "shallow", "air")
+_FRYING = re.compile(rf"^(?:{'|'.join(_FRYING_STYLES)})[\s-]+fried$")
+
+
+class CorrectionOutcome:
+    """Result of apply_corrections: the corrected analysis and what the engine could not apply."""
+
+    __slots__ = ("analysis", "unparsed", "applied")
+
+    def __init__(self, analysis: Dict, unparsed: str, applied: int):
+        self.analysis = analysis
+        # Clauses left for the Gemini corrections call, joined with "; "
+        self.unparsed = unparsed
+        self.applied = applied
+
+
+def _number(text: str) -> float:
+    text = re.sub(r"\s+", " ", text.strip())
+    if "/" in text:
+        whole, _, fraction = text.rpartition(" ")
+        numerator, denominator = fraction.split("/")
+        return (float(whole) if whole else 0.0) + float(numerator) / float(denominator)
+    try:
+        return float(text)
+    except ValueError:
+        words = [word for word in text.split() if word not in ("a", "an", "of")] or [text]
+        return float(_NUMBER_WORDS[words[0]])
+
+
+def _unit(text: Optional[str]) -> Optional[str]:
+    if not text:
+        return None
+    text = text.strip()
+    unit = _UNIT_ALIASES.get(text) or _UNIT_ALIASES.get(singularize(text), singularize(text))
+    if unit not in MASS_UNITS and unit not in VOLUME_UNITS and unit not in PIECE_UNITS:
+        # "glasses" singularizes to "glass" but "slices" to "slice": try the bare "-s" form as well
+        unit = _UNIT_ALIASES.get(text[:-1], text[:-1])
+    return unit
+
+
+def _food(text: str) -> str:
+    return re.sub(r"^(?:(?:the|my|some|a|an|of)\s+)+", "", text.strip(" .:'\"")).strip()
+
+
+def _quantity(text: str) -> Optional[Tuple[float, Optional[str], bool, str]]:
+    """(count, unit, relative, food) of a quantity phrase such as "2 large bowls of dal" or "1 more roti"."""
+    match = _QUANTITY.match(text)
+    if not match:
+        return None
+    count = _number(match.group("count")) * SIZE_FACTORS.get(match.group("size") or "", 1.0)
+    relative = bool(match.group("more") or match.group("more_after"))
+    return count, _unit(match.group("unit")), relative, _food(match.group("food"))
+
+
+def _method(text: str) -> Optional[str]:
+    """The cooking method a phrase like "fried" or "deep fried" names, if that is all it says."""
+    text = text.strip()
+    if _FRYING.match(text):
+        return text.replace("-", " ")
+    tokens = canonical_tokens(text)
+    return text if len(tokens) == 1 and tokens[0] in COOKING_METHODS else None
+
+
+def _without_methods(name: str, method: str) -> str:
+    """name without cooking-method words that contradict method ("Grilled Chicken" -> "Chicken" for "fried")."""
+    keep = set(canonical_tokens(method)) & COOKING_METHODS
+    words = []
+    for word in name.split():
+        named = _method(word.lower())
+        if named and not set(canonical_tokens(named)) & keep:
+            if words and words[-1].lower() in _FRYING_STYLES:
+                # The "Deep" of "Deep Fried"
+                words.pop()
+            continue
+        words.append(word)
+    return " ".join(words) or name
+
+
+def _parse_clause(clause: str, previous: Optional[str]) -> Optional[Tuple]:
+    """One edit for a clause, or None when the grammar does not cover it.
+
+    Edits are tuples led by their kind: ("set", food, count, unit), ("increment", food, count, unit),
+    ("add", food, count, unit), ("remove", food), ("scale", food, factor),
+    ("rename", old, new, count, unit), ("method", food, method) and ("recount", old_count, new_count).
+    previous is the kind of the clause before, so "missing: raita, papad" adds both.
+    """
+    clause = _FILLER.sub("", clause.strip(" .:!")).strip()
+    if not clause:
+        return None
+
+    match = _REMOVAL.match(clause) or _ABSENT.match(clause)
+    if match:
+        return ("remove", _food(match.group("food")))
+
+    match = _INSTEAD.match(clause) or _REPLACE.match(clause)
+    if match and not re.search(r"\b(?:is|was|are|were)$", match.group("new")):
+        new, old = match.group("new").strip(), _food(match.group("old"))
+        new_quantity, old_quantity = _quantity(new), _quantity(old)
+        if new_quantity and old_quantity and not new_quantity[3] and not old_quantity[3]:
+            # "actually 3 instead of 2"
+            return ("recount", old_quantity[0], new_quantity[0])
+        if new_quantity and old_quantity and new_quantity[3] and not old_quantity[3]:
+            # "3 chapatis, not 2"
+            return ("set", new_quantity[3], new_quantity[0], new_quantity[1])
+        method = _method(new)
+        if method:
+            # "fried, not grilled" finds the grilled item by its cooking method
+            return ("method", old, method)
+        if new_quantity and new_quantity[3]:
+            return ("rename", old, new_quantity[3], new_quantity[0], new_quantity[1])
+        return ("rename", old, _food(new), None, None)
+
+    match = _ADDITION.match(clause)
+    if match:
+        what = match.group("what").strip()
+        quantity = _quantity(what)
+        if quantity and quantity[3]:
+            kind = "increment" if quantity[2] else "add"
+            return (kind, quantity[3], quantity[0], quantity[1])
+        another = _ANOTHER.match(what)
+        if another:
+            return ("increment", _food(another.group("food")), 1.0, None)
+        return ("add", _food(what), None, None) if canonical_tokens(what) else None
+
+    match = _SCALE.match(clause)
+    if match:
+        return ("scale", _food(match.group("food")), _SCALE_WORDS[match.group("factor")])
+
+    match = _ANOTHER.match(clause)
+    if match:
+        return ("increment", _food(match.group("food")), 1.0, None)
+
+    quantity = _quantity(clause)
+    if quantity and quantity[3] and canonical_tokens(quantity[3]):
+        return ("increment" if quantity[2] else "set", quantity[3], quantity[0], quantity[1])
+
+    match = _IS.match(clause)
+    if match:
+        old, new = _food(match.group("old")), match.group("new").strip()
+        if old in _PRONOUNS:
+            # "it was fried" is only clear when the meal has one item; the editor checks that
+            method = _method(new)
+            return ("method", old, method) if method else None
+        if not canonical_tokens(old):
+            return None
+        quantity = _quantity(new)
+        if quantity and not quantity[3]:
+            return ("set", old, quantity[0], quantity[1])
+        method = _method(new)
+        if method:
+            return ("method", old, method)
+        return None
+
+    match = _QUANTITY_LAST.match(clause)
+    if match:
+        quantity = _quantity(match.group("quantity"))
+        if quantity and canonical_tokens(match.group("food")):
+            return ("set", _food(match.group("food")), quantity[0], quantity[1])
+
+    if previous in ("add", "remove") and canonical_tokens(clause) and len(clause.split()) <= 4:
+        return ("add", _food(clause), None, None) if previous == "add" else ("remove", _food(clause))
+    return None
+
+
+@lru_cache(maxsize=1024)
+def parse_corrections(user_corrections: str) -> Tuple[Tuple[Tuple[str, Tuple], ...], Tuple[str, ...]]:
+    """Split corrections into clauses and parse each one.
+
+    Returns the (clause, edit) pairs the grammar understood and the clauses it did not.
+    """
+    parsed, unparsed = [], []
+    previous = None
+    for clause in _CLAUSE_SPLIT.split(user_corrections.lower()):
+        clause = clause.strip()
+        if not clause:
+            continue
+        edit = _parse_clause(clause, previous)
+        if edit is None:
+            unparsed.append(clause)
+            previous = None
+        else:
+            parsed.append((clause, edit))
+            previous = edit[0]
+    return tuple(parsed), tuple(unparsed)
+
+
+def _format_count(count: float) -> str:
+    return f"{count:g}" if count >= 1 or count == 0 else f"{count:.2g}"
+
+
+def _quantity_text(count: float, unit: Optional[str], food: str) -> str:
+    """estimated_quantity for a corrected item: "1.5 cups", "200 g", "3 rotis"."""
+    if unit is None:
+        return f"{_format_count(count)} {food}"
+    if count > 1 and unit not in MASS_UNITS and unit not in ("ml", "l"):
+        unit += "es" if unit.endswith(("ch", "sh", "ss")) else "s"
+    return f"{_format_count(count)} {unit}"
+
+
+_PIECES = frozenset({None, "piece", "whole"})
+
+
+class _Editor:
+    """Applies parsed edits to a copy of an analysis' food items."""
+
+    # Edits that change an item relative to its current state, so applying them twice doubles them
+    RELATIVE = frozenset({"increment", "scale"})
+    # Edits that name no item: once applied, a second pass would pick whatever else matches
+    UNANCHORED = frozenset({"recount"})
+
+    def __init__(self, food_items: List[Dict], repeat_safe_only: bool):
+        self.items = [dict(item) for item in food_items]
+        self.repeat_safe_only = repeat_safe_only
+
+    def find(self, food: str, contained: bool = False, exact: bool = False) -> Optional[int]:
+        """Index of the item a food mention refers to: the closest item whose tokens contain, or are contained in, the mention's.
+
+        With contained, the item must contain every token of the mention, so "sugar in the tea"
+        never finds the tea. With exact, the item's name (with or without its cooking method) must
+        have the mention's tokens and no others, so "rice" never finds the fried rice.
+        """
+        wanted = set(canonical_tokens(food))
+        if not wanted:
+            return None
+        best, best_score = None, 0.0
+        for index, item in enumerate(self.items):
+            have = set(canonical_tokens(f"{item.get('cooking_method', '')} {item.get('name', '')}"))
+            if exact:
+                if wanted not in (have, set(canonical_tokens(item.get("name", "")))):
+                    continue
+            elif not have or not (wanted <= have or (not contained and have <= wanted)):
+                continue
+            score = len(wanted & have) / len(wanted | have)
+            if score > best_score:
+                best, best_score = index, score
+        return best
+
+    @staticmethod
+    def _item_quantity(item: Dict) -> Optional[Tuple[float, Optional[str]]]:
+        quantity = _quantity(str(item.get("estimated_quantity") or "").lower())
+        return (quantity[0], quantity[1]) if quantity and quantity[0] > 0 else None
+
+    def grams(self, food: str, count: float, unit: Optional[str], item: Optional[Dict] = None) -> Optional[float]:
+        """Weight of count units of a food, or None when the engine knows no weight for that unit."""
+        tokens = canonical_tokens(food or (item or {}).get("name", ""))
+        if unit in MASS_UNITS:
+            return count * MASS_UNITS[unit]
+        if unit in VOLUME_UNITS:
+            density = next((DENSITIES[token] for token in reversed(tokens) if token in DENSITIES), 1.0)
+            return count * VOLUME_UNITS[unit] * density
+        if unit in (None, "piece", "slice", "whole"):
+            piece = next((PIECE_WEIGHTS[token] for token in reversed(tokens) if token in PIECE_WEIGHTS), None)
+            if piece:
+                return count * piece
+        # Servings, plates and uncommon pieces: scale the item's own estimate by its own quantity
+        if item is not None:
+            current = self._item_quantity(item)
+            if current and (current[1] == unit or {current[1], unit} <= _PIECES):
+                return count * float(item.get("estimated_weight_grams") or 0) / current[0]
+        return None
+
+    def _corrected(self, index: int, grams: float, quantity: str, note: str) -> None:
+        item = self.items[index]
+        item["estimated_weight_grams"] = round(grams, 1)
+        item["estimated_quantity"] = quantity
+        item["user_corrected"] = True
+        item["correction_notes"] = note
+
+    def set(self, clause: str, food: str, count: float, unit: Optional[str]) -> bool:
+        index = self.find(food)
+        if index is None:
+            return self.add(clause, food, count, unit)
+        grams = self.grams(food, count, unit, self.items[index])
+        if grams is None:
+            return False
+        quantity = _quantity_text(count, unit, food)
+        self._corrected(index, grams, quantity, f"User corrected quantity to {quantity} ({grams:.0f} g)")
+        return True
+
+    def increment(self, clause: str, food: str, count: float, unit: Optional[str]) -> bool:
+        index = self.find(food)
+        if index is None:
+            return self.add(clause, food, count, unit)
+        item = self.items[index]
+        grams = self.grams(food, count, unit, item)
+        if grams is None:
+            return False
+        quantity = item.get("estimated_quantity", "")
+        current = self._item_quantity(item)
+        if current and (current[1] == unit or {current[1], unit} <= _PIECES):
+            quantity = re.sub(r"^\S+", _format_count(current[0] + count), str(quantity), count=1)
+        total = float(item.get("estimated_weight_grams") or 0) + grams
+        self._corrected(index, total, quantity,
+                        f"User added {_quantity_text(count, unit, food)} ({grams:.0f} g)")
+        return True
+
+    def add(self, clause: str, food: str, count: Optional[float], unit: Optional[str]) -> bool:
+        if self.find(food) is not None:
+            # Already listed; with a count, "add 2 rotis" means two more
+            if count is None or self.repeat_safe_only:
+                return True
+            return self.increment(clause, food, count, unit)
+        if count is None:
+            grams = self.grams(food, 1.0, None) or DEFAULT_ADDED_WEIGHT_GRAMS
+            quantity = ""
+        else:
+            grams = self.grams(food, count, unit)
+            if grams is None:
+                return False
+            quantity = _quantity_text(count, unit, food)
+        self.items.append({
+            "name": food,
+            "cooking_method": "",
+            "estimated_quantity": quantity,
+            "estimated_weight_grams": round(grams, 1),
+            "description": f"Added based on user input: {clause}",
+            "confidence_score": 100,
+            "user_added": True
+        })
+        return True
+
+    def remove(self, clause: str, food: str) -> bool:
+        # On a second pass "no rice" must not go on to remove the fried rice
+        index = self.find(food, contained=True, exact=self.repeat_safe_only)
+        if index is None:
+            # "no oil used" or "no sugar in the tea" name no item; Gemini decides what they change.
+            # After a vision call that saw the corrections, the item is simply gone already.
+            return self.repeat_safe_only
+        del self.items[index]
+        return True
+
+    def scale(self, clause: str, food: str, factor: float) -> bool:
+        index = self.find(food)
+        if index is None:
+            return False
+        item = self.items[index]
+        grams = float(item.get("estimated_weight_grams") or 0) * factor
+        self._corrected(index, grams, item.get("estimated_quantity", ""), f"User corrected portion: {clause}")
+        return True
+
+    def rename(self, clause: str, old: str, new: str, count: Optional[float], unit: Optional[str]) -> bool:
+        index = self.find(old, exact=self.repeat_safe_only)
+        if index is None:
+            # Already renamed, e.g. by the vision call that saw the same corrections
+            return self.repeat_safe_only and self.find(new) is not None
+        item = self.items[index]
+        previous_name = item.get("name", old)
+        method = next((word for word in new.split() if _method(word)), None)
+        item["name"] = " ".join(word for word in new.split() if word != method) if method else new
+        if method:
+            item["cooking_method"] = method
+        item["description"] = f"Corrected by user from {previous_name}"
+        item["user_corrected"] = True
+        item["correction_notes"] = f"User corrected {previous_name} to {new}"
+        if count is not None:
+            grams = self.grams(new, count, unit, None)
+            if grams is None:
+                return False
+            item["estimated_weight_grams"] = round(grams, 1)
+            item["estimated_quantity"] = _quantity_text(count, unit, new)
+        return True
+
+    def method(self, clause: str, food: str, method: str) -> bool:
+        index = 0 if food in _PRONOUNS and len(self.items) == 1 else self.find(food)
+        if index is None:
+            return False
+        item = self.items[index]
+        # "Grilled Chicken Breast" would otherwise keep searching as grilled
+        item["name"] = _without_methods(item.get("name", food), method)
+        item["cooking_method"] = method
+        item["user_corrected"] = True
+        item["correction_notes"] = f"User corrected cooking method to {method}"
+        return True
+
+    def recount(self, clause: str, old_count: float, new_count: float) -> bool:
+        """"actually 3 instead of 2": rescale the one item whose quantity counts old_count."""
+        matches = [index for index, item in enumerate(self.items)
+                   if (self._item_quantity(item) or (None,))[0] == old_count]
+        if len(matches) != 1:
+            return False
+        item = self.items[matches[0]]
+        grams = float(item.get("estimated_weight_grams") or 0) * new_count / old_count
+        quantity = re.sub(r"^\S+", _format_count(new_count), str(item.get("estimated_quantity", "")), count=1)
+        self._corrected(matches[0], grams, quantity, f"User corrected quantity to {quantity} ({grams:.0f} g)")
+        return True
+
+
+def apply_corrections(analysis: Dict, user_corrections: str, repeat_safe_only: bool = False) -> CorrectionOutcome:
+    """Apply every correction the grammar understands to a copy of analysis.
+
+    Clauses it cannot parse, or whose food or unit weight it cannot resolve, are returned in
+    outcome.unparsed for the Gemini corrections call. With repeat_safe_only, for analyses whose
+    vision call already saw the same corrections, the relative edits ("one more roti", "double the
+    rice") and recounts ("3 instead of 2") are skipped, and removals and renames only apply to an
+    item named exactly as in the correction: everything else is an absolute edit and safe to apply again.
+    """
+    if not user_corrections or not user_corrections.strip():
+        return CorrectionOutcome(analysis, "", 0)
+    parsed, unparsed = parse_corrections(user_corrections.strip())
+    editor = _Editor(analysis.get("food_items", []), repeat_safe_only)
+    left = list(unparsed)
+    applied = 0
+    for clause, edit in parsed:
+        if repeat_safe_only and edit[0] in _Editor.RELATIVE | _Editor.UNANCHORED:
+            continue
+        if getattr(editor, edit[0])(clause, *edit[1:]):
+            applied += 1
+        else:
+            left.append(clause)
+    return CorrectionOutcome(dict(analysis, food_items=editor.items), "; ".join(left), applied)
@@ -0,0 +1,172 @@
+"""Request latency budgets shared by every stage of an analysis.
+
+    with deadline_scope(3000):      # this analysis has 3 s
+        ...
+        timeout = timeout_for(10)   # an HTTP call gets min(10 s, what is left)
+
+The deadline lives in a context variable, so threads started with submit_in_context and
+asyncio tasks see the budget of the request they work for. Stages that cannot finish in
+time raise DeadlineExceeded, and the pipeline degrades the affected items to a cheaper
+nutrition source instead of failing the request.
+
+run() bounds a blocking call by the deadline and can hedge it: when the first attempt has
+not answered after ``hedge_after`` seconds a duplicate is sent and the first answer wins.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Iterator, Optional
+
+from instrumentation import count, registry, submit_in_context
+
+hedged_calls = registry.counter(
+    "calorie_counter_hedged_calls_total", "Duplicate requests sent for slow calls, by call")
+deadline_exceeded = registry.counter(
+    "calorie_counter_deadline_exceeded_total", "Calls abandoned or skipped because the request deadline passed")
+
+# Absolute time.monotonic() deadline of the current request, if it has one
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("calorie_counter_deadline", default=None)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's latency budget ran out before the call finished."""
+
+
+@contextmanager
+def deadline_scope(deadline_ms: Optional[float]) -> Iterator[Optional[float]]:
+    """Give the block a budget of deadline_ms from now; a nested scope can only tighten the outer one.
+
+    None or a non-positive budget leaves the current deadline (if any) in place.
+    """
+    with deadline_at(time.monotonic() + deadline_ms / 1000 if deadline_ms and deadline_ms > 0 else None) as deadline:
+        yield deadline
+
+
+@contextmanager
+def deadline_at(deadline: Optional[float]) -> Iterator[Optional[float]]:
+    """deadline_scope with an absolute time.monotonic() deadline, e.g. one stage's share of the budget."""
+    previous = _deadline.get()
+    if deadline is None:
+        yield previous
+        return
+    if previous is not None:
+        deadline = min(deadline, previous)
+    _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        # Not token.reset(): generators may finish in a different context than they started
+        _deadline.set(previous)
+
+
+def remaining(reserve: float = 0.0) -> Optional[float]:
+    """Seconds left before the deadline minus reserve (never negative), or None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - reserve - time.monotonic())
+
+
+def expired(reserve: float = 0.0) -> bool:
+    left = remaining(reserve)
+    return left is not None and left <= 0
+
+
+def timeout_for(default: Optional[float], reserve: float = 0.0, name: str = "call") -> Optional[float]:
+    """Timeout for one call: default capped by the budget left; raises DeadlineExceeded when none is."""
+    left = remaining(reserve)
+    if left is None:
+        return default
+    if left <= 0:
+        count(deadline_exceeded, call=name)
+        raise DeadlineExceeded(f"No budget left for {name}")
+    return left if default is None else min(default, left)
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="deadline")
+    return _pool
+
+
+def run(fn: Callable, *args, hedge_after: float = 0.0, reserve: float = 0.0, bounded: bool = True,
+        name: str = "call"):
+    """fn(*args), abandoned with DeadlineExceeded when the budget (minus reserve) runs out first.
+
+    With hedge_after > 0 a duplicate attempt starts if the first has not answered by then; the
+    first success wins and an error is raised only once every attempt failed. bounded=False
+    only hedges, leaving the deadline to fn's own timeouts. Without a deadline or hedging, fn
+    runs directly on the calling thread.
+    """
+    if (not bounded or remaining(reserve) is None) and hedge_after <= 0:
+        return fn(*args)
+    pool = _executor()
+    attempts = {submit_in_context(pool, fn, *args)}
+    hedge_at = time.monotonic() + hedge_after if hedge_after > 0 else None
+    error = None
+    while attempts:
+        timeout = remaining(reserve) if bounded else None
+        if hedge_at is not None:
+            until_hedge = max(0.0, hedge_at - time.monotonic())
+            timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+        done, attempts = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        if done:
+            # The other attempt may still succeed
+            continue
+        if hedge_at is not None and time.monotonic() >= hedge_at:
+            hedge_at = None
+            count(hedged_calls, call=name)
+            attempts.add(submit_in_context(pool, fn, *args))
+            continue
+        if bounded and expired(reserve):
+            count(deadline_exceeded, call=name)
+            raise DeadlineExceeded(f"{name} did not finish before the request deadline")
+    raise error
+
+
+async def run_async(fn: Callable[..., Awaitable], *args, hedge_after: float = 0.0, reserve: float = 0.0,
+                    bounded: bool = True, name: str = "call"):
+    """Async form of run(): await fn(*args) within the budget, hedging it after hedge_after seconds."""
+    if (not bounded or remaining(reserve) is None) and hedge_after <= 0:
+        return await fn(*args)
+    attempts = {asyncio.ensure_future(fn(*args))}
+    hedge_at = time.monotonic() + hedge_after if hedge_after > 0 else None
+    error = None
+    try:
+        while attempts:
+            timeout = remaining(reserve) if bounded else None
+            if hedge_at is not None:
+                until_hedge = max(0.0, hedge_at - time.monotonic())
+                timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+            done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+            if done:
+                continue
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                count(hedged_calls, call=name)
+                attempts.add(asyncio.ensure_future(fn(*args)))
+                continue
+            if bounded and expired(reserve):
+                count(deadline_exceeded, call=name)
+                raise DeadlineExceeded(f"{name} did not finish before the request deadline")
+        raise error
+    finally:
+        for task in attempts:
+            task.cancel()
@@ -0,0 +1,468 @@
+"""Offline FoodData Central index.
+
+Builds a compact, memory-mappable index from the bulk FoodData Central downloads
+(Foundation, SR Legacy and FNDDS, as CSV directories or JSON files) and answers the
+same description searches as the FDC ``/foods/search`` endpoint without network access.
+
+Usage:
+    python fdc_index.py build fdc.idx FoodData_Central_csv_2024-10-31/ FoodData_Central_survey_food_json.json
+    python fdc_index.py search fdc.idx "grilled chicken breast"
+"""
+import argparse
+import bisect
+import csv
+import json
+import logging
+import math
+import mmap
+import re
+import struct
+import sys
+import zlib
+from array import array
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Nutrients tracked by the pipeline, keyed by FDC nutrient number (values are per 100 g)
+NUTRIENT_NUMBERS = {
+    "208": "calories",
+    "203": "protein",
+    "204": "fat",
+    "205": "carbohydrates",
+    "291": "fiber",
+    "307": "sodium",
+    "301": "calcium",
+    "303": "iron",
+}
+# Same nutrients keyed by FDC nutrient id, as returned in nutrientId / nutrient.id fields
+NUTRIENT_IDS = {
+    1008: "208",
+    1003: "203",
+    1004: "204",
+    1005: "205",
+    1079: "291",
+    1093: "307",
+    1087: "301",
+    1089: "303",
+}
+# Foundation foods often only report energy through the Atwater factors
+ENERGY_FALLBACK_NUMBERS = ("957", "958")
+ENERGY_FALLBACK_IDS = {2047: "957", 2048: "958"}
+
+DATA_TYPES = ["Foundation", "SR Legacy", "Survey (FNDDS)"]
+# Matches the remote search preference: Foundation and FNDDS before SR Legacy
+PREFERRED_DATA_TYPES = {"Foundation", "Survey (FNDDS)"}
+_CSV_DATA_TYPES = {
+    "foundation_food": "Foundation",
+    "sr_legacy_food": "SR Legacy",
+    "survey_fndds_food": "Survey (FNDDS)",
+}
+
+# First description segments that name a food group rather than the food ("Fish, salmon, ...")
+FOOD_GROUP_HEADS = frozenset({
+    "alcoholic beverage", "babyfood", "beverages", "candies", "cereals ready-to-eat", "fast foods", "fish",
+    "game meat", "infant formula", "nuts", "restaurant", "snacks", "spices",
+})
+# Description segments that say what the food lacks ("Pizza, no cheese", "skin not eaten")
+_NEGATED_SEGMENT = re.compile(r"\b(?:no|not|without)\b")
+_MAGIC = b"FDCIDX1\0"
+_SECTION_ALIGN = 8
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase and split text into alphanumeric tokens."""
+    return [token for token in _NON_ALNUM.sub(" ", text.lower()).split() if token]
+
+
+def trigrams(text: str) -> set:
+    """Return the padded character trigrams of every token in text."""
+    grams = set()
+    for token in tokenize(text):
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i:i + 3])
+    return grams
+
+
+def describes(query: str, description: str) -> bool:
+    """Whether an FDC description is the queried food, not one that merely shares its words.
+
+    Every query token must be in the description, and the description's head (its first segment,
+    or the first one after a food group) must be in the query: "grilled chicken salad" does not
+    take a grilled chicken breast, nor "chicken" the "Soup, chicken noodle, canned". Words in
+    negated segments ("Pizza, no cheese") do not count. Tokens are compared as in
+    food_names.tokens_align, up to a typo.
+    """
+    # food_names builds on this module's trigrams
+    from food_names import canonical_tokens, is_typo_variant
+
+    query_tokens = canonical_tokens(query)
+    segments = [segment.strip().lower() for segment in description.split(",")]
+    head = next((segment for segment in segments if segment and segment not in FOOD_GROUP_HEADS), "")
+    head_tokens = canonical_tokens(head)
+    described = canonical_tokens(" ".join(segment for segment in segments if not _NEGATED_SEGMENT.search(segment)))
+    if not query_tokens or not head_tokens:
+        return False
+    return (all(any(is_typo_variant(token, other) for other in described) for token in query_tokens)
+            and all(any(is_typo_variant(token, other) for other in query_tokens) for token in head_tokens))
+
+
+def _trigram_hash(gram: str) -> int:
+    return zlib.crc32(gram.encode("utf-8"))
+
+
+def _nutrient_number(entry: Dict) -> Optional[str]:
+    """Resolve the FDC nutrient number of one foodNutrients entry in any FDC JSON shape."""
+    nested = entry.get("nutrient") or {}
+    number = entry.get("nutrientNumber") or nested.get("number")
+    if number:
+        return str(number)
+    nutrient_id = entry.get("nutrientId") or nested.get("id")
+    if nutrient_id is None:
+        return None
+    nutrient_id = int(nutrient_id)
+    return NUTRIENT_IDS.get(nutrient_id) or ENERGY_FALLBACK_IDS.get(nutrient_id)
+
+
+def nutrients_from_fdc_food(food: Dict) -> Dict[str, float]:
+    """Map an FDC food (search result, /foods detail or bulk JSON) to the pipeline's nutrient names."""
+    by_number = {}
+    for entry in food.get("foodNutrients", []):
+        number = _nutrient_number(entry)
+        if number is None:
+            continue
+        value = entry.get("value", entry.get("amount"))
+        if value is None:
+            continue
+        by_number[number] = float(value)
+
+    nutrients = {}
+    for number, name in NUTRIENT_NUMBERS.items():
+        if number in by_number:
+            nutrients[name] = by_number[number]
+    if "calories" not in nutrients:
+        for number in ENERGY_FALLBACK_NUMBERS:
+            if number in by_number:
+                nutrients["calories"] = by_number[number]
+                break
+    return nutrients
+
+
+def _iter_json_foods(path: Path) -> Iterator[Tuple[int, str, str, Dict[str, float]]]:
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+
+    if isinstance(payload, dict):
+        foods = []
+        for key in ("FoundationFoods", "SRLegacyFoods", "SurveyFoods", "foods"):
+            foods.extend(payload.get(key, []))
+    else:
+        foods = payload
+
+    for food in foods:
+        data_type = food.get("dataType", "")
+        if data_type == "Survey":
+            data_type = "Survey (FNDDS)"
+        if data_type not in DATA_TYPES:
+            continue
+        yield int(food["fdcId"]), data_type, food.get("description", ""), nutrients_from_fdc_food(food)
+
+
+def _iter_csv_foods(directory: Path) -> Iterator[Tuple[int, str, str, Dict[str, float]]]:
+    foods = {}
+    with open(directory / "food.csv", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            data_type = _CSV_DATA_TYPES.get(row.get("data_type", ""))
+            if data_type:
+                foods[int(row["fdc_id"])] = (data_type, row.get("description", ""))
+
+    tracked = set(NUTRIENT_NUMBERS) | set(ENERGY_FALLBACK_NUMBERS)
+    nutrient_numbers = {}
+    with open(directory / "nutrient.csv", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            number = (row.get("nutrient_nbr") or "").split(".")[0]
+            if number in tracked:
+                nutrient_numbers[row["id"]] = number
+
+    # food_nutrient.csv is by far the largest file, so stream it and keep only tracked rows
+    values: Dict[int, Dict[str, float]] = defaultdict(dict)
+    with open(directory / "food_nutrient.csv", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            number = nutrient_numbers.get(row.get("nutrient_id"))
+            if number is None:
+                continue
+            fdc_id = int(row["fdc_id"])
+            if fdc_id in foods and row.get("amount"):
+                values[fdc_id][number] = float(row["amount"])
+
+    for fdc_id, (data_type, description) in foods.items():
+        by_number = values.get(fdc_id, {})
+        nutrients = {name: by_number[number] for number, name in NUTRIENT_NUMBERS.items() if number in by_number}
+        if "calories" not in nutrients:
+            for number in ENERGY_FALLBACK_NUMBERS:
+                if number in by_number:
+                    nutrients["calories"] = by_number[number]
+                    break
+        yield fdc_id, data_type, description, nutrients
+
+
+def iter_fdc_foods(source: Union[str, Path]) -> Iterator[Tuple[int, str, str, Dict[str, float]]]:
+    """Yield (fdc_id, data_type, description, per-100 g nutrients) from a bulk CSV directory or JSON file."""
+    source = Path(source)
+    if source.is_dir():
+        return _iter_csv_foods(source)
+    return _iter_json_foods(source)
+
+
+def _aligned(buffer: bytearray) -> None:
+    buffer.extend(b"\0" * (-len(buffer) % _SECTION_ALIGN))
+
+
+def _little_endian(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def build_index(sources: Iterable[Union[str, Path]], output_path: Union[str, Path]) -> int:
+    """Import FDC bulk downloads and write a memory-mappable index; returns the number of foods."""
+    columns = list(NUTRIENT_NUMBERS)
+    fdc_ids = array("I")
+    data_types = array("B")
+    desc_offsets = array("I", [0])
+    desc_blob = bytearray()
+    trigram_counts = array("H")
+    matrix = array("f")
+    postings: Dict[int, List[int]] = defaultdict(list)
+    seen = set()
+
+    for source in sources:
+        for fdc_id, data_type, description, nutrients in iter_fdc_foods(source):
+            if fdc_id in seen or "calories" not in nutrients:
+                continue
+            seen.add(fdc_id)
+            index = len(fdc_ids)
+            fdc_ids.append(fdc_id)
+            data_types.append(DATA_TYPES.index(data_type))
+            desc_blob.extend(description.encode("utf-8"))
+            desc_offsets.append(len(desc_blob))
+
+            hashes = {_trigram_hash(gram) for gram in trigrams(description)}
+            trigram_counts.append(min(len(hashes), 0xFFFF))
+            for h in hashes:
+                postings[h].append(index)
+
+            for number in columns:
+                matrix.append(nutrients.get(NUTRIENT_NUMBERS[number], math.nan))
+
+    trigram_keys = array("I", sorted(postings))
+    trigram_offsets = array("I", [0])
+    posting_list = array("I")
+    for h in trigram_keys:
+        posting_list.extend(postings[h])
+        trigram_offsets.append(len(posting_list))
+
+    sections = [
+        ("fdc_ids", "I", _little_endian(fdc_ids)),
+        ("data_types", "B", data_types.tobytes()),
+        ("desc_offsets", "I", _little_endian(desc_offsets)),
+        ("desc_blob", "B", bytes(desc_blob)),
+        ("trigram_counts", "H", _little_endian(trigram_counts)),
+        ("nutrients", "f", _little_endian(matrix)),
+        ("trigram_keys", "I", _little_endian(trigram_keys)),
+        ("trigram_offsets", "I", _little_endian(trigram_offsets)),
+        ("postings", "I", _little_endian(posting_list)),
+    ]
+
+    header = {"version": 1, "count": len(fdc_ids), "columns": columns, "data_types": DATA_TYPES, "sections": {}}
+    # Section offsets depend on the header length, so lay out the body relative to the header first
+    body = bytearray()
+    relative = {}
+    for name, typecode, data in sections:
+        _aligned(body)
+        relative[name] = (len(body), len(data), typecode)
+        body.extend(data)
+
+    header_size = 0
+    while True:
+        base = len(_MAGIC) + 4 + header_size
+        base += -base % _SECTION_ALIGN
+        header["sections"] = {name: [base + offset, length, typecode] for name, (offset, length, typecode) in relative.items()}
+        encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        if len(encoded) == header_size:
+            break
+        header_size = len(encoded)
+
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(_MAGIC)
+        f.write(struct.pack("<I", header_size))
+        f.write(encoded)
+        f.write(b"\0" * (-(len(_MAGIC) + 4 + header_size) % _SECTION_ALIGN))
+        f.write(body)
+
+    logger.info(f"FDC index written to {output_path}: {len(fdc_ids)} foods, {len(trigram_keys)} trigrams")
+    return len(fdc_ids)
+
+
+class FDCIndex:
+    """Read-only, memory-mapped FoodData Central index with trigram description search."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"Not an FDC index file: {self.path}")
+        if sys.byteorder != "little":
+            raise ValueError("FDC index files can only be memory-mapped on little-endian hosts")
+
+        (header_size,) = struct.unpack_from("<I", self._mmap, len(_MAGIC))
+        start = len(_MAGIC) + 4
+        header = json.loads(self._mmap[start:start + header_size].decode("utf-8"))
+        self.count = header["count"]
+        self.columns = header["columns"]
+        self.data_types = header["data_types"]
+
+        self._view = memoryview(self._mmap)
+        self._sections = {}
+        for name, (offset, length, typecode) in header["sections"].items():
+            section = self._view[offset:offset + length]
+            self._sections[name] = section if typecode == "B" else section.cast(typecode)
+
+        self._fdc_ids = self._sections["fdc_ids"]
+        self._types = self._sections["data_types"]
+        self._desc_offsets = self._sections["desc_offsets"]
+        self._desc_blob = self._sections["desc_blob"]
+        self._trigram_counts = self._sections["trigram_counts"]
+        self._nutrients = self._sections["nutrients"]
+        self._trigram_keys = self._sections["trigram_keys"]
+        self._trigram_offsets = self._sections["trigram_offsets"]
+        self._postings = self._sections["postings"]
+        # Trigrams that occur in a large share of descriptions ("ed ", " co") carry no signal
+        self._common_posting_limit = max(64, self.count // 4)
+
+    def close(self) -> None:
+        for section in self._sections.values():
+            section.release()
+        self._sections.clear()
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def description(self, index: int) -> str:
+        return bytes(self._desc_blob[self._desc_offsets[index]:self._desc_offsets[index + 1]]).decode("utf-8")
+
+    def nutrients(self, index: int) -> Dict[str, float]:
+        """Per-100 g nutrients of one food, keyed by the pipeline's nutrient names."""
+        width = len(self.columns)
+        row = self._nutrients[index * width:(index + 1) * width]
+        return {NUTRIENT_NUMBERS[number]: round(float(value), 4)
+                for number, value in zip(self.columns, row) if not math.isnan(value)}
+
+    def _postings_for(self, gram_hash: int) -> memoryview:
+        position = bisect.bisect_left(self._trigram_keys, gram_hash)
+        if position == len(self._trigram_keys) or self._trigram_keys[position] != gram_hash:
+            return self._postings[0:0]
+        return self._postings[self._trigram_offsets[position]:self._trigram_offsets[position + 1]]
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        """Rank foods by trigram overlap with the query; returns FDC-like candidate dicts."""
+        query_hashes = {_trigram_hash(gram) for gram in trigrams(query)}
+        if not query_hashes:
+            return []
+
+        lists = [self._postings_for(h) for h in query_hashes]
+        selective = [p for p in lists if 0 < len(p) <= self._common_posting_limit]
+        scores: Dict[int, int] = defaultdict(int)
+        for posting in (selective or [p for p in lists if len(p)]):
+            for index in posting:
+                scores[index] += 1
+        if not scores:
+            return []
+
+        query_size = len(query_hashes)
+        ranked = []
+        for index, matched in scores.items():
+            recall = matched / query_size
+            precision = matched / max(1, self._trigram_counts[index])
+            score = 0.8 * recall + 0.2 * precision
+            preferred = self.data_types[self._types[index]] in PREFERRED_DATA_TYPES
+            ranked.append((score, preferred, index))
+        ranked.sort(key=lambda entry: (entry[0], entry[1]), reverse=True)
+
+        results = []
+        for score, _, index in ranked[:limit]:
+            results.append({
+                "fdcId": self._fdc_ids[index],
+                "description": self.description(index),
+                "dataType": self.data_types[self._types[index]],
+                "score": round(score, 4),
+                "nutrients": self.nutrients(index),
+            })
+        return results
+
+    def lookup(self, query: str, min_score: float = 0.6, limit: int = 20) -> Optional[Dict]:
+        """Best match for a query in the same shape as fetch_usda_nutrition, or None below min_score.
+
+        Only the top ``limit`` trigram candidates that describe the query (see describes) count.
+        """
+        candidates = [candidate for candidate in self.search(query, limit=limit)
+                      if candidate["score"] >= min_score and describes(query, candidate["description"])]
+        if not candidates:
+            return None
+
+        # Among near-equal matches, prefer Foundation/FNDDS like the remote search does
+        best = candidates[0]
+        for candidate in candidates[1:]:
+            if candidate["score"] < best["score"] - 0.05:
+                break
+            if candidate["dataType"] in PREFERRED_DATA_TYPES and best["dataType"] not in PREFERRED_DATA_TYPES:
+                best = candidate
+                break
+
+        nutrients = dict(best["nutrients"])
+        nutrients["food_name"] = best["description"]
+        nutrients["serving_size"] = 100
+        nutrients["serving_unit"] = "g"
+        nutrients["fdc_id"] = best["fdcId"]
+        nutrients["match_score"] = best["score"]
+        nutrients["data_source"] = "USDA"
+        return nutrients
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or query an offline FoodData Central index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="import FDC bulk downloads into an index file")
+    build.add_argument("output", help="index file to write")
+    build.add_argument("sources", nargs="+", help="FDC CSV directories or JSON files")
+
+    search = subparsers.add_parser("search", help="search an index file")
+    search.add_argument("index", help="index file to read")
+    search.add_argument("query", help="food description to look up")
+    search.add_argument("--limit", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        count = build_index(args.sources, args.output)
+        print(f"Indexed {count} foods into {args.output}")
+    else:
+        index = FDCIndex(args.index)
+        print(json.dumps(index.search(args.query, limit=args.limit), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""Food-name canonicalization and fuzzy matching of previously resolved nutrition queries.
+
+"Grilled Chicken Breast", "grilled chicken breasts" and "Chicken breast, grilled" all
+canonicalize to "breast chicken grill", so they share one cache entry. QueryIndex then
+serves near-identical queries ("grilled chiken breast") from an earlier result instead of
+another remote search. A fuzzy hit needs the same number of canonical tokens, each one at
+most a typo away from its counterpart, so "chicken noodle" never borrows the result for
+"chicken noodle soup".
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fdc_index import tokenize, trigrams
+
+# Words that do not change what food is meant
+STOP_WORDS = frozenset({
+    "a", "an", "the", "of", "with", "and", "in", "on", "some", "fresh", "homemade", "style",
+    "serving", "portion", "bowl", "plate", "piece", "pieces"
+})
+
+# Regional and spelling variants, mapped to the name FoodData Central knows best
+SYNONYMS = {
+    "roti": "chapati", "chapatti": "chapati", "phulka": "chapati",
+    "curd": "yogurt", "dahi": "yogurt", "yoghurt": "yogurt",
+    "daal": "dal", "dhal": "dal",
+    "aubergine": "eggplant", "brinjal": "eggplant", "baingan": "eggplant",
+    "prawn": "shrimp", "courgette": "zucchini", "garbanzo": "chickpea", "chana": "chickpea",
+    "aloo": "potato", "gobi": "cauliflower", "palak": "spinach", "bhindi": "okra", "ladyfinger": "okra",
+    "maize": "corn", "capsicum": "bell pepper",
+}
+
+# Cooking-method forms reduced to one stem, so "grilled" and "grill" match
+_METHOD_STEMS = {
+    "grilled": "grill", "fried": "fry", "baked": "bake", "roasted": "roast",
+    "boiled": "boil", "steamed": "steam", "sauteed": "saute", "stewed": "stew", "broiled": "broil",
+    "poached": "poach", "scrambled": "scramble", "smoked": "smoke",
+}
+# Canonical cooking-method tokens
+COOKING_METHODS = frozenset(_METHOD_STEMS.values()) | {"raw"}
+
+# Words ending in "s" that are not plurals
+_KEEP_S = ("ss", "us")
+
+
+def singularize(token: str) -> str:
+    """Crude English singular of a token ("berries" -> "berry", "tomatoes" -> "tomato")."""
+    if len(token) <= 3 or not token.endswith("s") or token.endswith(_KEEP_S):
+        return token
+    if token.endswith("ies"):
+        return token[:-3] + "y"
+    if token.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return token[:-2]
+    return token[:-1]
+
+
+def canonical_tokens(text: str) -> List[str]:
+    """Canonical tokens of a food query: lowercased, singular, synonyms applied, stop words dropped."""
+    tokens = []
+    for token in tokenize(text):
+        if token in STOP_WORDS:
+            continue
+        token = _METHOD_STEMS.get(token, token)
+        token = singularize(token)
+        tokens.extend(SYNONYMS.get(token, token).split())
+    return tokens
+
+
+def typo_distance_limit(token: str) -> int:
+    """Edits tolerated in a token of this length: none for short words, where one edit is another food."""
+    if len(token) <= 3:
+        return 0
+    return 1 if len(token) <= 7 else 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (transpositions count once), or limit + 1 once it exceeds limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def is_typo_variant(a: str, b: str) -> bool:
+    """Whether two canonical tokens are the same word up to a typo."""
+    if a == b:
+        return True
+    limit = min(typo_distance_limit(a), typo_distance_limit(b))
+    return limit > 0 and edit_distance(a, b, limit) <= limit
+
+
+def tokens_align(query: List[str], candidate: List[str]) -> bool:
+    """Whether the token lists pair up one to one, each pair equal or a typo apart."""
+    if len(query) != len(candidate):
+        return False
+    unmatched = list(candidate)
+    # Exact pairs first, so a typo never claims a token that has an exact partner
+    pending = []
+    for token in query:
+        if token in unmatched:
+            unmatched.remove(token)
+        else:
+            pending.append(token)
+    for token in pending:
+        partner = next((other for other in unmatched if is_typo_variant(token, other)), None)
+        if partner is None:
+            return False
+        unmatched.remove(partner)
+    return True
+
+
+def canonical_query(food_name: str, cooking_method: str = "") -> str:
+    """Order-independent cache key for a food query; word order and duplicates do not matter."""
+    return " ".join(sorted(set(canonical_tokens(f"{cooking_method} {food_name}"))))
+
+
+class QueryIndex:
+    """Trigram similarity index over canonical queries that already have a cached result.
+
+    Thread-safe and bounded; the least recently added queries are dropped first.
+    """
+
+    def __init__(self, max_entries: int = 4096, min_score: float = 0.85):
+        self.max_entries = max_entries
+        self.min_score = min_score
+        self._grams: "OrderedDict[str, frozenset]" = OrderedDict()
+        self._postings: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str) -> None:
+        grams = frozenset(trigrams(key))
+        if not grams:
+            return
+        with self._lock:
+            if key in self._grams:
+                self._grams.move_to_end(key)
+                return
+            self._grams[key] = grams
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+            while len(self._grams) > self.max_entries:
+                self._remove(next(iter(self._grams)))
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if key in self._grams:
+                self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        for gram in self._grams.pop(key):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def match(self, key: str, min_score: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """Closest indexed query by trigram Dice similarity, as (key, score), or None below min_score.
+
+        Only candidates whose tokens align one to one with the query's (see tokens_align) qualify;
+        whole-query similarity alone cannot tell a typo from an added or dropped word.
+        """
+        threshold = self.min_score if min_score is None else min_score
+        grams = trigrams(key)
+        if not grams:
+            return None
+        with self._lock:
+            shared: Dict[str, int] = {}
+            for gram in grams:
+                for candidate in self._postings.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            scored = []
+            for candidate, overlap in shared.items():
+                score = 2 * overlap / (len(grams) + len(self._grams[candidate]))
+                if score >= threshold:
+                    scored.append((score, candidate))
+        tokens = key.split()
+        for score, candidate in sorted(scored, reverse=True):
+            if tokens_align(tokens, candidate.split()):
+                return candidate, round(score, 4)
+        return None
+
+    def __len__(self) -> int:
+        return len(self._grams)
@@ -0,0 +1,229 @@
+"""Local food composition table used to estimate USDA misses without an LLM call.
+
+The table is a CSV of dishes with per-100 g nutrients:
+
+    name,aliases,category,calories,protein,fat,carbohydrates,fiber,sodium
+    idli,idly,breakfast,146,4.5,0.6,30,1.2,300
+
+``aliases`` is a ``|``-separated list of other names for the same dish. Two tables ship
+in data/: food_composition.csv, a few hundred hand-curated dishes (Indian regional food
+included), and fdc_food_composition.csv, several thousand foods generated from USDA
+FoodData Central (FNDDS, Foundation and SR Legacy) by the importer below. The curated
+table is loaded first, so its rows win ties. FOOD_TABLE_PATH takes one table or several
+joined with os.pathsep.
+
+Names are matched on canonical tokens (see food_names): a table entry matches when all
+of its tokens occur in the query, and the entry covering most of the food name wins,
+so "chicken biryani" resolves to the chicken biryani row rather than plain biryani
+while "apple pie" does not fall back to a raw apple.
+
+Usage:
+    python food_table.py lookup "masala dosa" "paneer butter masala"
+    python food_table.py import data/fdc_food_composition.csv FoodData_Central_survey_food_json.json \
+        FoodData_Central_foundation_food_csv/ FoodData_Central_sr_legacy_food_csv/ \
+        --exclude data/food_composition.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from fdc_index import iter_fdc_foods
+from food_names import COOKING_METHODS, canonical_tokens
+from nutrition_records import NUTRIENT_FIELDS
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = Path(__file__).resolve().parent / "data"
+DEFAULT_FOOD_TABLE_PATH = DATA_DIR / "food_composition.csv"
+FDC_FOOD_TABLE_PATH = DATA_DIR / "fdc_food_composition.csv"
+# Curated dishes first, so they win ties against generated rows
+DEFAULT_FOOD_TABLE_PATHS = (DEFAULT_FOOD_TABLE_PATH, FDC_FOOD_TABLE_PATH)
+
+TABLE_COLUMNS = ("name", "aliases", "category") + NUTRIENT_FIELDS
+# FNDDS describes foods as eaten, so it goes first; Foundation and SR Legacy fill in ingredients
+IMPORT_DATA_TYPES = ("Survey (FNDDS)", "Foundation", "SR Legacy")
+# Description segments that qualify a food rather than name it ("Rice, white, cooked, no added fat")
+_QUALIFIER = re.compile(
+    r"^(?:nfs|ns\b|no added|fat added|fat not added|from\b|made\b|includes?\b|for use\b|as ingredient|upc\b"
+    r"|cooked|prepared|unprepared|home recipe|commercial|ready-to|reduced|lower|low\b|without salt|with salt"
+    r"|enriched|unenriched|fortified|regular$|plain$|frozen$|canned$|dry$|fresh$|raw$)"
+)
+# Second segments read as a suffix of the first ("Adobo, with rice" -> "adobo with rice")
+_SUFFIX_SEGMENT = re.compile(r"^(?:with|in|and|on|or)\b")
+# Names with more tokens than this never cover a real query, so they are not imported
+MAX_NAME_TOKENS = 4
+
+
+class FoodTable:
+    """In-memory composition table with a token index over every dish name and alias."""
+
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        # Each name or alias becomes a pattern: its canonical token set and the entry it names
+        self._patterns: List[Tuple[frozenset, int]] = []
+        # Token -> patterns containing it; a query only checks patterns sharing one of its tokens
+        self._index: Dict[str, List[int]] = {}
+        for entry_id, entry in enumerate(entries):
+            for name in [entry["name"]] + entry["aliases"]:
+                tokens = frozenset(canonical_tokens(name))
+                if not tokens:
+                    continue
+                pattern_id = len(self._patterns)
+                self._patterns.append((tokens, entry_id))
+                for token in tokens:
+                    self._index.setdefault(token, []).append(pattern_id)
+
+    @classmethod
+    def load(cls, path: Union[str, Path, Sequence[Union[str, Path]]] = DEFAULT_FOOD_TABLE_PATHS) -> "FoodTable":
+        """Load one table, or several (a sequence or an os.pathsep-joined string) in priority order."""
+        if isinstance(path, (str, Path)):
+            paths = [part for part in str(path).split(os.pathsep) if part]
+        else:
+            paths = list(path)
+        entries = []
+        for table_path in paths:
+            entries.extend(cls._read(table_path))
+        return cls(entries)
+
+    @staticmethod
+    def _read(path: Union[str, Path]) -> List[Dict]:
+        entries = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for line, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    nutrients = {name: float(row[name]) for name in NUTRIENT_FIELDS if row.get(name) not in (None, "")}
+                except ValueError as e:
+                    logger.warning(f"Skipping {path}:{line}: {e}")
+                    continue
+                if not row.get("name") or "calories" not in nutrients:
+                    continue
+                entries.append({
+                    "name": row["name"].strip(),
+                    "aliases": [alias.strip() for alias in (row.get("aliases") or "").split("|") if alias.strip()],
+                    "category": (row.get("category") or "").strip(),
+                    "nutrients": nutrients
+                })
+        return entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(self, food_name: str, cooking_method: str = "", min_score: float = 0.6) -> Optional[Dict]:
+        """Best entry for a food, with ``score`` = share of the food name's tokens the entry covers.
+
+        Cooking-method words may complete a pattern ("fried" + "rice" -> fried rice) but do not
+        count against the score. Returns None when nothing reaches min_score.
+        """
+        query_tokens = set(canonical_tokens(f"{cooking_method} {food_name}"))
+        name_tokens = {token for token in canonical_tokens(food_name) if token not in COOKING_METHODS}
+        if not name_tokens:
+            return None
+
+        best, best_rank = None, None
+        seen = set()
+        for token in query_tokens:
+            for pattern_id in self._index.get(token, ()):
+                if pattern_id in seen:
+                    continue
+                seen.add(pattern_id)
+                tokens, entry_id = self._patterns[pattern_id]
+                if not tokens <= query_tokens:
+                    continue
+                score = len(tokens & name_tokens) / len(name_tokens)
+                # Prefer coverage of the name, then more specific patterns, then table order
+                rank = (score, len(tokens), -entry_id)
+                if best_rank is None or rank > best_rank:
+                    best, best_rank = entry_id, rank
+        if best is None or best_rank[0] < min_score:
+            return None
+        entry = self.entries[best]
+        return {"name": entry["name"], "category": entry["category"], "score": round(best_rank[0], 4),
+                "nutrients": dict(entry["nutrients"])}
+
+
+def table_name(description: str) -> str:
+    """Short, lowercase dish name of an FDC description ("Soup, chicken noodle, canned" -> "chicken noodle soup")."""
+    segments = [segment.strip() for segment in description.lower().split(",")]
+    kept = [segment for segment in segments if segment and not _QUALIFIER.match(segment)]
+    if not kept:
+        return ""
+    name = kept[0]
+    if len(kept) > 1:
+        name = f"{name} {kept[1]}" if _SUFFIX_SEGMENT.match(kept[1]) else f"{kept[1]} {name}"
+    # A trailing "with chicken" still names the dish ("Rice, fried, with chicken")
+    if len(kept) > 2 and _SUFFIX_SEGMENT.match(kept[2]):
+        name = f"{name} {kept[2]}"
+    return name
+
+
+def import_fdc_foods(sources: Iterable[Union[str, Path]],
+                     exclude: Iterable[Union[str, Path]] = ()) -> List[Dict]:
+    """Table entries for the FDC foods in bulk downloads (see fdc_index.iter_fdc_foods).
+
+    Each distinct name keeps the first food that has it, taking data types in IMPORT_DATA_TYPES
+    order. Names already covered by the tables in exclude are skipped.
+    """
+    taken = {frozenset(canonical_tokens(name)) for entry in FoodTable.load(list(exclude)).entries
+             for name in [entry["name"]] + entry["aliases"]}
+    foods = [food for source in sources for food in iter_fdc_foods(source) if food[1] in IMPORT_DATA_TYPES]
+    foods.sort(key=lambda food: IMPORT_DATA_TYPES.index(food[1]))
+
+    entries = []
+    for fdc_id, data_type, description, nutrients in foods:
+        name = table_name(description)
+        tokens = frozenset(canonical_tokens(name))
+        if "calories" not in nutrients or not tokens or len(tokens) > MAX_NAME_TOKENS or tokens in taken:
+            continue
+        taken.add(tokens)
+        entries.append({"name": name, "aliases": [], "category": "", "nutrients": nutrients})
+    return entries
+
+
+def write_table(entries: Iterable[Dict], path: Union[str, Path]) -> int:
+    """Write entries in the table's CSV layout; returns the number of rows."""
+    rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(TABLE_COLUMNS)
+        for entry in entries:
+            nutrients = entry["nutrients"]
+            writer.writerow([entry["name"], "|".join(entry["aliases"]), entry["category"]] +
+                            [f"{round(nutrients[name], 2):g}" if name in nutrients else "" for name in NUTRIENT_FIELDS])
+            rows += 1
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Query or generate the local food composition table")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    lookup = subparsers.add_parser("lookup", help="look up dishes in the table")
+    lookup.add_argument("foods", nargs="+")
+    lookup.add_argument("--table", default=os.pathsep.join(map(str, DEFAULT_FOOD_TABLE_PATHS)))
+    lookup.add_argument("--min-score", type=float, default=0.6)
+
+    build = subparsers.add_parser("import", help="generate a table from FDC bulk downloads")
+    build.add_argument("output", help="CSV table to write")
+    build.add_argument("sources", nargs="+", help="FDC CSV directories or JSON files (FNDDS, Foundation, SR Legacy)")
+    build.add_argument("--exclude", nargs="*", default=[], help="tables whose dishes are not imported again")
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        rows = write_table(import_fdc_foods(args.sources, args.exclude), args.output)
+        print(f"Wrote {rows} foods to {args.output}")
+        return 0
+
+    table = FoodTable.load(args.table)
+    for food in args.foods:
+        print(json.dumps({"query": food, "match": table.match(food, min_score=args.min_score)}))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import hashlib
+import io
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are only MIME-sniffed
+    Image = None
+    ImageOps = None
+
+if Image is not None:
+    try:
+        # HEIC/HEIF phone photos need the pillow-heif plugin when it is installed
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+# MIME types the Gemini vision endpoint accepts as-is
+GEMINI_IMAGE_MIME_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+
+_OUTPUT_FORMATS = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def detect_mime_type(data: bytes) -> str:
+    """Detect the image MIME type from magic bytes instead of trusting the file extension."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"avif"):
+            return "image/avif" if brand == b"avif" else "image/heif"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    return "application/octet-stream"
+
+
+def perceptual_hash(image) -> int:
+    """64-bit difference hash (dHash) of a PIL image; similar photos differ in only a few bits."""
+    small = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ImagePreprocessor:
+    """Downscale, strip EXIF and re-encode images before they are uploaded to the vision model."""
+
+    def __init__(self, max_edge: int = 1536, quality: int = 85, output_format: str = "JPEG", enabled: bool = True):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.output_format = output_format.upper()
+        self.enabled = enabled
+        if self.output_format not in _OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+
+    @classmethod
+    def from_env(cls) -> "ImagePreprocessor":
+        """Build from IMAGE_PREPROCESSING, IMAGE_MAX_EDGE, IMAGE_QUALITY and IMAGE_OUTPUT_FORMAT."""
+        return cls(
+            max_edge=int(os.getenv("IMAGE_MAX_EDGE", "1536")),
+            quality=int(os.getenv("IMAGE_QUALITY", "85")),
+            output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG"),
+            enabled=os.getenv("IMAGE_PREPROCESSING", "1").lower() not in ("0", "false", "no")
+        )
+
+    def options(self) -> Dict:
+        return {"max_edge": self.max_edge, "quality": self.quality,
+                "output_format": self.output_format, "enabled": self.enabled}
+
+    def process(self, data: bytes) -> Dict:
+        """Return the bytes to upload with their real MIME type and a size report."""
+        original_mime = detect_mime_type(data)
+        result = {
+            "data": data,
+            "content_hash": hashlib.sha256(data).hexdigest(),
+            "perceptual_hash": None,
+            "mime_type": original_mime,
+            "original_mime_type": original_mime,
+            "original_bytes": len(data),
+            "processed_bytes": len(data),
+            "bytes_saved": 0,
+            "resized": False,
+            "reencoded": False
+        }
+        if Image is None:
+            return result
+        if not self.enabled:
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    result["perceptual_hash"] = perceptual_hash(ImageOps.exif_transpose(image))
+            except Exception as e:
+                logger.debug(f"Could not hash image: {e}")
+            return result
+
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                result["original_size"] = list(image.size)
+                # Apply the EXIF orientation before the metadata is dropped by re-encoding
+                image = ImageOps.exif_transpose(image)
+                has_exif = bool(image.info.get("exif"))
+                result["perceptual_hash"] = perceptual_hash(image)
+
+                resized = max(image.size) > self.max_edge
+                if resized:
+                    image.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+
+                if self.output_format == "JPEG" and image.mode not in ("RGB", "L"):
+                    if image.mode in ("RGBA", "LA", "P"):
+                        # Flatten transparency onto white, as a photo viewer would show it
+                        rgba = image.convert("RGBA")
+                        background = Image.new("RGB", rgba.size, (255, 255, 255))
+                        background.paste(rgba, mask=rgba.getchannel("A"))
+                        image = background
+                    else:
+                        image = image.convert("RGB")
+
+                buffer = io.BytesIO()
+                save_options = {"optimize": True}
+                if self.output_format in ("JPEG", "WEBP"):
+                    save_options["quality"] = self.quality
+                image.save(buffer, format=self.output_format, **save_options)
+                encoded = buffer.getvalue()
+                result["processed_size"] = list(image.size)
+        except Exception as e:
+            logger.warning(f"Image preprocessing failed, uploading original bytes: {e}")
+            return result
+
+        # Keep the original when re-encoding gains nothing and the model accepts it unchanged
+        needs_reencode = resized or has_exif or original_mime not in GEMINI_IMAGE_MIME_TYPES
+        if not needs_reencode and len(encoded) >= len(data):
+            return result
+
+        result.update({
+            "data": encoded,
+            "mime_type": _OUTPUT_FORMATS[self.output_format],
+            "processed_bytes": len(encoded),
+            "bytes_saved": len(data) - len(encoded),
+            "resized": resized,
+            "reencoded": True
+        })
+        return result
+
+    def process_file(self, image_path: Union[str, Path]) -> Optional[Dict]:
+        """Read and preprocess an image file, or None if it does not exist."""
+        image_path = Path(image_path)
+        if not image_path.exists():
+            return None
+        with open(image_path, "rb") as image:
+            return self.process(image.read())
+
+
+def preprocess_image_file(image_path: Union[str, Path], options: Dict) -> Optional[Dict]:
+    """Process-pool entry point: read and preprocess one file in a worker process.
+
+    Reading inside the worker means only the (much smaller) processed bytes cross the process boundary.
+    """
+    return ImagePreprocessor(**options).process_file(image_path)
+
+
+def report(preprocessed: Dict) -> Dict:
+    """The preprocessing summary surfaced in analysis results (everything but the bytes)."""
+    return {key: value for key, value in preprocessed.items()
+            if key not in ("data", "content_hash", "perceptual_hash")}
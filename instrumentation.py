@@ -0,0 +1,376 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Process-wide switch for counters and histograms; per-request timings and tracers work without it
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0").lower() in ("1", "true", "yes")
+
+# Latency buckets in seconds, from a cache hit to a slow vision call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+T = TypeVar("T")
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    """Labelled value that can go up and down, e.g. a queue depth."""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus layout."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # Per-bucket counts followed by the +Inf count and the running sum
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self, **labels) -> Dict:
+        series = self._series.get(_label_key(labels))
+        if series is None:
+            return {"count": 0, "sum": 0.0}
+        return {"count": sum(series[:-1]), "sum": series[-1]}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', f'{bound:g}'))} {cumulative}")
+                cumulative += series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]:g}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help_text, **kwargs)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def prometheus_text(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].collect())
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Zero every metric, e.g. between benchmark runs."""
+        for metric in list(self._metrics.values()):
+            metric.clear()
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "calorie_counter_stage_seconds", "Time spent in each pipeline stage")
+stage_errors = registry.counter(
+    "calorie_counter_stage_errors_total", "Pipeline stages that raised")
+cache_requests = registry.counter(
+    "calorie_counter_cache_requests_total", "Cache lookups by cache and result")
+usda_retries = registry.counter(
+    "calorie_counter_usda_retries_total", "FoodData Central requests retried after 429/5xx or timeouts")
+gemini_tokens = registry.counter(
+    "calorie_counter_gemini_tokens_total", "Gemini tokens by call and direction")
+
+# Span collector of the request being timed, if any (see collect_timings)
+_current_timings: contextvars.ContextVar[Optional[List[Dict]]] = contextvars.ContextVar(
+    "calorie_counter_timings", default=None)
+
+# Tracer hooks: factory(name, attributes) -> context manager wrapped around every span
+_tracers: List[Callable[[str, Dict], ContextManager]] = []
+
+
+def set_enabled(enabled: bool) -> None:
+    global METRICS_ENABLED
+    METRICS_ENABLED = enabled
+
+
+def add_tracer(factory: Callable[[str, Dict], ContextManager]) -> None:
+    """Wrap every span in factory(name, attributes), e.g. an OpenTelemetry tracer's
+    ``lambda name, attrs: tracer.start_as_current_span(name, attributes=attrs)``."""
+    _tracers.append(factory)
+
+
+def remove_tracer(factory: Callable[[str, Dict], ContextManager]) -> None:
+    _tracers.remove(factory)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("name", "attributes", "timings", "started", "tracer_contexts")
+
+    def __init__(self, name: str, attributes: Dict, timings: Optional[List[Dict]]):
+        self.name = name
+        self.attributes = attributes
+        self.timings = timings
+        self.tracer_contexts = []
+
+    def __enter__(self):
+        for factory in _tracers:
+            try:
+                context = factory(self.name, self.attributes)
+                context.__enter__()
+                self.tracer_contexts.append(context)
+            except Exception as e:
+                logger.debug(f"Tracer hook failed on {self.name}: {e}")
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if METRICS_ENABLED:
+            stage_seconds.observe(elapsed, stage=self.name)
+            if exc_type is not None:
+                stage_errors.inc(stage=self.name)
+        if self.timings is not None:
+            record = {"stage": self.name, "seconds": round(elapsed, 6)}
+            if self.attributes:
+                record.update(self.attributes)
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            self.timings.append(record)
+        for context in reversed(self.tracer_contexts):
+            try:
+                context.__exit__(exc_type, exc, tb)
+            except Exception as e:
+                logger.debug(f"Tracer hook failed on {self.name}: {e}")
+        return False
+
+
+def span(name: str, **attributes):
+    """Time a pipeline stage; a shared no-op unless metrics, timings or a tracer are active."""
+    timings = _current_timings.get()
+    if timings is None and not METRICS_ENABLED and not _tracers:
+        return _NOOP_SPAN
+    return _Span(name, attributes, timings)
+
+
+def count(counter: Counter, amount: float = 1, **labels) -> None:
+    if METRICS_ENABLED and amount:
+        counter.inc(amount, **labels)
+
+
+def record_cache(cache: str, result: str) -> None:
+    count(cache_requests, cache=cache, result=result)
+
+
+def record_tokens(call: str, usage_metadata) -> None:
+    """Count prompt and response tokens from a Gemini response's usage_metadata."""
+    if not METRICS_ENABLED or usage_metadata is None:
+        return
+    gemini_tokens.inc(getattr(usage_metadata, "prompt_token_count", 0) or 0, call=call, direction="prompt")
+    gemini_tokens.inc(getattr(usage_metadata, "candidates_token_count", 0) or 0, call=call, direction="response")
+
+
+@contextmanager
+def collect_timings(enabled: bool = True) -> Iterator[Optional[List[Dict]]]:
+    """Collect the spans of one request into a list (None when disabled)."""
+    if not enabled:
+        yield None
+        return
+    previous = _current_timings.get()
+    timings: List[Dict] = []
+    _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        # Not token.reset(): generators may finish in a different context than they started
+        _current_timings.set(previous)
+
+
+def summarize_timings(timings: List[Dict], total_seconds: Optional[float] = None) -> Dict:
+    """The timings block added to results: seconds per stage (summed over items) plus every span.
+
+    Spans of concurrent items overlap, so stage sums can exceed total_seconds.
+    """
+    stages: Dict[str, float] = {}
+    for record in timings:
+        stages[record["stage"]] = round(stages.get(record["stage"], 0) + record["seconds"], 6)
+    summary = {"stages": stages, "spans": list(timings)}
+    if total_seconds is not None:
+        summary["total_seconds"] = round(total_seconds, 6)
+    return summary
+
+
+def submit_in_context(executor, func: Callable, *args):
+    """executor.submit that carries the caller's timing context into the worker thread."""
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def iterate_in_context(iterator: Iterator[T]) -> Iterator[T]:
+    """Advance iterator in a copy of the caller's context, one step at a time.
+
+    Context variables the iterator sets and holds across a yield (deadline_scope, collect_timings)
+    stay in the copy, so a consumer that stops early is not left with them.
+    """
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(iterator.close)
+
+
+_EXHAUSTED = object()
+
+
+async def _step(iterator: AsyncIterator[T]):
+    return await anext(iterator, _EXHAUSTED)
+
+
+async def _close(iterator: AsyncIterator[T]) -> None:
+    await iterator.aclose()
+
+
+async def aiterate_in_context(iterator: AsyncIterator[T]) -> AsyncIterator[T]:
+    """Async iterate_in_context: each step runs as a task in the copied context."""
+    context = contextvars.copy_context()
+    try:
+        while True:
+            item = await asyncio.create_task(_step(iterator), context=context)
+            if item is _EXHAUSTED:
+                return
+            yield item
+    finally:
+        await asyncio.create_task(_close(iterator), context=context)
+
+
+def prometheus_text() -> str:
+    return registry.prometheus_text()
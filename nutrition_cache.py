@@ -0,0 +1,476 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Sentinel so cached falsy values are distinguishable from misses
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process cache with a size bound and optional TTL."""
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SQLiteCache:
+    """On-disk cache with TTL expiry, shareable across processes and restarts.
+
+    Expired rows are purged when the cache is opened and every ``purge_interval`` writes, which
+    is also when the table is trimmed back to ``max_entries`` rows (soonest-expiring first).
+    """
+
+    def __init__(self, path: Union[str, Path], ttl_seconds: Optional[float] = 30 * 24 * 3600,
+                 table: str = "nutrition_cache", max_entries: Optional[int] = 100_000,
+                 purge_interval: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.table = table
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table}(expires_at)")
+        self.purge()
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            # WAL lets readers in other processes proceed while one process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _record(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_with_expiry(key, default)[0]
+
+    def get_with_expiry(self, key: str, default: Any = None) -> "tuple[Any, Optional[float]]":
+        """Return (value, expires_at) where expires_at is a time.time() timestamp or None for no expiry."""
+        try:
+            row = self._connection().execute(
+                f"SELECT value, expires_at FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Nutrition cache read failed for {key}: {e}")
+            self._record(False)
+            return default, None
+
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            self._record(False)
+            return default, None
+        self._record(True)
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.time() + ttl if ttl is not None else None
+        try:
+            self._connection().execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Nutrition cache write failed for {key}: {e}")
+            return
+        with self._stats_lock:
+            self._writes += 1
+            due = self.purge_interval > 0 and self._writes % self.purge_interval == 0
+        if due:
+            self.purge()
+
+    def delete(self, key: str) -> None:
+        self._connection().execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connection().execute(f"DELETE FROM {self.table}")
+
+    def purge_expired(self) -> int:
+        """Delete expired rows and return how many were removed."""
+        cursor = self._connection().execute(
+            f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        return cursor.rowcount
+
+    def trim(self) -> int:
+        """Delete rows beyond max_entries, soonest-expiring first, and return how many were removed."""
+        if self.max_entries is None:
+            return 0
+        excess = len(self) - self.max_entries
+        if excess <= 0:
+            return 0
+        # Rows that never expire sort last, so they are the final ones to go
+        cursor = self._connection().execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "ORDER BY expires_at IS NULL, expires_at LIMIT ?)", (excess,)
+        )
+        with self._stats_lock:
+            self.evictions += cursor.rowcount
+        return cursor.rowcount
+
+    def purge(self) -> int:
+        """Purge expired rows and trim to max_entries; failures are logged, never raised."""
+        try:
+            return self.purge_expired() + self.trim()
+        except sqlite3.Error as e:
+            logger.warning(f"Nutrition cache purge failed for {self.path}: {e}")
+            return 0
+
+    def __contains__(self, key: str) -> bool:
+        row = self._connection().execute(
+            f"SELECT 1 FROM {self.table} WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": str(self.path),
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class TieredCache:
+    """Memory LRU in front of an optional persistent tier; disk hits are promoted to memory."""
+
+    def __init__(self, memory: LRUCache, disk: Optional[SQLiteCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.memory.get(key, _MISSING)
+        if value is _MISSING and self.disk is not None:
+            value, expires_at = self.disk.get_with_expiry(key, _MISSING)
+            if value is not _MISSING:
+                # Promote with the disk entry's remaining lifetime, not the memory tier's default
+                remaining = None if expires_at is None else max(0.0, expires_at - time.time())
+                self.memory.set(key, value, remaining)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        self.memory.set(key, value, ttl_seconds)
+        if self.disk is not None:
+            self.disk.set(key, value, ttl_seconds)
+
+    def delete(self, key: str) -> None:
+        self.memory.delete(key)
+        if self.disk is not None:
+            self.disk.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.memory or (self.disk is not None and key in self.disk)
+
+    def __len__(self) -> int:
+        return len(self.disk) if self.disk is not None else len(self.memory)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "tiered",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None
+        }
+
+
+def create_nutrition_cache(path: Optional[Union[str, Path]] = None, max_entries: int = 2048,
+                           ttl_seconds: Optional[float] = 30 * 24 * 3600,
+                           disk_max_entries: Optional[int] = 100_000) -> TieredCache:
+    """Build the standard memory + (optional) SQLite cache stack."""
+    memory = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    disk = SQLiteCache(path, ttl_seconds=ttl_seconds, max_entries=disk_max_entries) if path else None
+    return TieredCache(memory, disk)
+
+
+def create_nutrition_cache_from_env() -> TieredCache:
+    """Build the cache stack from USDA_CACHE_PATH, USDA_CACHE_MAX_ENTRIES, USDA_CACHE_DISK_MAX_ENTRIES
+    and USDA_CACHE_TTL_SECONDS."""
+    return create_nutrition_cache(
+        path=os.getenv("USDA_CACHE_PATH") or None,
+        max_entries=int(os.getenv("USDA_CACHE_MAX_ENTRIES", "2048")),
+        ttl_seconds=float(os.getenv("USDA_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        disk_max_entries=int(os.getenv("USDA_CACHE_DISK_MAX_ENTRIES", "100000"))
+    )
+
+
+def _normalize_corrections(user_corrections: str) -> str:
+    return " ".join((user_corrections or "").lower().split())
+
+
+def _to_signed64(value: int) -> int:
+    # SQLite integers are signed 64-bit, perceptual hashes are unsigned
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _from_signed64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class AnalysisCache:
+    """Cache of Gemini vision analyses with an exact tier and a near-duplicate tier.
+
+    The exact tier is keyed by the image content hash plus normalized corrections. The
+    near-duplicate tier maps perceptual hashes to exact keys and matches any stored hash within
+    ``near_duplicate_threshold`` bits (Hamming distance) for the same corrections. On disk it keeps
+    at most ``max_entries`` unexpired hashes, and only those whose exact entry is still stored.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, max_entries: int = 512,
+                 ttl_seconds: Optional[float] = 7 * 24 * 3600, near_duplicate_threshold: int = 6):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.near_duplicate_threshold = near_duplicate_threshold
+        disk = SQLiteCache(path, ttl_seconds=ttl_seconds, table="analysis_cache") if path else None
+        self.exact = TieredCache(LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds), disk)
+        self._lock = threading.Lock()
+        # corrections -> {exact_key: perceptual_hash}, oldest first
+        self._perceptual: Dict[str, "OrderedDict[str, int]"] = {}
+        self._perceptual_size = 0
+        self.exact_hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+        self._disk = disk
+        if disk is not None:
+            self._load_perceptual_index()
+
+    def _load_perceptual_index(self) -> None:
+        conn = self._disk._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_phash ("
+            "exact_key TEXT PRIMARY KEY, corrections TEXT NOT NULL, phash INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._prune_perceptual_rows()
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0
+        rows = conn.execute(
+            "SELECT exact_key, corrections, phash FROM analysis_phash WHERE created_at > ? "
+            "ORDER BY created_at DESC LIMIT ?", (cutoff, self.max_entries)
+        ).fetchall()
+        for exact_key, corrections, phash in reversed(rows):
+            self._remember_perceptual(exact_key, corrections, _from_signed64(phash))
+
+    def _prune_perceptual_rows(self) -> None:
+        """Delete hashes that expired, lost their exact entry, or fall beyond max_entries."""
+        conn = self._disk._connection()
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0
+        try:
+            conn.execute("DELETE FROM analysis_phash WHERE created_at <= ?", (cutoff,))
+            # The exact tier purges and trims its own table; a hash without its analysis is useless
+            conn.execute(f"DELETE FROM analysis_phash WHERE exact_key NOT IN (SELECT key FROM {self._disk.table})")
+            conn.execute(
+                "DELETE FROM analysis_phash WHERE exact_key NOT IN "
+                "(SELECT exact_key FROM analysis_phash ORDER BY created_at DESC LIMIT ?)", (self.max_entries,)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Analysis cache perceptual index purge failed: {e}")
+
+    def _remember_perceptual(self, exact_key: str, corrections: str, phash: int) -> None:
+        bucket = self._perceptual.setdefault(corrections, OrderedDict())
+        if exact_key not in bucket:
+            self._perceptual_size += 1
+        bucket[exact_key] = phash
+        bucket.move_to_end(exact_key)
+        while self._perceptual_size > self.max_entries:
+            # Evict from the largest bucket; each bucket is kept in insertion order
+            largest = max(self._perceptual.values(), key=len)
+            largest.popitem(last=False)
+            self._perceptual_size -= 1
+
+    @staticmethod
+    def exact_key(content_hash: str, user_corrections: str = "") -> str:
+        return f"{content_hash}:{_normalize_corrections(user_corrections)}"
+
+    def get(self, content_hash: str, user_corrections: str = "",
+            perceptual_hash: Optional[int] = None) -> "tuple[Optional[Dict], Dict]":
+        """Return (analysis or None, cache status block for the result's data_sources)."""
+        key = self.exact_key(content_hash, user_corrections)
+        analysis = self.exact.get(key)
+        if analysis is not None:
+            with self._lock:
+                self.exact_hits += 1
+            return json.loads(json.dumps(analysis)), {"status": "exact_hit"}
+
+        if perceptual_hash is not None and self.near_duplicate_threshold > 0:
+            corrections = _normalize_corrections(user_corrections)
+            best_key, best_distance = None, None
+            with self._lock:
+                for candidate_key, candidate_hash in self._perceptual.get(corrections, {}).items():
+                    distance = bin(candidate_hash ^ perceptual_hash).count("1")
+                    if distance <= self.near_duplicate_threshold and (best_distance is None or distance < best_distance):
+                        best_key, best_distance = candidate_key, distance
+            if best_key is not None:
+                analysis = self.exact.get(best_key)
+                if analysis is not None:
+                    with self._lock:
+                        self.near_duplicate_hits += 1
+                    return json.loads(json.dumps(analysis)), {
+                        "status": "near_duplicate_hit", "hamming_distance": best_distance
+                    }
+
+        with self._lock:
+            self.misses += 1
+        return None, {"status": "miss"}
+
+    def set(self, content_hash: str, user_corrections: str, analysis: Dict,
+            perceptual_hash: Optional[int] = None) -> None:
+        key = self.exact_key(content_hash, user_corrections)
+        # Stored as a JSON round trip so later in-place edits by callers never leak into the cache
+        self.exact.set(key, json.loads(json.dumps(analysis)))
+        if perceptual_hash is None:
+            return
+
+        corrections = _normalize_corrections(user_corrections)
+        with self._lock:
+            self._remember_perceptual(key, corrections, perceptual_hash)
+        if self._disk is not None:
+            try:
+                self._disk._connection().execute(
+                    "INSERT OR REPLACE INTO analysis_phash (exact_key, corrections, phash, created_at) VALUES (?, ?, ?, ?)",
+                    (key, corrections, _to_signed64(perceptual_hash), time.time())
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Analysis cache perceptual index write failed: {e}")
+                return
+            self._prune_perceptual_rows()
+
+    def clear(self) -> None:
+        self.exact.clear()
+        with self._lock:
+            self._perceptual.clear()
+            self._perceptual_size = 0
+        if self._disk is not None:
+            self._disk._connection().execute("DELETE FROM analysis_phash")
+
+    def stats(self) -> Dict:
+        lookups = self.exact_hits + self.near_duplicate_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "near_duplicate_hits": self.near_duplicate_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.near_duplicate_hits) / lookups, 4) if lookups else 0.0,
+            "perceptual_entries": self._perceptual_size,
+            "exact": self.exact.stats()
+        }
+
+
+def create_analysis_cache_from_env() -> Optional[AnalysisCache]:
+    """Build the vision analysis cache from the ANALYSIS_CACHE_* environment variables (None if disabled)."""
+    if os.getenv("ANALYSIS_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    return AnalysisCache(
+        path=os.getenv("ANALYSIS_CACHE_PATH") or None,
+        max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "512")),
+        ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+        near_duplicate_threshold=int(os.getenv("ANALYSIS_CACHE_HAMMING_THRESHOLD", "6"))
+    )
@@ -0,0 +1,215 @@
+import math
+from typing import Dict, Iterable, Optional, Sequence
+
+from fdc_index import NUTRIENT_NUMBERS
+
+# Fixed nutrient order of every vector and matrix column
+NUTRIENT_FIELDS = tuple(NUTRIENT_NUMBERS.values())
+NUTRIENT_INDEX = {name: i for i, name in enumerate(NUTRIENT_FIELDS)}
+
+# Energy per gram of each macronutrient, for macro percentages
+MACRO_KCAL_PER_GRAM = (("protein", 4), ("carbohydrates", 4), ("fat", 9))
+
+# Keys of a result item that FoodRecord keeps as attributes; anything else is a source detail
+_CORE_KEYS = ("name", "cooking_method", "estimated_weight_grams", "estimated_quantity", "description",
+              "confidence_score", "data_source")
+_FLAG_KEYS = ("user_corrected", "user_added", "correction_notes")
+
+_numpy = None
+
+
+def _np():
+    """NumPy, imported on first use so it stays out of the import path (None when not installed)."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:  # NumPy is optional; without it vectors are plain lists
+            _numpy = False
+    return _numpy or None
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def nutrient_vector(nutrition: Dict):
+    """Fixed-order vector of the tracked nutrients in a nutrition dict; NaN marks a missing value."""
+    values = [nutrition.get(name) for name in NUTRIENT_FIELDS]
+    values = [float(value) if _is_number(value) else math.nan for value in values]
+    np = _np()
+    return np.array(values) if np else values
+
+
+def nutrient_dict(vector, digits: int = 2) -> Dict[str, float]:
+    """The nutrients present in a vector as a dict, rounded as in the result schema."""
+    return {name: round(float(value), digits) for name, value in zip(NUTRIENT_FIELDS, vector)
+            if not math.isnan(value)}
+
+
+def scale(vector, multiplier: float):
+    """Scale a nutrient vector or matrix to a different portion size."""
+    if _np() and not isinstance(vector, list):
+        return vector * multiplier
+    return [value * multiplier for value in vector]
+
+
+def stack(vectors: Iterable):
+    """Stack per-item nutrient vectors into an items x nutrients matrix."""
+    rows = list(vectors)
+    np = _np()
+    if np:
+        return np.vstack(rows) if rows else np.empty((0, len(NUTRIENT_FIELDS)))
+    return rows
+
+
+def column_totals(matrix):
+    """Sum each nutrient over the rows of a matrix, skipping missing values.
+
+    A nutrient missing from every row stays missing (NaN) instead of totalling zero.
+    """
+    np = _np()
+    if np:
+        missing = np.isnan(matrix).all(axis=0)
+        return np.where(missing, np.nan, np.nansum(matrix, axis=0))
+    totals = [math.nan] * len(NUTRIENT_FIELDS)
+    for row in matrix:
+        for i, value in enumerate(row):
+            if not math.isnan(value):
+                totals[i] = value if math.isnan(totals[i]) else totals[i] + value
+    return totals
+
+
+def totals_of(items: Iterable[Dict], fields: Sequence[str] = NUTRIENT_FIELDS) -> Dict[str, float]:
+    """Totals of the given nutrients over result items (zero when missing), rounded as in the result schema."""
+    totals = column_totals(stack(nutrient_vector(item["nutrition"]) for item in items))
+    values = (float(totals[NUTRIENT_INDEX[name]]) for name in fields)
+    return {name: 0 if math.isnan(value) else round(value, 2) for name, value in zip(fields, values)}
+
+
+def macro_percentages(totals: Dict[str, float]) -> Dict[str, float]:
+    """Share of calories from protein, carbohydrates and fat; empty when there are no calories."""
+    calories = totals.get("calories") or 0
+    if calories <= 0:
+        return {}
+    grams = [totals.get(name) or 0 for name, _ in MACRO_KCAL_PER_GRAM]
+    factors = [factor for _, factor in MACRO_KCAL_PER_GRAM]
+    np = _np()
+    if np:
+        shares = np.array(grams, dtype=float) * factors / calories * 100
+    else:
+        shares = [gram * factor / calories * 100 for gram, factor in zip(grams, factors)]
+    return {name: float(share) for (name, _), share in zip(MACRO_KCAL_PER_GRAM, shares)}
+
+
+def summarize_meals(results: Iterable[Dict]) -> Dict:
+    """Aggregate the total_nutrition of many meal results, e.g. a user's history for a report.
+
+    Returns the meal count, nutrient totals, per-meal averages and the overall macro split.
+    Failed results are skipped.
+    """
+    matrix = stack(nutrient_vector(result.get("total_nutrition", {}))
+                   for result in results if result.get("success"))
+    meals = len(matrix)
+    totals = column_totals(matrix)
+    total_nutrition = nutrient_dict(totals)
+    return {
+        "meals": meals,
+        "total_nutrition": total_nutrition,
+        "average_nutrition": nutrient_dict(scale(totals, 1 / meals)) if meals else {},
+        "macro_percentages": {name: round(share, 1) for name, share in macro_percentages(total_nutrition).items()}
+    }
+
+
+class FoodRecord:
+    """A resolved food item with its tracked nutrients held as one fixed-order vector.
+
+    ``nutrients`` covers the portion; ``nutrition_extras`` keeps the rest of the item's
+    nutrition block (portion size, data source, estimation notes), ``details`` the
+    source-specific fields and ``flags`` the user-correction markers. to_dict() renders
+    the result schema.
+    """
+
+    __slots__ = ("name", "cooking_method", "weight_grams", "quantity", "description", "confidence_score",
+                 "data_source", "nutrients", "nutrition_extras", "details", "flags")
+
+    def __init__(self, name: str, cooking_method: str = "", weight_grams: float = 100, quantity: str = "",
+                 description: str = "", confidence_score: float = 50, data_source: str = "",
+                 nutrients=None, nutrition_extras: Optional[Dict] = None, details: Optional[Dict] = None,
+                 flags: Optional[Dict] = None):
+        self.name = name
+        self.cooking_method = cooking_method
+        self.weight_grams = weight_grams
+        self.quantity = quantity
+        self.description = description
+        self.confidence_score = confidence_score
+        self.data_source = data_source
+        self.nutrients = nutrients if nutrients is not None else nutrient_vector({})
+        self.nutrition_extras = nutrition_extras or {}
+        self.details = details or {}
+        self.flags = flags or {}
+
+    @classmethod
+    def from_food_item(cls, food_item: Dict, data_source: str, nutrition: Dict,
+                       details: Optional[Dict] = None) -> "FoodRecord":
+        """Record for a vision-analysis food item and the nutrition resolved for its portion."""
+        nutrients, extras = split_nutrition(nutrition)
+        flags = {}
+        if food_item.get("user_corrected"):
+            flags["user_corrected"] = True
+            flags["correction_notes"] = food_item.get("correction_notes", "User corrected")
+        if food_item.get("user_added"):
+            flags["user_added"] = True
+            flags["correction_notes"] = "Added based on user input"
+        return cls(
+            food_item["name"], food_item.get("cooking_method", ""), food_item.get("estimated_weight_grams", 100),
+            food_item.get("estimated_quantity", ""), food_item.get("description", ""),
+            food_item.get("confidence_score", 50), data_source, nutrients, extras, details, flags
+        )
+
+    @classmethod
+    def from_dict(cls, item: Dict) -> "FoodRecord":
+        """Record for a result item, e.g. one from a previous result."""
+        nutrients, extras = split_nutrition(item.get("nutrition", {}))
+        known = set(_CORE_KEYS) | set(_FLAG_KEYS) | {"nutrition"}
+        return cls(
+            item["name"], item.get("cooking_method", ""), item.get("estimated_weight_grams", 100),
+            item.get("estimated_quantity", ""), item.get("description", ""), item.get("confidence_score", 50),
+            item.get("data_source", ""), nutrients, extras,
+            {key: value for key, value in item.items() if key not in known},
+            {key: item[key] for key in _FLAG_KEYS if key in item}
+        )
+
+    def rescaled(self, weight_grams: float) -> "FoodRecord":
+        """Copy with the nutrients scaled from the current portion weight to weight_grams."""
+        multiplier = weight_grams / (self.weight_grams or 100)
+        extras = dict(self.nutrition_extras)
+        if "portion_size_grams" in extras:
+            extras["portion_size_grams"] = weight_grams
+        return FoodRecord(self.name, self.cooking_method, weight_grams, self.quantity, self.description,
+                          self.confidence_score, self.data_source, scale(self.nutrients, multiplier),
+                          extras, dict(self.details), dict(self.flags))
+
+    def nutrition(self) -> Dict:
+        nutrition = nutrient_dict(self.nutrients)
+        nutrition.update(self.nutrition_extras)
+        return nutrition
+
+    def to_dict(self) -> Dict:
+        item = dict(zip(_CORE_KEYS, (self.name, self.cooking_method, self.weight_grams, self.quantity,
+                                     self.description, self.confidence_score, self.data_source)))
+        item.update(self.details)
+        item["nutrition"] = self.nutrition()
+        item.update(self.flags)
+        return item
+
+
+def split_nutrition(nutrition: Dict):
+    """Split a nutrition dict into its nutrient vector and the entries that are not tracked nutrients.
+
+    Untracked numeric entries (portion size, FDC id, serving size) are kept as-is, never scaled.
+    """
+    extras = {key: value for key, value in nutrition.items()
+              if key not in NUTRIENT_INDEX or not _is_number(value)}
+    return nutrient_vector(nutrition), extras
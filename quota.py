@@ -0,0 +1,431 @@
+"""Client-side quotas for the Gemini and FoodData Central API keys.
+
+Every key in a pool gets a token bucket refilled at the key's quota (GEMINI_RATE_LIMIT,
+USDA_RATE_LIMIT, e.g. "2000/min"). Calls queue for a token by priority, so interactive
+analyses go ahead of batch backfill, and take keys round-robin across the pool
+(GEMINI_API_KEYS, USDA_API_KEYS).
+
+A 429 empties the key's bucket, pauses the key for Retry-After and halves its rate.
+Successes then win the rate back step by step. The scheduler therefore settles just
+under the real ceiling instead of retrying into an error storm.
+
+    scheduler = QuotaScheduler("usda", keys, rate_per_second=1000 / 3600, burst=1000)
+    response = scheduler.call(lambda key: send(key), name="usda.search")
+
+Like the deadline in deadlines.py, the priority of the current request lives in a
+context variable (priority_scope).
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import deadlines
+import instrumentation
+from instrumentation import count, registry
+
+logger = logging.getLogger(__name__)
+
+quota_queue_depth = registry.gauge(
+    "calorie_counter_quota_queue_depth", "Calls waiting for an API quota token, by api and priority")
+quota_wait_seconds = registry.histogram(
+    "calorie_counter_quota_wait_seconds", "Time calls spent waiting for an API quota token")
+quota_throttled = registry.counter(
+    "calorie_counter_quota_throttled_total", "429 responses by api and key index")
+quota_rate = registry.gauge(
+    "calorie_counter_quota_rate_per_second", "Current adaptive request rate by api and key index")
+
+# Lower values are served first
+INTERACTIVE = 0
+BATCH = 10
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Share of the configured rate a key never drops below, however many 429s it gets
+MIN_RATE_FRACTION = 0.1
+# Share of the configured rate each success wins back after a 429
+RECOVERY_FRACTION = 0.05
+# Pause after a 429 without a Retry-After hint, in seconds
+DEFAULT_COOLDOWN = 1.0
+
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60,
+            "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+_RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(?:/\s*([a-z]+?)s?)?\s*$")
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("calorie_counter_priority", default=INTERACTIVE)
+
+
+class QuotaTimeout(TimeoutError):
+    """No quota token became free within the longest allowed wait."""
+
+
+class RateLimited(Exception):
+    """An API answered 429; raise it from a call to have the scheduler back off and retry."""
+
+    def __init__(self, message: str = "Rate limited", retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def priority_scope(priority: int) -> Iterator[int]:
+    """Run the block's API calls at priority (INTERACTIVE, BATCH or any int; lower goes first)."""
+    previous = _priority.get()
+    _priority.set(priority)
+    try:
+        yield priority
+    finally:
+        _priority.set(previous)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+def parse_rate(spec: Optional[str]) -> Tuple[float, float]:
+    """(requests per second, burst) of a quota like "2000/min" or "1000/hour"; a bare number is per minute.
+
+    The burst is one period's worth of requests. "0" or an empty spec means no limit: (0, 0).
+    """
+    match = _RATE_PATTERN.match((spec or "0").lower())
+    if not match or (match.group(2) and match.group(2) not in _PERIODS):
+        raise ValueError(f"Invalid rate limit {spec!r}; expected e.g. '2000/min' or '1000/hour'")
+    requests = float(match.group(1))
+    return requests / _PERIODS[match.group(2) or "min"], requests
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Whether an error from the Gemini SDK, requests or httpx is a 429."""
+    if isinstance(error, RateLimited):
+        return True
+    # google.api_core errors carry the HTTP status as an int code
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code == 429:
+        return True
+    if getattr(getattr(error, "response", None), "status_code", None) == 429:
+        return True
+    return str(error).startswith("429")
+
+
+def retry_after_of(error: BaseException) -> Optional[float]:
+    """The server's Retry-After hint in seconds, when the error carries one."""
+    if isinstance(error, RateLimited):
+        return error.retry_after
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    value = headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _KeyBucket:
+    """Token bucket of one API key with an additive-increase, multiplicative-decrease rate."""
+
+    __slots__ = ("ceiling", "rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.ceiling = rate
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        # Time tokens were last added; a paused key has it in the future
+        self.updated = now
+
+    def refill(self, now: float) -> None:
+        if now <= self.updated:
+            return
+        if self.ceiling > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.refill(now)
+        if now < self.updated:
+            return False
+        if self.ceiling <= 0:
+            return True
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def refund(self) -> None:
+        if self.ceiling > 0:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def wait_time(self, now: float) -> float:
+        paused = max(0.0, self.updated - now)
+        if self.ceiling <= 0:
+            return paused
+        return paused + max(0.0, 1 - self.tokens) / self.rate
+
+    def throttle(self, now: float, retry_after: Optional[float]) -> None:
+        self.tokens = 0.0
+        self.updated = max(self.updated, now + (retry_after if retry_after is not None else DEFAULT_COOLDOWN))
+        if self.ceiling > 0:
+            self.rate = max(self.ceiling * MIN_RATE_FRACTION, self.rate / 2)
+
+    def recover(self) -> None:
+        if self.ceiling > 0:
+            self.rate = min(self.ceiling, self.rate + self.ceiling * RECOVERY_FRACTION)
+
+
+class _Waiter:
+    __slots__ = ("priority", "index", "cancelled", "event", "future", "loop")
+
+    def __init__(self, priority: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.index: Optional[int] = None
+        self.cancelled = False
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+
+    def grant(self, index: int) -> None:
+        self.index = index
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class QuotaScheduler:
+    """Priority queue in front of a pool of API keys, each limited by its own token bucket.
+
+    rate_per_second=0 leaves the keys unlimited; 429s still pause the offending key. Threads
+    and coroutines (on any event loop) share one scheduler and one queue.
+    """
+
+    def __init__(self, name: str, keys: Sequence[Optional[str]], rate_per_second: float = 0.0,
+                 burst: Optional[float] = None, max_wait: float = 30.0, max_retries: int = 2):
+        if not keys:
+            raise ValueError(f"Quota {name}: at least one API key is required")
+        self.name = name
+        self.keys = list(keys)
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        now = time.monotonic()
+        burst = rate_per_second * 60 if burst is None else burst
+        self._buckets = [_KeyBucket(rate_per_second, burst, now) for _ in self.keys]
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._depth: Dict[int, int] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        with self._lock:
+            return sum(self._depth.values()) if priority is None else self._depth.get(priority, 0)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            for bucket in self._buckets:
+                bucket.refill(now)
+            return {
+                "queued": {PRIORITY_NAMES.get(priority, str(priority)): depth
+                           for priority, depth in sorted(self._depth.items()) if depth},
+                "keys": [{"index": index, "rate_per_second": round(bucket.rate, 4),
+                          "tokens": round(bucket.tokens, 2) if bucket.ceiling > 0 else None, "paused_seconds": round(max(0.0, bucket.updated - now), 3)}
+                         for index, bucket in enumerate(self._buckets)]
+            }
+
+    def acquire(self, priority: Optional[int] = None) -> int:
+        """Block until a key has a token; returns the key's index in keys."""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        give_up_at, deadline_bound = self._give_up_at(started)
+        with self._lock:
+            index = self._take_if_idle(started)
+            if index is not None:
+                return index
+            waiter = _Waiter(priority)
+            delay = self._enqueue(waiter, started)
+        while waiter.index is None:
+            left = give_up_at - time.monotonic()
+            if left <= 0:
+                with self._lock:
+                    if waiter.index is None:
+                        self._cancel(waiter)
+                        self._timed_out(started, deadline_bound)
+                break
+            waiter.event.wait(left if delay is None else min(left, delay))
+            with self._lock:
+                if waiter.index is None:
+                    delay = self._dispatch(time.monotonic())
+        self._observe_wait(priority, started)
+        return waiter.index
+
+    async def acquire_async(self, priority: Optional[int] = None) -> int:
+        """acquire() for coroutines; cancelling the caller gives its place (or token) back."""
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        give_up_at, deadline_bound = self._give_up_at(started)
+        with self._lock:
+            index = self._take_if_idle(started)
+            if index is not None:
+                return index
+            waiter = _Waiter(priority, asyncio.get_running_loop())
+            delay = self._enqueue(waiter, started)
+        try:
+            while waiter.index is None:
+                left = give_up_at - time.monotonic()
+                if left <= 0:
+                    with self._lock:
+                        if waiter.index is None:
+                            self._cancel(waiter)
+                            self._timed_out(started, deadline_bound)
+                    break
+                try:
+                    # Shielded, so a timeout does not cancel the future a grant would resolve
+                    await asyncio.wait_for(asyncio.shield(waiter.future), left if delay is None else min(left, delay))
+                except asyncio.TimeoutError:
+                    pass
+                with self._lock:
+                    if waiter.index is None:
+                        delay = self._dispatch(time.monotonic())
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.index is None:
+                    self._cancel(waiter)
+                else:
+                    self._buckets[waiter.index].refund()
+            raise
+        self._observe_wait(priority, started)
+        return waiter.index
+
+    def call(self, fn: Callable, name: str = "call", priority: Optional[int] = None):
+        """fn(key) with a quota token, retried on another token after a 429 (up to max_retries times)."""
+        for attempt in range(self.max_retries + 1):
+            index = self.acquire(priority)
+            try:
+                result = fn(self.keys[index])
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.throttled(index, retry_after_of(e), name)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            self.succeeded(index)
+            return result
+
+    async def call_async(self, fn: Callable[[Optional[str]], Awaitable], name: str = "call",
+                         priority: Optional[int] = None):
+        """Async form of call(): awaits fn(key)."""
+        for attempt in range(self.max_retries + 1):
+            index = await self.acquire_async(priority)
+            try:
+                result = await fn(self.keys[index])
+            except Exception as e:
+                if not is_rate_limited(e):
+                    raise
+                self.throttled(index, retry_after_of(e), name)
+                if attempt == self.max_retries:
+                    raise
+                continue
+            self.succeeded(index)
+            return result
+
+    def succeeded(self, index: int) -> None:
+        """Let a key that answered win back part of the rate an earlier 429 cost it."""
+        with self._lock:
+            bucket = self._buckets[index]
+            if bucket.rate >= bucket.ceiling:
+                return
+            bucket.recover()
+            rate = bucket.rate
+        self._set_rate(index, rate)
+
+    def throttled(self, index: int, retry_after: Optional[float] = None, name: str = "call") -> None:
+        """Back off a key that answered 429."""
+        with self._lock:
+            bucket = self._buckets[index]
+            bucket.throttle(time.monotonic(), retry_after)
+            rate = bucket.rate
+        count(quota_throttled, api=self.name, key=str(index))
+        self._set_rate(index, rate)
+        logger.warning(f"{name} was rate limited on {self.name} key #{index}; "
+                       f"pausing it {retry_after if retry_after is not None else DEFAULT_COOLDOWN}s "
+                       f"at {rate:.3g} requests/s")
+
+    def _give_up_at(self, now: float) -> Tuple[float, bool]:
+        left = deadlines.remaining()
+        if left is not None and left < self.max_wait:
+            return now + left, True
+        return now + self.max_wait, False
+
+    def _timed_out(self, started: float, deadline_bound: bool) -> None:
+        waited = time.monotonic() - started
+        if deadline_bound:
+            count(deadlines.deadline_exceeded, call=f"{self.name}.quota")
+            raise deadlines.DeadlineExceeded(f"No {self.name} quota before the request deadline ({waited:.2f}s)")
+        raise QuotaTimeout(f"No {self.name} quota within {waited:.2f}s")
+
+    def _take_if_idle(self, now: float) -> Optional[int]:
+        # Without anyone queued there is no priority order to respect
+        return None if self._queue else self._take(now)
+
+    def _take(self, now: float) -> Optional[int]:
+        """Index of the next key round-robin that has a token (consuming it), if any."""
+        for offset in range(len(self._buckets)):
+            index = (self._next + offset) % len(self._buckets)
+            if self._buckets[index].take(now):
+                self._next = (index + 1) % len(self._buckets)
+                return index
+        return None
+
+    def _enqueue(self, waiter: _Waiter, now: float) -> Optional[float]:
+        heapq.heappush(self._queue, (waiter.priority, next(self._sequence), waiter))
+        self._depth[waiter.priority] = self._depth.get(waiter.priority, 0) + 1
+        self._report_depth(waiter.priority)
+        return self._dispatch(now)
+
+    def _cancel(self, waiter: _Waiter) -> None:
+        # Removed lazily: _dispatch drops cancelled entries when they reach the head
+        waiter.cancelled = True
+        self._dequeued(waiter.priority)
+
+    def _dequeued(self, priority: int) -> None:
+        self._depth[priority] -= 1
+        self._report_depth(priority)
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """Hand tokens to queued waiters in priority order; returns seconds until the next token, if anyone waits."""
+        while self._queue:
+            priority, _, waiter = self._queue[0]
+            if waiter.cancelled:
+                heapq.heappop(self._queue)
+                continue
+            index = self._take(now)
+            if index is None:
+                return min(bucket.wait_time(now) for bucket in self._buckets)
+            heapq.heappop(self._queue)
+            self._dequeued(priority)
+            waiter.grant(index)
+        return None
+
+    def _report_depth(self, priority: int) -> None:
+        if instrumentation.METRICS_ENABLED:
+            quota_queue_depth.set(self._depth[priority], api=self.name,
+                                  priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _observe_wait(self, priority: int, started: float) -> None:
+        if instrumentation.METRICS_ENABLED:
+            quota_wait_seconds.observe(time.monotonic() - started, api=self.name,
+                                       priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _set_rate(self, index: int, rate: float) -> None:
+        if instrumentation.METRICS_ENABLED:
+            quota_rate.set(round(rate, 4), api=self.name, key=str(index))
@@ -0,0 +1,235 @@
+"""Single-flight deduplication of concurrent identical upstream calls.
+
+When many requests miss the cache for the same food at once, only the first caller (the
+leader) sends the FoodData Central search or Gemini estimate; the others wait for it and
+share its result, or its exception. SingleFlight serves threads and AsyncSingleFlight
+coroutines. Keys are normalized lookups (AccurateCalorieCounter.usda_cache_key and
+_estimate_key), so "Grilled chicken" and "chicken, grilled" share one call.
+
+    flight = SingleFlight("usda")
+    food = flight.do(key, search, query)
+
+do_many() is the batched form: the caller leads the keys nobody else has in flight, computes
+them in one call, and waits for the rest.
+
+Followers wait no longer than their own request deadline (deadlines.py). A leader that ran
+out of its budget does not pass DeadlineExceeded on to followers with time left: the first
+of them leads the call again.
+"""
+import asyncio
+import threading
+import weakref
+from typing import Awaitable, Callable, Dict, Hashable, List, Sequence
+
+import deadlines
+import instrumentation
+from instrumentation import count, registry
+
+single_flight_calls = registry.counter(
+    "calorie_counter_single_flight_calls_total",
+    "Deduplicated calls by flight and role: leaders ran the call, followers shared a leader's result")
+single_flight_dedup_ratio = registry.gauge(
+    "calorie_counter_single_flight_dedup_ratio", "Share of calls served by another caller's in-flight call")
+
+
+class _FlightStats:
+    """Leader/follower counts of one flight, locally and in the process-wide metrics."""
+
+    def __init__(self, name: str, enabled: bool):
+        self.name = name
+        self.enabled = enabled
+        self._leaders = 0
+        self._followers = 0
+        self._stats_lock = threading.Lock()
+
+    def _record(self, leaders: int, followers: int) -> None:
+        with self._stats_lock:
+            self._leaders += leaders
+            self._followers += followers
+        count(single_flight_calls, leaders, flight=self.name, role="leader")
+        count(single_flight_calls, followers, flight=self.name, role="follower")
+        if instrumentation.METRICS_ENABLED:
+            led = single_flight_calls.value(flight=self.name, role="leader")
+            shared = single_flight_calls.value(flight=self.name, role="follower")
+            single_flight_dedup_ratio.set(round(shared / ((led + shared) or 1), 4), flight=self.name)
+
+    def _timed_out(self) -> deadlines.DeadlineExceeded:
+        count(deadlines.deadline_exceeded, call=f"{self.name}.single_flight")
+        return deadlines.DeadlineExceeded(f"Single-flight {self.name}: no result before the request deadline")
+
+    @staticmethod
+    def _leader_ran_out(error: BaseException) -> bool:
+        """Whether a leader's error was its own deadline, one this caller still has budget past."""
+        return isinstance(error, deadlines.DeadlineExceeded) and not deadlines.expired()
+
+    def stats(self) -> Dict:
+        calls = self._leaders + self._followers
+        return {"calls": calls, "deduplicated": self._followers,
+                "dedup_ratio": round(self._followers / calls, 4) if calls else 0.0}
+
+
+class _Call:
+    __slots__ = ("owner", "done", "result", "error")
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(_FlightStats):
+    """Thread-safe single-flight group; with enabled=False every call runs on its own."""
+
+    def __init__(self, name: str = "default", enabled: bool = True):
+        super().__init__(name, enabled)
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable, *args):
+        """fn(*args), unless a call for key is already in flight, in which case its outcome."""
+        return self.do_many([key], lambda led: [fn(*args)])[0]
+
+    def do_many(self, keys: Sequence[Hashable], fn: Callable[[List[int]], Sequence]) -> List:
+        """Results for every key, in order; fn(indices) returns the results of the keys this caller leads.
+
+        A key in flight elsewhere, or repeated earlier in keys, waits for that call instead.
+        If fn raises, the waiters on its keys get the same exception, except a DeadlineExceeded
+        that leaves them budget: they call fn again for that key.
+        """
+        if not self.enabled:
+            return list(fn(list(range(len(keys)))))
+        me = threading.get_ident()
+        calls: List[_Call] = []
+        led: List[int] = []
+        mine: Dict[Hashable, _Call] = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                call = mine.get(key) or self._calls.get(key)
+                if call is None or (call.owner == me and key not in mine):
+                    # A nested call from inside this thread's own leader would wait on itself; run it
+                    # unregistered instead
+                    call = _Call(me)
+                    if key not in self._calls:
+                        self._calls[key] = call
+                    mine[key] = call
+                    led.append(i)
+                calls.append(call)
+        self._record(len(led), len(keys) - len(led))
+
+        if led:
+            try:
+                results = list(fn(led))
+                if len(results) != len(led):
+                    raise ValueError(f"Single-flight {self.name}: expected {len(led)} results, got {len(results)}")
+                for i, result in zip(led, results):
+                    calls[i].result = result
+            except BaseException as e:
+                for i in led:
+                    calls[i].error = e
+                raise
+            finally:
+                with self._lock:
+                    for i in led:
+                        if self._calls.get(keys[i]) is calls[i]:
+                            del self._calls[keys[i]]
+                for i in led:
+                    calls[i].done.set()
+
+        results = []
+        for i, call in enumerate(calls):
+            if not call.done.wait(deadlines.remaining()):
+                raise self._timed_out()
+            if call.error is not None and self._leader_ran_out(call.error):
+                results.append(self.do_many([keys[i]], lambda led, index=i: fn([index]))[0])
+                continue
+            if call.error is not None:
+                raise call.error
+            results.append(call.result)
+        return results
+
+
+# Marks a call whose leader was cancelled; its followers start the call again
+_ABANDONED = object()
+
+
+class AsyncSingleFlight(_FlightStats):
+    """Single-flight group for coroutines; calls on different event loops never share."""
+
+    def __init__(self, name: str = "default", enabled: bool = True):
+        super().__init__(name, enabled)
+        self._loops: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = weakref.WeakKeyDictionary()
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable], *args):
+        async def run(led: List[int]) -> List:
+            return [await fn(*args)]
+        return (await self.do_many([key], run))[0]
+
+    async def do_many(self, keys: Sequence[Hashable], fn: Callable[[List[int]], Awaitable[Sequence]]) -> List:
+        """Async form of SingleFlight.do_many; fn(indices) is awaited for the keys this task leads.
+
+        A cancelled leader does not cancel its followers: they start the call again, as they do
+        after a leader's DeadlineExceeded while their own deadline has budget left.
+        """
+        if not self.enabled:
+            return list(await fn(list(range(len(keys)))))
+        loop = asyncio.get_running_loop()
+        in_flight = self._loops.setdefault(loop, {})
+        me = asyncio.current_task()
+        futures: List[asyncio.Future] = []
+        led: List[int] = []
+        mine: Dict[Hashable, asyncio.Future] = {}
+        for i, key in enumerate(keys):
+            entry = mine.get(key) or in_flight.get(key)
+            if entry is None or (entry[0] is me and key not in mine):
+                entry = (me, loop.create_future())
+                if key not in in_flight:
+                    in_flight[key] = entry
+                mine[key] = entry
+                led.append(i)
+            futures.append(entry[1])
+        self._record(len(led), len(keys) - len(led))
+
+        if led:
+            try:
+                results = list(await fn(led))
+                if len(results) != len(led):
+                    raise ValueError(f"Single-flight {self.name}: expected {len(led)} results, got {len(results)}")
+                for i, result in zip(led, results):
+                    if not futures[i].done():
+                        futures[i].set_result(result)
+            except asyncio.CancelledError:
+                for i in led:
+                    if not futures[i].done():
+                        futures[i].set_result(_ABANDONED)
+                raise
+            except BaseException as e:
+                for i in led:
+                    if not futures[i].done():
+                        futures[i].set_exception(e)
+                        # Raised here already; followers still see it, but unawaited futures do not log it
+                        futures[i].exception()
+                raise
+            finally:
+                for i in led:
+                    entry = in_flight.get(keys[i])
+                    if entry is not None and entry[1] is futures[i]:
+                        del in_flight[keys[i]]
+
+        results = []
+        for i, future in enumerate(futures):
+            try:
+                # Shielded, so a cancelled or timed-out follower does not cancel the shared call
+                result = await asyncio.wait_for(asyncio.shield(future), deadlines.remaining())
+            except deadlines.DeadlineExceeded as e:
+                if not self._leader_ran_out(e):
+                    raise
+                result = _ABANDONED
+            except asyncio.TimeoutError:
+                raise self._timed_out() from None
+            if result is _ABANDONED:
+                async def retry(led: List[int], index: int = i) -> Sequence:
+                    return await fn([index])
+                result = (await self.do_many([keys[i]], retry))[0]
+            results.append(result)
+        return results
@@ -0,0 +1,100 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+# Fallback for responses that wrap the JSON in prose or markdown fences
+_JSON_OBJECT = re.compile(r'\{.*\}', re.DOTALL)
+
+
+class StreamingArrayParser:
+    """Incrementally scan a streamed JSON object and emit the elements of one top-level array.
+
+    Feed text chunks as they arrive; every element of ``array_key`` is returned from feed()
+    as soon as its closing bracket has been seen, long before the document is complete.
+    Text outside the outermost object (markdown fences, prose) is ignored.
+    """
+
+    def __init__(self, array_key: str = "food_items"):
+        self.array_key = array_key
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = -1
+        self._last_key: Optional[str] = None
+        self._in_array = False
+        self._element_start = -1
+        self._document_start = -1
+        self._document_end = -1
+        self.emitted = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Consume the next chunk and return any array elements it completed."""
+        if not chunk or self._document_end >= 0:
+            self._text += chunk or ""
+            return []
+        self._text += chunk
+        completed = []
+        text = self._text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        # A string directly inside the outer object is a key or a scalar value
+                        self._last_key = text[self._string_start + 1:pos]
+                continue
+
+            if char == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_start = pos
+            elif char in "{[":
+                if self._depth == 0:
+                    if char != "{":
+                        continue
+                    self._document_start = pos
+                elif self._depth == 1 and char == "[" and self._last_key == self.array_key:
+                    self._in_array = True
+                elif self._depth == 2 and self._in_array:
+                    self._element_start = pos
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0:
+                    continue
+                self._depth -= 1
+                if self._depth == 2 and self._in_array and self._element_start >= 0:
+                    completed.append(json.loads(text[self._element_start:pos + 1]))
+                    self._element_start = -1
+                elif self._depth == 1 and self._in_array:
+                    self._in_array = False
+                elif self._depth == 0:
+                    self._document_end = pos + 1
+                    self._pos = pos + 1
+                    break
+        else:
+            self._pos = len(text)
+        self.emitted += len(completed)
+        return completed
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    def result(self) -> Dict:
+        """Parse the complete document once the stream has ended."""
+        if self._document_start >= 0 and self._document_end > 0:
+            try:
+                return json.loads(self._text[self._document_start:self._document_end])
+            except json.JSONDecodeError:
+                pass
+        json_match = _JSON_OBJECT.search(self._text)
+        if not json_match:
+            raise ValueError("No JSON found in Gemini response")
+        return json.loads(json_match.group())
@@ -0,0 +1,150 @@
+import pytest
+
+from corrections import apply_corrections, parse_corrections
+
+
+def analysis():
+    return {"food_items": [
+        {"name": "Chapati", "cooking_method": "roasted", "estimated_quantity": "2 pieces", "estimated_weight_grams": 80},
+        {"name": "Steamed Basmati Rice", "cooking_method": "steamed", "estimated_quantity": "1 cup",
+         "estimated_weight_grams": 180},
+        {"name": "Tofu Curry", "cooking_method": "", "estimated_quantity": "1 serving", "estimated_weight_grams": 150},
+        {"name": "Grilled Chicken Breast", "cooking_method": "grilled", "estimated_quantity": "1 breast",
+         "estimated_weight_grams": 170},
+        {"name": "Masala Tea", "cooking_method": "", "estimated_quantity": "1 cup", "estimated_weight_grams": 240},
+        {"name": "Raita", "cooking_method": "raw", "estimated_quantity": "1 katori", "estimated_weight_grams": 150},
+    ]}
+
+
+def items_by_name(outcome):
+    return {item["name"]: item for item in outcome.analysis["food_items"]}
+
+
+@pytest.mark.parametrize("text, edits", [
+    ("2 chapatis", [("set", "chapatis", 2.0, None)]),
+    ("200g rice", [("set", "rice", 200.0, "g")]),
+    ("rice was 1.5 cups", [("set", "rice", 1.5, "cup")]),
+    ("half the dal", [("scale", "dal", 0.5)]),
+    ("half a chapati", [("set", "chapati", 0.5, None)]),
+    ("one more roti", [("increment", "roti", 1.0, None)]),
+    ("actually paneer instead of tofu", [("rename", "tofu", "paneer", None, None)]),
+    ("replace rice with quinoa", [("rename", "rice", "quinoa", None, None)]),
+    ("actually 3 instead of 2", [("recount", 2.0, 3.0)]),
+    ("3 rotis, not 2", [("set", "rotis", 3.0, None)]),
+    ("missing: raita and papad", [("add", "raita", None, None), ("add", "papad", None, None)]),
+    ("no raita", [("remove", "raita")]),
+    ("the salad wasn't there", [("remove", "salad")]),
+    ("the chicken was fried", [("method", "chicken", "fried")]),
+    ("chapati x3", [("set", "chapati", 3.0, None)]),
+])
+def test_grammar(text, edits):
+    parsed, unparsed = parse_corrections(text)
+    assert [edit for _, edit in parsed] == edits
+    assert unparsed == ()
+
+
+@pytest.mark.parametrize("text", ["it was less oily", "the portion looks bigger", "make it healthier"])
+def test_grammar_leaves_what_it_does_not_cover(text):
+    parsed, unparsed = parse_corrections(text)
+    assert parsed == () and unparsed == (text,)
+
+
+def test_quantities_rescale_weights():
+    outcome = apply_corrections(analysis(), "3 chapatis, rice was 1.5 cups, double the tofu curry")
+    items = items_by_name(outcome)
+    assert outcome.unparsed == "" and outcome.applied == 3
+    assert items["Chapati"]["estimated_weight_grams"] == 120
+    assert items["Chapati"]["estimated_quantity"] == "3 chapatis"
+    assert items["Steamed Basmati Rice"]["estimated_quantity"] == "1.5 cups"
+    assert items["Tofu Curry"]["estimated_weight_grams"] == 300
+
+
+def test_the_input_analysis_is_not_modified():
+    original = analysis()
+    apply_corrections(original, "3 chapatis, no raita")
+    assert original == analysis()
+
+
+def test_removal_of_a_listed_item():
+    outcome = apply_corrections(analysis(), "no raita")
+    assert outcome.unparsed == "" and "Raita" not in items_by_name(outcome)
+
+
+@pytest.mark.parametrize("text", ["No oil used", "I didn't eat the chicken skin", "no sugar in the tea"])
+def test_removals_that_match_no_item_go_to_gemini(text):
+    outcome = apply_corrections(analysis(), text)
+    assert outcome.unparsed == text.lower()
+    assert outcome.applied == 0
+    assert outcome.analysis["food_items"] == analysis()["food_items"]
+
+
+def test_removals_are_repeat_safe():
+    # The vision call already saw "no raita" and left it out
+    corrected = {"food_items": [item for item in analysis()["food_items"] if item["name"] != "Raita"]}
+    outcome = apply_corrections(corrected, "no raita", repeat_safe_only=True)
+    assert outcome.unparsed == "" and outcome.applied == 1
+
+
+def rice_and_fried_rice():
+    return {"food_items": [
+        {"name": "Rice", "cooking_method": "steamed", "estimated_quantity": "1 cup", "estimated_weight_grams": 180},
+        {"name": "Fried Rice", "cooking_method": "fried", "estimated_quantity": "1 plate",
+         "estimated_weight_grams": 250},
+        {"name": "Boiled Egg", "cooking_method": "boiled", "estimated_quantity": "2 eggs",
+         "estimated_weight_grams": 100},
+    ]}
+
+
+@pytest.mark.parametrize("text", ["no rice", "replace rice with quinoa"])
+def test_second_pass_leaves_items_sharing_a_token_alone(text):
+    first = apply_corrections(rice_and_fried_rice(), text)
+    assert first.applied == 1
+    second = apply_corrections(first.analysis, text, repeat_safe_only=True)
+    assert second.unparsed == ""
+    assert second.analysis["food_items"] == first.analysis["food_items"]
+
+
+def test_recounts_are_skipped_when_repeat_safe_only():
+    # The vision call already made the chapatis 3; the 2 eggs were never meant
+    corrected = {"food_items": [dict(analysis()["food_items"][0], estimated_quantity="3 pieces"),
+                                rice_and_fried_rice()["food_items"][2]]}
+    outcome = apply_corrections(corrected, "actually 3 instead of 2", repeat_safe_only=True)
+    assert outcome.applied == 0 and outcome.unparsed == ""
+    assert outcome.analysis["food_items"] == corrected["food_items"]
+
+
+def test_second_pass_still_applies_exact_removals_and_renames():
+    # The vision call ignored the corrections: the named items are still there
+    outcome = apply_corrections(rice_and_fried_rice(), "no rice, replace fried rice with quinoa",
+                                repeat_safe_only=True)
+    assert outcome.applied == 2
+    assert [item["name"] for item in outcome.analysis["food_items"]] == ["quinoa", "Boiled Egg"]
+
+
+def test_cooking_method_replaces_the_one_in_the_name():
+    items = items_by_name(apply_corrections(analysis(), "the chicken was deep fried"))
+    assert items["Chicken Breast"]["cooking_method"] == "deep fried"
+
+
+def test_cooking_method_keeps_a_matching_name():
+    items = items_by_name(apply_corrections(analysis(), "the rice was steamed"))
+    assert items["Steamed Basmati Rice"]["cooking_method"] == "steamed"
+
+
+def test_pronoun_method_needs_a_single_item():
+    single = {"food_items": [analysis()["food_items"][3]]}
+    assert items_by_name(apply_corrections(single, "it was fried"))["Chicken Breast"]["cooking_method"] == "fried"
+    assert apply_corrections(analysis(), "it was fried").unparsed == "it was fried"
+
+
+def test_additions_and_renames():
+    outcome = apply_corrections(analysis(), "add 2 papads, actually paneer instead of tofu")
+    items = items_by_name(outcome)
+    assert items["papads"]["user_added"] and items["papads"]["estimated_quantity"] == "2 papads"
+    assert "paneer Curry" not in items and items["paneer"]["correction_notes"] == "User corrected Tofu Curry to paneer"
+
+
+def test_relative_edits_are_skipped_when_repeat_safe_only():
+    outcome = apply_corrections(analysis(), "one more chapati, double the rice", repeat_safe_only=True)
+    assert outcome.applied == 0 and outcome.unparsed == ""
+    assert outcome.analysis["food_items"] == analysis()["food_items"]
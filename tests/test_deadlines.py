@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+import pytest
+
+from async_calorie_counter import AsyncAccurateCalorieCounter
+from calorie_counter import AccurateCalorieCounter
+import deadlines
+from deadlines import DeadlineExceeded, deadline_scope
+from nutrition_cache import LRUCache, TieredCache
+
+ITEMS = [{"name": "grilled salmon", "cooking_method": "grilled", "estimated_weight_grams": 120},
+         {"name": "jeera rice", "cooking_method": "", "estimated_weight_grams": 150}]
+RICE = {"food_name": "Rice, white, cooked", "calories": 130, "protein": 2.7, "fat": 0.3, "carbohydrates": 28,
+        "serving_size": 100, "serving_unit": "g", "data_source": "USDA"}
+
+
+def make_counter(cls, max_workers=6, search_delay=0.0):
+    counter = cls(usda_cache=TieredCache(LRUCache()), fdc_index=None, max_workers=max_workers)
+    counter.fdc_index = None
+    counter.estimate_nutrition_locally = lambda food_item: None
+    searches = []
+
+    def search(query):
+        searches.append(query)
+        time.sleep(search_delay)
+        # What search_usda_food raises once deadlines.timeout_for finds no budget left
+        raise DeadlineExceeded("No budget left for usda.search")
+
+    def estimate(food_items):
+        return [counter.get_default_nutrition_estimate(item["name"], item["estimated_weight_grams"])
+                for item in food_items]
+
+    if cls is AsyncAccurateCalorieCounter:
+        async def search_async(query):
+            return search(query)
+
+        async def estimate_async(food_items):
+            return estimate(food_items)
+        counter.search_usda_food, counter.estimate_nutrition_batch_with_gemini = search_async, estimate_async
+    else:
+        counter.search_usda_food, counter.estimate_nutrition_batch_with_gemini = search, estimate
+    return counter, searches
+
+
+def test_fetch_usda_nutrition_propagates_deadline_exceeded():
+    counter, searches = make_counter(AccurateCalorieCounter)
+    with pytest.raises(DeadlineExceeded):
+        counter.fetch_usda_nutrition("salmon", "grilled")
+    # The name-only retry is not attempted once the budget is gone
+    assert searches == ["grilled salmon"]
+
+
+@pytest.mark.parametrize("max_workers", [1, 6])
+def test_timed_out_lookups_degrade_their_items(max_workers):
+    counter, _ = make_counter(AccurateCalorieCounter, max_workers)
+    with deadline_scope(60_000):
+        resolved = dict(counter.iter_resolved_food_items(ITEMS))
+    assert [resolved[i].get("degraded") for i in range(len(ITEMS))] == ["usda_deadline"] * len(ITEMS)
+
+
+def test_resolve_food_item_degrades_on_deadline():
+    counter, _ = make_counter(AccurateCalorieCounter)
+    with deadline_scope(60_000):
+        assert counter.resolve_food_item(ITEMS[0])["degraded"] == "usda_deadline"
+
+
+def test_async_timed_out_lookups_degrade_their_items():
+    counter, _ = make_counter(AsyncAccurateCalorieCounter)
+    counter.remember_usda_result("jeera rice", RICE)
+
+    async def run():
+        with deadline_scope(60_000):
+            return {i: item async for i, item in counter.iter_resolved_food_items(ITEMS)}, \
+                await counter.resolve_food_item(ITEMS[0])
+
+    resolved, single = asyncio.run(run())
+    assert resolved[0]["degraded"] == "usda_deadline"
+    # The cached item still comes from USDA, undegraded
+    assert resolved[1]["data_source"] == "USDA" and "degraded" not in resolved[1]
+    assert single["degraded"] == "usda_deadline"
+
+
+def test_lookups_past_the_usda_deadline_are_abandoned():
+    counter, _ = make_counter(AccurateCalorieCounter, search_delay=0.5)
+    started = time.monotonic()
+    # 400 ms budget: USDA gets 200 ms, the other half is held back for estimates
+    with deadline_scope(400):
+        resolved = dict(counter.iter_resolved_food_items(ITEMS))
+    assert time.monotonic() - started < 0.45
+    assert all(item["degraded"] == "usda_deadline" for item in resolved.values())
+
+
+def test_consumer_that_stops_early_keeps_no_deadline():
+    counter, _ = make_counter(AccurateCalorieCounter)
+    seen, closed = [], []
+
+    def events(*args):
+        try:
+            seen.append(deadlines.remaining())
+            yield {"event": "items_identified", "food_items": []}
+            yield {"event": "complete", "result": {}}
+        finally:
+            closed.append(deadlines.remaining() is not None)
+
+    counter._iter_calories_from_image = events
+    stream = counter.iter_calories_from_image("meal.jpg", deadline_ms=1)
+    for event in stream:
+        break
+    assert seen[0] is not None
+    time.sleep(0.01)
+    assert deadlines.remaining() is None and not deadlines.expired()
+    stream.close()
+    # The pipeline is closed inside its own context, still under its deadline
+    assert closed == [True]
+    assert deadlines.remaining() is None
+
+
+def test_async_consumer_that_stops_early_keeps_no_deadline():
+    counter, _ = make_counter(AsyncAccurateCalorieCounter)
+    closed = []
+
+    async def events(*args):
+        try:
+            assert deadlines.remaining() is not None
+            yield {"event": "items_identified", "food_items": []}
+            await asyncio.sleep(0)
+            yield {"event": "complete", "result": {}}
+        finally:
+            closed.append(deadlines.remaining() is not None)
+
+    counter._iter_calories_from_image = events
+
+    async def consume():
+        stream = counter.iter_calories_from_image("meal.jpg", deadline_ms=1)
+        async for event in stream:
+            break
+        await asyncio.sleep(0.01)
+        # Later calls in this task still have no deadline
+        assert deadlines.remaining() is None and not deadlines.expired()
+        await stream.aclose()
+        assert deadlines.remaining() is None
+
+    asyncio.run(consume())
+    assert closed == [True]
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from fdc_index import FDCIndex, build_index, describes
+
+BREAST = "Chicken, broilers or fryers, breast, meat only, cooked, grilled"
+SOUP = "Soup, chicken noodle, canned, condensed"
+
+
+def fdc_food(fdc_id, description, calories):
+    return {"fdcId": fdc_id, "dataType": "SR Legacy", "description": description, "foodNutrients": [
+        {"nutrient": {"number": "208"}, "amount": calories}]}
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("fdc")
+    source = directory / "foods.json"
+    source.write_text(json.dumps({"SRLegacyFoods": [
+        fdc_food(1, BREAST, 151),
+        fdc_food(2, SOUP, 62),
+        fdc_food(3, "Fish, salmon, Atlantic, farmed, cooked, dry heat", 206),
+        fdc_food(4, "Pizza, no cheese, thin crust", 230),
+        fdc_food(5, "Pizza, cheese, regular crust", 266),
+    ]}))
+    build_index([source], directory / "foods.idx")
+    fdc_index = FDCIndex(directory / "foods.idx")
+    yield fdc_index
+    fdc_index.close()
+
+
+@pytest.mark.parametrize("query, description", [
+    ("grilled chicken salad", BREAST),
+    ("chicken", SOUP),
+    ("chicken noodle", SOUP),
+    ("cheese pizza", "Pizza, no cheese, thin crust"),
+    ("salmon salad", "Fish, salmon, Atlantic, farmed, raw"),
+])
+def test_descriptions_that_drop_or_change_a_word_do_not_describe_the_query(query, description):
+    assert not describes(query, description)
+
+
+@pytest.mark.parametrize("query, description", [
+    ("grilled chicken breast", BREAST),
+    ("grilled chiken breast", BREAST),
+    ("chicken noodle soup", SOUP),
+    ("salmon", "Fish, salmon, Atlantic, farmed, raw"),
+    ("apples", "Apples, raw, with skin"),
+])
+def test_descriptions_of_the_queried_food(query, description):
+    assert describes(query, description)
+
+
+def test_lookup_rejects_a_match_that_drops_a_word(index):
+    # Trigram overlap alone would accept the grilled breast
+    assert index.search("grilled chicken salad", limit=1)[0]["description"] == BREAST
+    assert index.search("grilled chicken salad", limit=1)[0]["score"] >= 0.6
+    assert index.lookup("grilled chicken salad") is None
+
+
+def test_lookup_skips_candidates_that_do_not_describe_the_query(index):
+    assert index.lookup("chicken")["food_name"] == BREAST
+    assert index.lookup("grilled chicken breast")["calories"] == 151
+    assert index.lookup("chicken noodle soup")["food_name"] == SOUP
+    assert index.lookup("cheese pizza")["calories"] == 266
+    assert index.lookup("salmon")["calories"] == 206
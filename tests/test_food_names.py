@@ -0,0 +1,48 @@
+import pytest
+
+from food_names import QueryIndex, canonical_query, edit_distance, tokens_align
+
+
+def index_of(*names):
+    index = QueryIndex()
+    for name in names:
+        index.add(canonical_query(name))
+    return index
+
+
+@pytest.mark.parametrize("query, indexed", [
+    ("chicken noodle", "chicken noodle soup"),
+    ("chicken fried rice soup", "chicken fried rice"),
+    ("chocolate cream", "chocolate ice cream"),
+    ("chicken curry rice", "chicken curry"),
+    ("grilled chicken salad", "grilled chicken caesar salad"),
+])
+def test_different_dishes_do_not_match(query, indexed):
+    assert index_of(indexed).match(canonical_query(query)) is None
+
+
+@pytest.mark.parametrize("query, indexed", [
+    ("grilled chiken breast", "grilled chicken breast"),
+    ("Chicken breasts, grilled", "grilled chicken breast"),
+    ("chicken tika masala", "chicken tikka masala"),
+])
+def test_typos_and_word_order_match(query, indexed):
+    match = index_of(indexed).match(canonical_query(query))
+    assert match is not None and match[0] == canonical_query(indexed)
+
+
+def test_short_words_need_an_exact_match():
+    # "ham" and "jam" are one edit apart but different foods
+    assert index_of("ham sandwich").match(canonical_query("jam sandwich"), min_score=0.5) is None
+
+
+def test_only_the_aligned_candidate_is_returned():
+    index = index_of("chicken noodle soup", "chicken noodles")
+    assert index.match(canonical_query("chiken noodle"), min_score=0.6)[0] == canonical_query("chicken noodle")
+
+
+def test_edit_distance_counts_transpositions_once():
+    assert edit_distance("chicken", "chikcen", 2) == 1
+    assert edit_distance("rice", "bread", 1) == 2
+    assert tokens_align(["breast", "chicken"], ["chicken", "breast"])
+    assert not tokens_align(["chicken"], ["chicken", "soup"])
@@ -0,0 +1,49 @@
+import json
+import os
+
+from food_table import (DEFAULT_FOOD_TABLE_PATH, FDC_FOOD_TABLE_PATH, FoodTable, import_fdc_foods, table_name,
+                        write_table)
+
+
+def fdc_food(fdc_id, data_type, description, calories, protein=1.0):
+    return {"fdcId": fdc_id, "dataType": data_type, "description": description, "foodNutrients": [
+        {"nutrient": {"number": "208"}, "amount": calories},
+        {"nutrient": {"number": "203"}, "amount": protein},
+    ]}
+
+
+def test_table_name_puts_the_detail_before_the_head():
+    assert table_name("Soup, chicken noodle, canned") == "chicken noodle soup"
+    assert table_name("Rice, fried, with chicken") == "fried rice with chicken"
+    assert table_name("Burrito, beef") == "beef burrito"
+    assert table_name("Apples, raw, with skin") == "apples with skin"
+
+
+def test_import_skips_excluded_and_repeated_names(tmp_path):
+    source = tmp_path / "fdc.json"
+    source.write_text(json.dumps({
+        "SRLegacyFoods": [fdc_food(3, "SR Legacy", "Soup, chicken noodle, canned, condensed", 60)],
+        "SurveyFoods": [fdc_food(1, "Survey (FNDDS)", "Soup, chicken noodle", 30),
+                        fdc_food(2, "Survey (FNDDS)", "Burrito, beef", 267),
+                        fdc_food(4, "Survey (FNDDS)", "Rice, white, cooked", 130)],
+    }))
+    curated = tmp_path / "curated.csv"
+    write_table([{"name": "white rice", "aliases": [], "category": "grain", "nutrients": {"calories": 130}}], curated)
+
+    entries = import_fdc_foods([source], exclude=[curated])
+    # FNDDS comes first, so its soup wins over the condensed SR Legacy one; white rice is already curated
+    assert [(entry["name"], entry["nutrients"]["calories"]) for entry in entries] == [
+        ("chicken noodle soup", 30), ("beef burrito", 267)]
+
+    table_path = tmp_path / "fdc.csv"
+    assert write_table(entries, table_path) == 2
+    table = FoodTable.load(os.pathsep.join([str(curated), str(table_path)]))
+    assert len(table) == 3
+    assert table.match("beef burrito")["nutrients"] == {"calories": 267.0, "protein": 1.0}
+
+
+def test_curated_table_wins_over_the_generated_one():
+    table = FoodTable.load([DEFAULT_FOOD_TABLE_PATH, FDC_FOOD_TABLE_PATH])
+    assert len(table) > 4000
+    assert table.match("vegetable soup")["category"] == "soup"
+    assert table.match("beef burrito")["name"] == "beef burrito"
@@ -0,0 +1,77 @@
+import time
+
+from nutrition_cache import AnalysisCache, LRUCache, SQLiteCache, TieredCache
+
+
+def test_disk_hit_is_promoted_with_its_remaining_ttl(tmp_path):
+    disk = SQLiteCache(tmp_path / "cache.sqlite", ttl_seconds=3600)
+    disk.set("miss", {"usda_miss": True}, ttl_seconds=0.2)
+    cache = TieredCache(LRUCache(ttl_seconds=30 * 24 * 3600), disk)
+
+    assert cache.get("miss") == {"usda_miss": True}
+    assert "miss" in cache.memory
+    time.sleep(0.3)
+    # The memory copy must expire with the disk entry, not live for the memory tier's 30 days
+    assert cache.memory.get("miss") is None
+    assert cache.get("miss") is None
+
+
+def test_get_with_expiry_reports_the_stored_expiry(tmp_path):
+    disk = SQLiteCache(tmp_path / "cache.sqlite", ttl_seconds=None)
+    disk.set("forever", 1)
+    disk.set("brief", 2, ttl_seconds=60)
+
+    assert disk.get_with_expiry("forever") == (1, None)
+    value, expires_at = disk.get_with_expiry("brief")
+    assert value == 2 and 0 < expires_at - time.time() <= 60
+    assert disk.get_with_expiry("absent", "default") == ("default", None)
+
+
+def test_expired_rows_are_purged_on_open(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    disk = SQLiteCache(path)
+    disk.set("stale", 1, ttl_seconds=0.01)
+    disk.set("fresh", 2)
+    time.sleep(0.05)
+
+    reopened = SQLiteCache(path)
+    assert len(reopened) == 1
+    assert reopened.get("fresh") == 2
+
+
+def test_row_count_is_capped_soonest_expiring_first(tmp_path):
+    disk = SQLiteCache(tmp_path / "cache.sqlite", max_entries=3, purge_interval=1)
+    for i in range(5):
+        disk.set(f"key{i}", i, ttl_seconds=100 + i)
+
+    assert len(disk) == 3
+    assert [disk.get(f"key{i}") for i in range(5)] == [None, None, 2, 3, 4]
+    assert disk.stats()["evictions"] == 2
+
+
+def phash_keys(cache):
+    rows = cache._disk._connection().execute("SELECT exact_key FROM analysis_phash ORDER BY created_at").fetchall()
+    return [row[0].split(":")[0] for row in rows]
+
+
+def test_perceptual_rows_are_capped_at_max_entries(tmp_path):
+    cache = AnalysisCache(tmp_path / "analysis.sqlite", max_entries=3)
+    for i in range(5):
+        cache.set(f"image{i}", "", {"food_items": []}, perceptual_hash=i)
+    assert phash_keys(cache) == ["image2", "image3", "image4"]
+
+
+def test_perceptual_rows_follow_their_exact_entries(tmp_path):
+    cache = AnalysisCache(tmp_path / "analysis.sqlite")
+    # Trim the exact tier on every write down to two analyses
+    cache._disk.max_entries, cache._disk.purge_interval = 2, 1
+    for i in range(4):
+        cache.set(f"image{i}", "", {"food_items": []}, perceptual_hash=i)
+    assert len(cache._disk) == 2
+    assert phash_keys(cache) == ["image2", "image3"]
+
+
+def test_expired_perceptual_rows_are_purged_on_open(tmp_path):
+    AnalysisCache(tmp_path / "analysis.sqlite", ttl_seconds=0.2).set("image", "", {"food_items": []}, perceptual_hash=1)
+    time.sleep(0.3)
+    assert phash_keys(AnalysisCache(tmp_path / "analysis.sqlite", ttl_seconds=0.2)) == []
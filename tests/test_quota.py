@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import calorie_counter
+from quota import BATCH, INTERACTIVE, QuotaScheduler, RateLimited, parse_rate, priority_scope
+
+
+def test_429_pauses_the_key_halves_its_rate_and_retries_elsewhere():
+    scheduler = QuotaScheduler("test", ["a", "b"], rate_per_second=100, burst=5)
+    used = []
+
+    def send(key):
+        used.append(key)
+        if key == "a":
+            raise RateLimited("429 Too Many Requests", retry_after=5)
+        return key
+
+    assert scheduler.call(send) == "b"
+    assert used == ["a", "b"]
+    key_a, key_b = scheduler.stats()["keys"]
+    assert 4 < key_a["paused_seconds"] <= 5 and key_a["rate_per_second"] == 50
+    assert key_b["paused_seconds"] == 0 and key_b["rate_per_second"] == 100
+    # While "a" is paused every call goes to "b"
+    assert [scheduler.call(lambda key: key) for _ in range(3)] == ["b", "b", "b"]
+
+
+def test_successes_win_the_rate_back():
+    scheduler = QuotaScheduler("test", ["a"], rate_per_second=100, burst=5)
+    scheduler.throttled(0, retry_after=0)
+    assert scheduler.stats()["keys"][0]["rate_per_second"] == 50
+    for _ in range(3):
+        scheduler.call(lambda key: key)
+    assert scheduler.stats()["keys"][0]["rate_per_second"] == 65
+
+
+def test_gives_up_after_max_retries():
+    scheduler = QuotaScheduler("test", ["a", "b"], max_retries=1)
+    calls = []
+
+    def send(key):
+        calls.append(key)
+        raise RateLimited(retry_after=0)
+
+    with pytest.raises(RateLimited):
+        scheduler.call(send)
+    assert calls == ["a", "b"]
+
+
+def test_interactive_calls_go_ahead_of_queued_batch_calls():
+    scheduler = QuotaScheduler("test", ["a"], rate_per_second=20, burst=1)
+    scheduler.acquire()
+    order = []
+
+    def caller(label, priority):
+        with priority_scope(priority):
+            scheduler.acquire()
+        order.append(label)
+
+    threads = []
+    for label, priority in [("batch1", BATCH), ("batch2", BATCH), ("interactive", INTERACTIVE)]:
+        threads.append(threading.Thread(target=caller, args=(label, priority)))
+        threads[-1].start()
+        # Queue them in this order
+        while scheduler.queue_depth() < len(threads):
+            time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "batch1", "batch2"]
+
+
+def test_async_waiters_follow_priority_too():
+    async def run():
+        scheduler = QuotaScheduler("test", ["a"], rate_per_second=20, burst=1)
+        scheduler.acquire()
+        order = []
+
+        async def caller(label, priority):
+            await scheduler.acquire_async(priority)
+            order.append(label)
+
+        tasks = []
+        for label, priority in [("batch", BATCH), ("interactive", INTERACTIVE)]:
+            tasks.append(asyncio.ensure_future(caller(label, priority)))
+            while scheduler.queue_depth() < len(tasks):
+                await asyncio.sleep(0.001)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "batch"]
+
+
+def test_parse_rate():
+    assert parse_rate("2000/min") == (2000 / 60, 2000)
+    assert parse_rate("1000/hour") == (1000 / 3600, 1000)
+    assert parse_rate("0") == (0, 0)
+    with pytest.raises(ValueError):
+        parse_rate("ten a minute")
+
+
+@pytest.fixture
+def fake_genai(monkeypatch):
+    def install(model_class):
+        monkeypatch.setattr(calorie_counter, "_genai", SimpleNamespace(GenerativeModel=model_class, __version__="x"))
+        monkeypatch.setattr(calorie_counter, "_gemini_pool_models", {})
+    return install
+
+
+class Model:
+    def __init__(self, name):
+        self._client = None
+        self._async_client = None
+
+
+def test_pool_model_gets_a_client_for_its_key(fake_genai):
+    fake_genai(Model)
+    model = calorie_counter.get_gemini_pool_model("key-1234")
+    assert type(model._client).__name__ == "GenerativeServiceClient"
+    assert calorie_counter.get_gemini_pool_model("key-1234") is model
+
+
+def test_async_pool_model_gets_its_client_on_the_running_loop(fake_genai):
+    fake_genai(Model)
+
+    async def run():
+        return calorie_counter.get_gemini_pool_model("key-1234", asynchronous=True)
+
+    model = asyncio.run(run())
+    assert type(model._async_client).__name__ == "GenerativeServiceAsyncClient"
+    assert model is not calorie_counter.get_gemini_pool_model("key-1234")
+
+
+def test_pool_model_warns_when_the_sdk_has_no_client_attribute(fake_genai, caplog):
+    fake_genai(lambda name: SimpleNamespace())
+    with caplog.at_level(logging.WARNING, logger="calorie_counter"):
+        model = calorie_counter.get_gemini_pool_model("key-5678")
+    assert not hasattr(model, "_client")
+    assert "pool key ...5678 use the default key" in caplog.text
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from deadlines import DeadlineExceeded, deadline_scope
+from instrumentation import submit_in_context
+from single_flight import AsyncSingleFlight, SingleFlight
+
+
+class Upstream:
+    """Blocks every call until released; the first call can be told to fail."""
+
+    def __init__(self, first_error=None):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.first_error = first_error
+
+    def __call__(self, query):
+        self.calls += 1
+        call = self.calls
+        self.started.set()
+        self.release.wait(5)
+        if call == 1 and self.first_error is not None:
+            raise self.first_error
+        return f"{query} #{call}"
+
+
+def leader_and_follower(flight, upstream, follower_deadline_ms=None):
+    """Start a leader, then a follower for the same key; returns both futures."""
+    pool = ThreadPoolExecutor(2)
+    leader = pool.submit(flight.do, "rice", upstream, "rice")
+    upstream.started.wait(5)
+
+    def follow():
+        with deadline_scope(follower_deadline_ms):
+            return flight.do("rice", upstream, "rice")
+    follower = submit_in_context(pool, follow)
+    while flight.stats()["deduplicated"] < 1:
+        time.sleep(0.001)
+    return pool, leader, follower
+
+
+def test_followers_share_the_result():
+    flight, upstream = SingleFlight("test"), Upstream()
+    pool, leader, follower = leader_and_follower(flight, upstream)
+    upstream.release.set()
+    assert leader.result() == follower.result() == "rice #1"
+    assert upstream.calls == 1
+    pool.shutdown()
+
+
+def test_followers_share_the_error():
+    flight, upstream = SingleFlight("test"), Upstream(ValueError("boom"))
+    pool, leader, follower = leader_and_follower(flight, upstream)
+    upstream.release.set()
+    for future in (leader, follower):
+        with pytest.raises(ValueError, match="boom"):
+            future.result()
+    assert upstream.calls == 1
+    pool.shutdown()
+
+
+def test_follower_wait_is_bounded_by_its_own_deadline():
+    flight, upstream = SingleFlight("test"), Upstream()
+    pool, leader, follower = leader_and_follower(flight, upstream, follower_deadline_ms=100)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        follower.result(5)
+    assert time.monotonic() - started < 1
+    upstream.release.set()
+    assert leader.result() == "rice #1"
+    pool.shutdown()
+
+
+def test_follower_with_budget_retries_after_the_leaders_deadline():
+    flight, upstream = SingleFlight("test"), Upstream(DeadlineExceeded("leader ran out"))
+    pool, leader, follower = leader_and_follower(flight, upstream, follower_deadline_ms=5000)
+    upstream.release.set()
+    with pytest.raises(DeadlineExceeded):
+        leader.result()
+    assert follower.result() == "rice #2"
+    assert upstream.calls == 2
+    pool.shutdown()
+
+
+class AsyncUpstream:
+    def __init__(self, first_error=None):
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.first_error = first_error
+
+    async def __call__(self, query):
+        self.calls += 1
+        call = self.calls
+        self.started.set()
+        await self.release.wait()
+        if call == 1 and self.first_error is not None:
+            raise self.first_error
+        return f"{query} #{call}"
+
+
+async def async_leader_and_follower(flight, upstream, follower_deadline_ms=None):
+    leader = asyncio.ensure_future(flight.do("rice", upstream, "rice"))
+    await upstream.started.wait()
+
+    async def follow():
+        with deadline_scope(follower_deadline_ms):
+            return await flight.do("rice", upstream, "rice")
+    follower = asyncio.ensure_future(follow())
+    while flight.stats()["deduplicated"] < 1:
+        await asyncio.sleep(0.001)
+    return leader, follower
+
+
+def test_async_followers_share_the_error():
+    async def run():
+        flight, upstream = AsyncSingleFlight("test"), AsyncUpstream(ValueError("boom"))
+        leader, follower = await async_leader_and_follower(flight, upstream)
+        upstream.release.set()
+        return await asyncio.gather(leader, follower, return_exceptions=True), upstream.calls
+
+    (leader, follower), calls = asyncio.run(run())
+    assert isinstance(leader, ValueError) and follower is leader
+    assert calls == 1
+
+
+def test_async_follower_wait_is_bounded_by_its_own_deadline():
+    async def run():
+        flight, upstream = AsyncSingleFlight("test"), AsyncUpstream()
+        leader, follower = await async_leader_and_follower(flight, upstream, follower_deadline_ms=100)
+        with pytest.raises(DeadlineExceeded):
+            await asyncio.wait_for(follower, 1)
+        upstream.release.set()
+        return await leader
+
+    assert asyncio.run(run()) == "rice #1"
+
+
+def test_async_follower_with_budget_retries_after_the_leaders_deadline():
+    async def run():
+        flight, upstream = AsyncSingleFlight("test"), AsyncUpstream(DeadlineExceeded("leader ran out"))
+        leader, follower = await async_leader_and_follower(flight, upstream, follower_deadline_ms=5000)
+        upstream.release.set()
+        with pytest.raises(DeadlineExceeded):
+            await leader
+        return await follower, upstream.calls
+
+    assert asyncio.run(run()) == ("rice #2", 2)
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import pytest
+
+import calorie_counter
+from async_calorie_counter import AsyncAccurateCalorieCounter
+from calorie_counter import AccurateCalorieCounter
+from nutrition_cache import LRUCache, SQLiteCache, TieredCache
+
+CHICKEN = {"food_name": "Chicken, broilers or fryers, meat only", "calories": 165, "data_source": "USDA"}
+
+
+def counter_with(cache, cls=AccurateCalorieCounter, searches=None):
+    counter = cls(usda_cache=cache, fdc_index=None)
+    counter.fdc_index = None
+
+    def search_usda_food(query):
+        searches.append(query)
+        return None
+
+    async def search_usda_food_async(query):
+        return search_usda_food(query)
+
+    counter.search_usda_food = search_usda_food_async if cls is AsyncAccurateCalorieCounter else search_usda_food
+    return counter
+
+
+@pytest.mark.parametrize("cls", [AccurateCalorieCounter, AsyncAccurateCalorieCounter])
+def test_name_only_retry_is_served_locally(cls):
+    searches = []
+    counter = counter_with(TieredCache(LRUCache()), cls, searches)
+    counter.remember_usda_result("chicken", CHICKEN)
+
+    items = [{"name": "chicken", "cooking_method": "grilled"}]
+    results = counter.fetch_usda_nutrition_many(items)
+    if asyncio.iscoroutine(results):
+        results = asyncio.run(results)
+
+    assert results == [CHICKEN]
+    # Only the detailed query went upstream; the bare name came from the cache
+    assert searches == ["grilled chicken"]
+
+
+def test_remembered_name_miss_skips_the_retry():
+    searches = []
+    counter = counter_with(TieredCache(LRUCache()), searches=searches)
+    counter.remember_usda_miss("chicken")
+
+    assert counter.fetch_usda_nutrition_many([{"name": "chicken", "cooking_method": "grilled"}]) == [None]
+    assert searches == ["grilled chicken"]
+
+
+def test_miss_expires_across_tiers(tmp_path, monkeypatch):
+    monkeypatch.setattr(calorie_counter, "USDA_MISS_TTL", 0.2)
+    path = tmp_path / "usda.sqlite"
+    writer = counter_with(TieredCache(LRUCache(), SQLiteCache(path)), searches=[])
+    writer.remember_usda_miss("dragon fruit")
+
+    # A fresh process sees the miss on disk and promotes it with what is left of its TTL
+    reader = counter_with(TieredCache(LRUCache(ttl_seconds=3600), SQLiteCache(path)), searches=[])
+    key = reader.usda_cache_key("dragon fruit")
+    assert reader.is_usda_miss(reader.usda_cache.get(key))
+    time.sleep(0.3)
+    assert reader.usda_cache.get(key) is None